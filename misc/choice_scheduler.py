@@ -0,0 +1,69 @@
+"""Learn weights for the choice points of a generated fuzzer from the coverage of a target program.
+
+The fuzzer records the option picked at every choice point of a sample (`ks_helper.trace`). Coverage is only known
+for windows of executions, the ones between two coverage collections, so every option is credited with the share of
+the samples of a window that picked it, and rewarded with the same share if the window found new lines. The weight of
+an option is its estimated chance of being in a window that finds new lines, plus a floor so that every option keeps
+being tried, times the weight it had before the run (the weights given in the definition, for example).
+"""
+import threading
+from collections import Counter
+from typing import Iterable, Mapping, Optional, Sequence
+
+DEFAULT_EXPLORATION = 0.1
+
+
+class ChoiceScheduler():
+    def __init__(self, choice_points: dict[str, tuple[str, Optional[int]]], exploration: float = DEFAULT_EXPLORATION,
+                 priors: Mapping[str, Sequence[float]] = {}) -> None:
+        if exploration <= 0:
+            raise ValueError("`exploration` must be greater than 0")
+        # Only choice points with a number of options known in advance get weights
+        self.n_options = {point: n_options for point, (_, n_options) in choice_points.items() if n_options is not None and n_options > 1}
+        self.exploration = exploration
+        self.priors = {point: list(weights) for point, weights in priors.items()
+                       if point in self.n_options and len(weights) == self.n_options[point]}
+        self.uses = {point: [0.0] * n_options for point, n_options in self.n_options.items()}
+        self.rewards = {point: [0.0] * n_options for point, n_options in self.n_options.items()}
+        # Index of a sample that was not rewarded yet -> options it picked
+        self.pending = {}
+        self.lines_executed = 0
+        self.n_windows = 0
+        self.n_productive_windows = 0
+        self.lock = threading.Lock()
+
+    def record(self, index: int, trace: Iterable[tuple[str, int]]) -> None:
+        """Record the options picked to generate sample `index`"""
+        with self.lock:
+            self.pending[index] = {(point, option) for point, option in trace if point in self.n_options}
+
+    def update(self, runs: int, lines_executed: int) -> None:
+        """Reward the options of the samples before sample `runs`, given the number of lines executed so far"""
+        with self.lock:
+            indices = [index for index in self.pending if index < runs]
+            if len(indices) == 0:
+                return
+            found_new_lines = lines_executed > self.lines_executed
+            self.lines_executed = max(self.lines_executed, lines_executed)
+            counts = Counter()
+            for index in indices:
+                counts.update(self.pending.pop(index))
+            for (point, option), count in counts.items():
+                if option >= self.n_options[point]:
+                    continue
+                share = count / len(indices)
+                self.uses[point][option] += share
+                if found_new_lines:
+                    self.rewards[point][option] += share
+            self.n_windows += 1
+            self.n_productive_windows += found_new_lines
+
+    def weights(self) -> dict[str, list[float]]:
+        """Get the weights of every choice point, options never picked get the weight of an even chance"""
+        with self.lock:
+            return {
+                point: [self.priors.get(point, [1.0] * n_options)[option]
+                        * (self.exploration + (self.rewards[point][option] + 1) / (self.uses[point][option] + 2))
+                        for option in range(n_options)]
+                for point, n_options in self.n_options.items()
+            }
@@ -0,0 +1,152 @@
+"""Collect the coverage of a target program built with `--coverage` while it is being run.
+
+The `.gcda` files written by the target are read with `gcov --json-format --stdout` every N executions or T seconds,
+in a background thread, so executions go on while gcov runs. The executed lines and branches are kept in memory as
+sets, so they only grow even if a `.gcda` file is read while the target is writing it. Every collection appends a row
+to a `runs,coverage_percent` CSV file, the format `plot.gp` reads.
+"""
+import fnmatch
+import json
+import os
+import subprocess
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable, List, NamedTuple, Optional
+
+CSV_HEADER = "runs,coverage_percent"
+DEFAULT_EVERY_N = 1000
+DEFAULT_EVERY_SECONDS = 60.0
+
+
+class CoverageSnapshot(NamedTuple):
+    runs: int
+    lines_executed: int
+    lines_total: int
+    branches_executed: int
+    branches_total: int
+
+    @staticmethod
+    def percent(executed: int, total: int) -> float:
+        return 0.0 if total == 0 else 100 * executed / total
+
+    @property
+    def line_percent(self) -> float:
+        return self.percent(self.lines_executed, self.lines_total)
+
+    @property
+    def branch_percent(self) -> float:
+        return self.percent(self.branches_executed, self.branches_total)
+
+
+class CoverageCollector():
+    """Coverage of the `.gcda` files found in `data_dirs`, excluding the source files whose name matches one of the
+    `exclude` patterns, such as `pngtest.*`"""
+
+    def __init__(self, data_dirs: List[str], csv_path: str, every_n: Optional[int] = DEFAULT_EVERY_N,
+                 every_seconds: Optional[float] = DEFAULT_EVERY_SECONDS, exclude: Iterable[str] = (), gcov: str = "gcov",
+                 on_collect: Optional[Callable[[CoverageSnapshot], None]] = None) -> None:
+        self.data_dirs = data_dirs
+        # Called with every snapshot, from the thread that collected it
+        self.on_collect = on_collect
+        self.every_n = every_n
+        self.every_seconds = every_seconds
+        self.exclude = list(exclude)
+        self.gcov = gcov
+        # Source file -> line numbers, and source file -> (line number, branch index)
+        self.lines = {}
+        self.executed_lines = {}
+        self.branches = {}
+        self.executed_branches = {}
+        self.snapshot: Optional[CoverageSnapshot] = None
+        self.runs = 0
+        self.last_runs = 0
+        self.last_time = time.monotonic()
+        self.pending: Optional[Future] = None
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="gcov")
+        self.csv_file = open(csv_path, "w")
+        self.csv_file.write(CSV_HEADER + "\n")
+        self.csv_file.flush()
+
+    def find_data_files(self) -> List[str]:
+        data_files = []
+        for data_dir in self.data_dirs:
+            for dir_path, _, file_names in os.walk(data_dir):
+                data_files.extend(os.path.join(dir_path, file_name) for file_name in file_names if file_name.endswith(".gcda"))
+        return sorted(data_files)
+
+    def is_excluded(self, source_path: str) -> bool:
+        file_name = os.path.basename(source_path)
+        return any(fnmatch.fnmatch(file_name, pattern) for pattern in self.exclude)
+
+    def add_report(self, report: dict) -> None:
+        """Add the JSON report of a single `.gcda` file"""
+        for source in report["files"]:
+            source_path = source["file"]
+            if self.is_excluded(source_path):
+                continue
+            lines = self.lines.setdefault(source_path, set())
+            executed_lines = self.executed_lines.setdefault(source_path, set())
+            branches = self.branches.setdefault(source_path, set())
+            executed_branches = self.executed_branches.setdefault(source_path, set())
+            for line in source["lines"]:
+                line_number = line["line_number"]
+                lines.add(line_number)
+                if line["count"] > 0:
+                    executed_lines.add(line_number)
+                for i, branch in enumerate(line["branches"]):
+                    branches.add((line_number, i))
+                    if branch["count"] > 0:
+                        executed_branches.add((line_number, i))
+
+    def collect(self, runs: int) -> CoverageSnapshot:
+        """Read the `.gcda` files now, and add a row to the CSV file"""
+        data_files = self.find_data_files()
+        if len(data_files) > 0:
+            # gcov writes one JSON report per line, one per data file
+            process = subprocess.run([self.gcov, "--json-format", "--stdout", "--branch-probabilities", *data_files],
+                                     stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=False)
+            for line in process.stdout.splitlines():
+                if len(line.strip()) == 0:
+                    continue
+                try:
+                    self.add_report(json.loads(line))
+                except (ValueError, KeyError):
+                    # A data file being written by the target, the next collection reads it again
+                    continue
+        self.snapshot = CoverageSnapshot(
+            runs,
+            sum(len(lines) for lines in self.executed_lines.values()),
+            sum(len(lines) for lines in self.lines.values()),
+            sum(len(branches) for branches in self.executed_branches.values()),
+            sum(len(branches) for branches in self.branches.values()),
+        )
+        self.csv_file.write(f"{runs},{self.snapshot.line_percent:.2f}\n")
+        self.csv_file.flush()
+        if self.on_collect is not None:
+            self.on_collect(self.snapshot)
+        return self.snapshot
+
+    def on_execution(self, *_) -> None:
+        """Count an execution, and start a collection in the background if it is due and none is running"""
+        self.runs += 1
+        if self.pending is not None and not self.pending.done():
+            return
+        due = self.every_n is not None and self.runs - self.last_runs >= self.every_n
+        due = due or (self.every_seconds is not None and time.monotonic() - self.last_time >= self.every_seconds)
+        if due:
+            if self.pending is not None:
+                # Raise the exception of the previous collection, if any
+                self.pending.result()
+            self.last_runs = self.runs
+            self.last_time = time.monotonic()
+            self.pending = self.executor.submit(self.collect, self.runs)
+
+    def close(self) -> CoverageSnapshot:
+        """Wait for the running collection, then collect the coverage of every execution unless it already did"""
+        if self.pending is not None:
+            self.pending.result()
+        self.executor.shutdown()
+        if self.snapshot is None or self.snapshot.runs != self.runs:
+            self.collect(self.runs)
+        self.csv_file.close()
+        return self.snapshot
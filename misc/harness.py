@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""Run a target program on the samples of a generated fuzzer and record how every execution ended.
+
+Samples are generated in batches in this process, from a master seed, and handed to a pool of workers which run the
+target on them, so sample k of a run can be regenerated with `output_fuzzer.py --seed <master seed> --index k`. The
+sample is written to the stdin of the target, or to a file whose path replaces `@@` in the target command.
+
+Example, from the directory of the `readpng` build:
+
+    python3 harness.py --fuzzer output_fuzzer.py --duration 86400 -- env LD_PRELOAD=../../.libs/libpng16.so ./readpng
+"""
+import argparse
+import importlib.util
+import itertools
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterator, List, NamedTuple, Optional
+
+from choice_scheduler import DEFAULT_EXPLORATION, ChoiceScheduler
+from gcov_collector import DEFAULT_EVERY_N, DEFAULT_EVERY_SECONDS, CoverageCollector
+
+FILE_PLACEHOLDER = "@@"
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_TIMEOUT = 5.0
+# Bytes of the stderr output of the target kept with a crashing sample
+MAX_STDERR_SIZE = 64 * 1024
+
+STATUS_OK = "ok"
+STATUS_FAILED = "failed"
+STATUS_CRASH = "crash"
+STATUS_TIMEOUT = "timeout"
+STATUSES = (STATUS_OK, STATUS_FAILED, STATUS_CRASH, STATUS_TIMEOUT)
+
+
+class Execution(NamedTuple):
+    """How the target ended on sample `index`. `returncode` is None on a timeout, negative if the target was killed by
+    a signal."""
+    index: int
+    status: str
+    returncode: Optional[int]
+    duration: float
+    size: int
+    stderr: bytes = b""
+
+    def to_record(self) -> dict[str, Any]:
+        record = {
+            "index": self.index,
+            "status": self.status,
+            "returncode": self.returncode,
+            "duration": round(self.duration, 6),
+            "size": self.size,
+        }
+        if self.returncode is not None and self.returncode < 0:
+            record["signal"] = signal.Signals(-self.returncode).name if -self.returncode in signal.valid_signals() else -self.returncode
+        return record
+
+
+def load_fuzzer(path: str):
+    """Import a generated fuzzer as a module"""
+    spec = importlib.util.spec_from_file_location("output_fuzzer", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def get_status(returncode: Optional[int]) -> str:
+    if returncode is None:
+        return STATUS_TIMEOUT
+    if returncode < 0:
+        return STATUS_CRASH
+    if returncode > 0:
+        return STATUS_FAILED
+    return STATUS_OK
+
+
+class Target():
+    """Target command, run once per sample"""
+
+    def __init__(self, command: List[str], timeout: Optional[float] = DEFAULT_TIMEOUT, work_dir: Optional[str] = None) -> None:
+        if len(command) == 0:
+            raise ValueError("The target command cannot be empty")
+        self.command = command
+        self.timeout = timeout
+        self.uses_file = any(FILE_PLACEHOLDER in arg for arg in command)
+        self.work_dir = work_dir
+
+    def run(self, index: int, sample: bytes) -> Execution:
+        command = self.command
+        stdin_data = sample
+        if self.uses_file:
+            sample_path = os.path.join(self.work_dir, f"{index}.bin")
+            with open(sample_path, "wb") as f:
+                f.write(sample)
+            command = [arg.replace(FILE_PLACEHOLDER, sample_path) for arg in command]
+            stdin_data = b""
+        start_time = time.monotonic()
+        try:
+            # The target gets its own process group, so a timeout also kills the processes it started
+            with subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, start_new_session=True) as process:
+                try:
+                    _, stderr = process.communicate(stdin_data, timeout=self.timeout)
+                    returncode = process.returncode
+                except subprocess.TimeoutExpired:
+                    os.killpg(process.pid, signal.SIGKILL)
+                    _, stderr = process.communicate()
+                    returncode = None
+        finally:
+            if self.uses_file:
+                os.unlink(sample_path)
+        duration = time.monotonic() - start_time
+        status = get_status(returncode)
+        return Execution(index, status, returncode, duration, len(sample), stderr[-MAX_STDERR_SIZE:] if status in (STATUS_CRASH, STATUS_TIMEOUT) else b"")
+
+
+class Report():
+    """Results of a run in `report_dir`:
+
+    executions.jsonl: One JSON object per execution, in sample order.
+    crashes/: The samples that crashed or timed out, `<index>.bin`, with the stderr output of the target, `<index>.stderr`.
+    summary.json: Number of executions per status, throughput and timing of the run, written by `close()`.
+    """
+
+    def __init__(self, report_dir: str, metadata: dict[str, Any]) -> None:
+        self.report_dir = report_dir
+        self.crash_dir = os.path.join(report_dir, "crashes")
+        os.makedirs(self.crash_dir, exist_ok=True)
+        self.metadata = metadata
+        self.executions_file = open(os.path.join(report_dir, "executions.jsonl"), "w")
+        self.counts = Counter()
+        self.total_duration = 0.0
+        self.max_duration = 0.0
+        self.start_time = time.monotonic()
+
+    @property
+    def n_executions(self) -> int:
+        return sum(self.counts.values())
+
+    def add(self, execution: Execution, sample: bytes) -> None:
+        self.counts[execution.status] += 1
+        self.total_duration += execution.duration
+        self.max_duration = max(self.max_duration, execution.duration)
+        self.executions_file.write(json.dumps(execution.to_record()) + "\n")
+        if execution.status in (STATUS_CRASH, STATUS_TIMEOUT):
+            with open(os.path.join(self.crash_dir, f"{execution.index}.bin"), "wb") as f:
+                f.write(sample)
+            with open(os.path.join(self.crash_dir, f"{execution.index}.stderr"), "wb") as f:
+                f.write(execution.stderr)
+
+    def summary(self) -> dict[str, Any]:
+        elapsed = time.monotonic() - self.start_time
+        n_executions = self.n_executions
+        return {
+            **self.metadata,
+            "executions": n_executions,
+            "statuses": {status: self.counts[status] for status in STATUSES},
+            "elapsed": round(elapsed, 3),
+            "executions_per_second": round(n_executions / elapsed, 3) if elapsed > 0 else None,
+            "mean_duration": round(self.total_duration / n_executions, 6) if n_executions > 0 else None,
+            "max_duration": round(self.max_duration, 6),
+        }
+
+    def close(self) -> dict[str, Any]:
+        self.executions_file.close()
+        summary = self.summary()
+        with open(os.path.join(self.report_dir, "summary.json"), "w") as f:
+            json.dump(summary, f, indent=2)
+            f.write("\n")
+        return summary
+
+
+def iter_traced_samples(fuzzer, seed: int, count: Optional[int], scheduler: ChoiceScheduler) -> Iterator[tuple[int, bytes]]:
+    """Generate `(index, sample)`, recording the options picked for every sample in `scheduler`"""
+    samples = fuzzer.generate(count, seed=seed)
+    for index in itertools.count():
+        fuzzer.ks_helper.trace = []
+        sample = next(samples, None)
+        trace, fuzzer.ks_helper.trace = fuzzer.ks_helper.trace, None
+        if sample is None:
+            return
+        scheduler.record(index, trace)
+        yield index, sample
+
+
+def iter_batches(fuzzer, seed: int, count: Optional[int], batch_size: int, deadline: Optional[float],
+                 scheduler: Optional[ChoiceScheduler] = None) -> Iterator[List[tuple[int, bytes]]]:
+    """Generate batches of `(index, sample)` until `count` samples were generated or `deadline` has passed"""
+    if scheduler is None:
+        samples = enumerate(fuzzer.generate(count, seed=seed))
+    else:
+        samples = iter_traced_samples(fuzzer, seed, count, scheduler)
+    while deadline is None or time.monotonic() < deadline:
+        batch = [item for _, item in zip(range(batch_size), samples)]
+        if len(batch) == 0:
+            return
+        yield batch
+
+
+def run(fuzzer, target: Target, report: Report, seed: int, count: Optional[int] = None, duration: Optional[float] = None,
+        jobs: int = 1, batch_size: int = DEFAULT_BATCH_SIZE, on_execution=None, scheduler: Optional[ChoiceScheduler] = None) -> None:
+    """Run `target` on the samples of `fuzzer` until `count` samples were run or `duration` seconds have passed.
+
+    Executions are added to `report` in sample order, and passed to `on_execution(execution, sample)` if given. The
+    options picked for every sample are recorded in `scheduler` if given.
+    """
+    deadline = None if duration is None else time.monotonic() + duration
+    with ThreadPoolExecutor(jobs) as pool:
+        # Bound the number of executions in flight so samples do not pile up in memory
+        pending = deque()
+        for batch in iter_batches(fuzzer, seed, count, batch_size, deadline, scheduler):
+            for index, sample in batch:
+                pending.append((pool.submit(target.run, index, sample), sample))
+            while len(pending) > 2 * max(jobs, batch_size):
+                finish(pending.popleft(), report, on_execution)
+        while len(pending) > 0:
+            finish(pending.popleft(), report, on_execution)
+
+
+def finish(item, report: Report, on_execution) -> None:
+    future, sample = item
+    execution = future.result()
+    report.add(execution, sample)
+    if on_execution is not None:
+        on_execution(execution, sample)
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run a target program on the samples of a generated fuzzer.",
+                                     usage="%(prog)s [options] -- target [args...]")
+    parser.add_argument("--fuzzer", default="output_fuzzer.py",
+                        help="Generated fuzzer. Defaults to `output_fuzzer.py`.")
+    parser.add_argument("-n", "--count", type=int, default=None,
+                        help="Number of samples to run. Unlimited by default.")
+    parser.add_argument("-t", "--duration", type=float, default=None,
+                        help="Number of seconds to run for. Unlimited by default.")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="Number of target processes run at once. Defaults to the number of CPUs.")
+    parser.add_argument("-s", "--seed", type=int, default=None,
+                        help="Master seed of the fuzzer. A random master seed is picked by default.")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"Number of samples generated at once. Defaults to {DEFAULT_BATCH_SIZE}.")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT,
+                        help=f"Number of seconds after which the target is killed. Defaults to {DEFAULT_TIMEOUT}.")
+    parser.add_argument("-r", "--report-dir", default="report",
+                        help="Directory of the report. Defaults to `report`.")
+    parser.add_argument("--coverage-dir", action="append", default=[],
+                        help="Directory searched for the `.gcda` files of a target built with `--coverage`. Can be repeated. "
+                        "The coverage is written to `coverage.csv` in the report directory.")
+    parser.add_argument("--coverage-every", type=int, default=DEFAULT_EVERY_N,
+                        help=f"Number of executions between two coverage collections. Defaults to {DEFAULT_EVERY_N}.")
+    parser.add_argument("--coverage-interval", type=float, default=DEFAULT_EVERY_SECONDS,
+                        help=f"Number of seconds between two coverage collections. Defaults to {DEFAULT_EVERY_SECONDS}.")
+    parser.add_argument("--coverage-exclude", action="append", default=[],
+                        help="Leave out the source files whose name matches this pattern, such as `pngtest.*`. Can be repeated.")
+    parser.add_argument("--choice-weights", default=None, metavar="FILE",
+                        help="JSON file giving the weights of the options of the choice points of the fuzzer, such as "
+                        "the `choice_weights.json` of a previous report.")
+    parser.add_argument("--feedback", action="store_true",
+                        help="Weight the options of the choice points of the fuzzer by how often they led to new "
+                        "coverage, requires `--coverage-dir`. The weights are written to `choice_weights.json` in the "
+                        "report directory. Samples can then no longer be regenerated from the seed and their index.")
+    parser.add_argument("--exploration", type=float, default=DEFAULT_EXPLORATION,
+                        help=f"Weight added to every option by `--feedback`, so every option keeps being tried. Defaults to {DEFAULT_EXPLORATION}.")
+    parser.add_argument("target", nargs=argparse.REMAINDER,
+                        help=f"Target command. The sample is written to its stdin, or to a file whose path replaces `{FILE_PLACEHOLDER}`.")
+    args = parser.parse_args(argv)
+    if len(args.target) > 0 and args.target[0] == "--":
+        args.target = args.target[1:]
+    if len(args.target) == 0:
+        parser.error("The target command is missing")
+    if args.count is None and args.duration is None:
+        parser.error("`--count` or `--duration` is required")
+    if args.count is not None and args.count < 0:
+        parser.error("`--count` cannot be negative")
+    if args.jobs < 1:
+        parser.error("`--jobs` cannot be less than 1")
+    if args.batch_size < 1:
+        parser.error("`--batch-size` cannot be less than 1")
+    if args.coverage_every < 1:
+        parser.error("`--coverage-every` cannot be less than 1")
+    if args.feedback and len(args.coverage_dir) == 0:
+        parser.error("`--feedback` requires `--coverage-dir`")
+    if args.exploration <= 0:
+        parser.error("`--exploration` must be greater than 0")
+    return args
+
+
+def main(argv: List[str]) -> int:
+    args = parse_args(argv)
+    if args.seed is None:
+        args.seed = random.SystemRandom().getrandbits(64)
+    fuzzer = load_fuzzer(args.fuzzer)
+    if args.choice_weights is not None:
+        with open(args.choice_weights, "r") as f:
+            fuzzer.ks_helper.update_choice_weights(json.load(f))
+    scheduler = None
+    if args.feedback:
+        if not hasattr(fuzzer, "CHOICE_POINTS"):
+            print("The fuzzer has no choice points, compile it again to use `--feedback`", file=sys.stderr)
+            return 2
+        scheduler = ChoiceScheduler(fuzzer.CHOICE_POINTS, exploration=args.exploration, priors=fuzzer.ks_helper.choice_weights)
+    metadata = {"fuzzer": os.path.abspath(args.fuzzer), "target": args.target, "seed": args.seed, "jobs": args.jobs, "timeout": args.timeout,
+                "feedback": args.feedback}
+    report = Report(args.report_dir, metadata)
+    collector = None
+    if len(args.coverage_dir) > 0:
+        on_collect = None
+        if scheduler is not None:
+            def on_collect(snapshot):
+                scheduler.update(snapshot.runs, snapshot.lines_executed)
+                fuzzer.ks_helper.update_choice_weights(scheduler.weights())
+        collector = CoverageCollector(args.coverage_dir, os.path.join(args.report_dir, "coverage.csv"), every_n=args.coverage_every,
+                                      every_seconds=args.coverage_interval, exclude=args.coverage_exclude, on_collect=on_collect)
+    with tempfile.TemporaryDirectory(prefix="harness-") as work_dir:
+        target = Target(args.target, timeout=args.timeout, work_dir=work_dir)
+        try:
+            run(fuzzer, target, report, args.seed, count=args.count, duration=args.duration, jobs=args.jobs, batch_size=args.batch_size,
+                on_execution=None if collector is None else collector.on_execution, scheduler=scheduler)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if collector is not None:
+                snapshot = collector.close()
+                report.metadata["coverage"] = {**snapshot._asdict(), "line_percent": round(snapshot.line_percent, 2),
+                                               "branch_percent": round(snapshot.branch_percent, 2)}
+            if scheduler is not None:
+                report.metadata["windows"] = scheduler.n_windows
+                report.metadata["productive_windows"] = scheduler.n_productive_windows
+                with open(os.path.join(args.report_dir, "choice_weights.json"), "w") as f:
+                    json.dump(scheduler.weights(), f, indent=2)
+                    f.write("\n")
+            summary = report.close()
+    print(f"Ran      : {summary['executions']} ({summary['executions_per_second']}/s, master seed {args.seed})")
+    print(f"Passed   : {summary['statuses'][STATUS_OK]}")
+    print(f"Failed   : {summary['statuses'][STATUS_FAILED]}")
+    print(f"Crashed  : {summary['statuses'][STATUS_CRASH]}")
+    print(f"Timed out: {summary['statuses'][STATUS_TIMEOUT]}")
+    if collector is not None:
+        print(f"Coverage : {snapshot.line_percent:.2f}% of {snapshot.lines_total} lines, {snapshot.branch_percent:.2f}% of {snapshot.branches_total} branches")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
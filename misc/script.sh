@@ -2,11 +2,8 @@
 
 BUILD_DIR='build'
 EXCLUDE_FILES="pnglibconf.* pngtest.* example.*"
-TEMP_FILE='/tmp/tempfile'
 REPORT_DIR='report'
 COVERAGE_REPORT="$REPORT_DIR/coverage.csv"
-TEST_TARGET_OUTPUT="$REPORT_DIR/test_target_out.txt"
-LAST_GCOV_OUTPUT="$REPORT_DIR/gcov_out.txt"
 GIT_STATUS="$REPORT_DIR/git.txt"
 TEST_COUNT=10000
 TEST_SECONDS=$(expr '24' '*' '60' '*' '60')
@@ -46,40 +43,24 @@ test() {
     cp output_fuzzer.py "$REPORT_DIR/"
     git log -1 > "$GIT_STATUS"
     git status >> "$GIT_STATUS"
-    echo 'runs,coverage_percent' > "$COVERAGE_REPORT"
-    SUCCESS=0
-    FAILED=0
-    RAN=0
-    TEST_START_TIME=$(date +%s)
-    TEST_END_TIME=$(expr $TEST_SECONDS '+' $TEST_START_TIME)
-    # for i in $(seq $TEST_COUNT)
-    while [ $(date +%s) -lt $TEST_END_TIME ]
+    # Run the target on samples until the time is up, collecting the coverage of libpng and readpng on the way.
+    # See harness.py for the report, the coverage is written to $COVERAGE_REPORT.
+    set -f
+    EXCLUDE_OPTIONS=""
+    for pattern in $EXCLUDE_FILES
     do
-        # echo $i
-        python3 output_fuzzer.py > test_file
-        LD_PRELOAD=../../.libs/libpng16.so ./readpng < test_file > "$TEMP_FILE" 2>&1
-        # LD_PRELOAD=../../.libs/libpng16.so ./pngtopng test_file /dev/null /tmp/tempfile 
-        if [ $? -eq 0 ]
-        then
-            SUCCESS=$(expr $SUCCESS + 1)
-        else
-            FAILED=$(expr $FAILED + 1)
-        fi
-        RAN=$(expr $RAN + 1)
-        cat "$TEMP_FILE" | tee /dev/tty >> "$TEST_TARGET_OUTPUT"
-        cd ../.. && \
-        prepare_cov $RAN $COVERAGE_REPORT && \
-        cd "$BUILD_DIR"/app
-        rm test_file "$TEMP_FILE"
+        EXCLUDE_OPTIONS="$EXCLUDE_OPTIONS --coverage-exclude $pattern"
     done
+    python3 ../../../harness.py --fuzzer output_fuzzer.py --duration "$TEST_SECONDS" --report-dir "$REPORT_DIR" \
+        --coverage-dir ../../.libs --coverage-dir . $EXCLUDE_OPTIONS -- \
+        env LD_PRELOAD=../../.libs/libpng16.so ./readpng
+    set +f
     rm output_fuzzer.py
     cd "../.."
     echo -e "${CYAN_BOLD}================================================${NC}"
     echo -e "${CYAN_BOLD}                  Test result                   ${NC}"
     echo -e "${CYAN_BOLD}================================================${NC}"
-    echo "🏃 Ran     : $RAN"
-    echo "🎉 Passed  : $SUCCESS"
-    echo "❌ Failed  : $FAILED"
+    cat "$BUILD_DIR/app/$REPORT_DIR/summary.json"
 }
 
 run() {
@@ -89,17 +70,6 @@ run() {
     cd ../..
 }
 
-prepare_cov() {
-    cp -P *.c "$BUILD_DIR"/app/
-    # cp -P *.h "$BUILD_DIR"/app/
-    cp -P .libs/*.gcda "$BUILD_DIR"/app/
-    cp -P .libs/*.gcno "$BUILD_DIR"/app/
-    cd "$BUILD_DIR"/app
-    rm -r $EXCLUDE_FILES
-    gcov *.c | tee "$LAST_GCOV_OUTPUT" | tail -n1 | tee /dev/tty | sed -e "s/^Lines executed:/$1,/" | sed -e 's/% of [0-9]*$//' >> $2
-    cd ../..
-}
-
 clean_cov() {
     rm -f *.gcda *.gcov
     cd .libs
@@ -133,5 +103,4 @@ then
     test
 else
     run
-    # prepare_cov
 fi
@@ -0,0 +1,137 @@
+import hashlib
+import random
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+# Number of samples whose recipe is remembered, the oldest ones are forgotten first
+MAX_RECIPES = 65536
+# Samples that went through more mutations are not mutated further, a new sample is generated instead
+MAX_MUTATIONS = 32
+DESCRIPTION = "ks-bin-fuzzer"
+
+
+class Recipe(NamedTuple):
+    """How to generate a sample again: the seed of the sample followed by the seed of every mutation applied to it,
+    and the object limit it was generated with (None if unlimited)"""
+    seeds: tuple[int, ...]
+    max_objects: Optional[int] = None
+
+
+class MutatorState():
+    def __init__(self, seed: int) -> None:
+        self.rng = random.Random(seed)
+        # Digest of a sample -> recipe of the sample, only for samples generated by this module
+        self.recipes = OrderedDict()
+        self.trim_recipe = None
+        self.trim_limits = []
+        self.trim_step = 0
+
+    @staticmethod
+    def get_key(buf: bytes | bytearray) -> bytes:
+        return hashlib.blake2b(buf, digest_size=16).digest()
+
+    def find_recipe(self, buf: bytes | bytearray) -> Optional[Recipe]:
+        return self.recipes.get(self.get_key(buf))
+
+    def add_recipe(self, buf: bytes, recipe: Recipe) -> None:
+        key = self.get_key(buf)
+        self.recipes[key] = recipe
+        self.recipes.move_to_end(key)
+        while len(self.recipes) > MAX_RECIPES:
+            self.recipes.popitem(last=False)
+
+
+state = None
+
+
+def count_objects(obj) -> int:
+    """Count the objects of an object tree"""
+    n_objects = 0
+    objects = [obj]
+    while len(objects) > 0:
+        obj = objects.pop()
+        n_objects += 1
+        for name in obj.__slots__:
+            value = getattr(obj, name, None)
+            if not name.startswith("_"):
+                objects.extend(item for item in (value if isinstance(value, list) else [value]) if hasattr(item, "__slots__"))
+    return n_objects
+
+
+def build(recipe: Recipe):
+    """Generate the sample of a recipe"""
+    limits = fuzzer.budget.limits
+    fuzzer.budget.configure(**{**limits, "max_objects": recipe.max_objects})
+    try:
+        fuzzer.ks_helper.seed(recipe.seeds[0])
+        sample = fuzzer.create_sample()
+        for seed in recipe.seeds[1:]:
+            fuzzer.ks_helper.seed(seed)
+            fuzzer.mutate_sample(sample)
+        return sample
+    finally:
+        fuzzer.budget.configure(**limits)
+
+
+def init(seed: int) -> None:
+    """Called once by AFL++ when the mutator is loaded"""
+    global state
+    state = MutatorState(seed)
+
+
+def deinit() -> None:
+    global state
+    state = None
+
+
+def fuzz(buf: bytearray, add_buf: Optional[bytearray], max_size: int) -> bytearray:
+    """Mutate `buf` if it is a sample generated by this module, by generating one of its fields again. Any other input
+    is replaced by a new sample. Samples longer than `max_size` are truncated."""
+    recipe = state.find_recipe(buf)
+    if recipe is None or len(recipe.seeds) > MAX_MUTATIONS:
+        recipe = Recipe((state.rng.getrandbits(64), ))
+    else:
+        recipe = recipe._replace(seeds=recipe.seeds + (state.rng.getrandbits(64), ))
+    output = build(recipe).result()
+    if len(output) > max_size:
+        # The truncated sample cannot be generated again
+        return bytearray(output[:max_size])
+    state.add_recipe(output, recipe)
+    return bytearray(output)
+
+
+def describe(max_description_length: int) -> str:
+    return DESCRIPTION[:max_description_length]
+
+
+def init_trim(buf: bytearray) -> int:
+    """Prepare to trim `buf`, get the number of trimming steps. Only samples generated by this module can be trimmed:
+    they are generated again from the same seeds with fewer and fewer objects, so loops end earlier."""
+    state.trim_recipe = state.find_recipe(buf)
+    state.trim_limits = []
+    state.trim_step = 0
+    if state.trim_recipe is None:
+        return 0
+    limit = count_objects(build(state.trim_recipe)) // 2
+    while limit > 0:
+        state.trim_limits.append(limit)
+        limit //= 2
+    return len(state.trim_limits)
+
+
+def trim() -> bytearray:
+    """Get the sample of the current trimming step"""
+    recipe = state.trim_recipe._replace(max_objects=state.trim_limits[state.trim_step])
+    output = build(recipe).result()
+    state.add_recipe(output, recipe)
+    return bytearray(output)
+
+
+def post_trim(success: bool) -> int:
+    """Called after AFL++ ran the trimmed sample, get the index of the next trimming step. Trimming goes on with fewer
+    objects while the trimmed samples behave the same, and stops at the first one that does not."""
+    if not success:
+        return len(state.trim_limits)
+    state.trim_recipe = state.trim_recipe._replace(max_objects=state.trim_limits[state.trim_step])
+    state.trim_step += 1
+    return state.trim_step
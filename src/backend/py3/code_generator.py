@@ -3,14 +3,18 @@ from backend.generator import Generator
 from backend.utils.indenter import Indenter
 import backend.py3.utils.sanitiser as sanitiser
 from utils.types import SeqEntry, VerboseEnumClassEntry, is_base_type
-from utils.const import KEY_WITH_EXPRESSION, KEY_WITH_EXPRESSION_PRODUCE_BYTES, OPERATORS
+from utils.const import KEY_WITH_EXPRESSION_REGEX
 from datastructure.dependency_graph import DependencyGraph
-from .value_code_generator import ValueCodeGenerator
+from datastructure.expression import parse_expression, get_attribute_path
+from .value_code_generator import ValueCodeGenerator, INT_TYPE
+from .expression_compiler import Python3ExpressionCompiler, get_constant_value
+from .include import KsHelper
 import re
+import struct
 
 from io import StringIO
 from pathlib import Path
-from typing import List, Any
+from typing import List, Any, Optional, Tuple
 import logging
 import sys
 
@@ -54,10 +58,15 @@ class Python3CodeGenerator(Generator):
         "f8be": ">d",
     }
 
-    def __init__(self, ir: IntermediateRepresentation, output: StringIO, is_entry_point: bool = False) -> None:
+    def __init__(self, ir: IntermediateRepresentation, output: StringIO, is_entry_point: bool = False, optimise: bool = True) -> None:
         self.ir = ir
         self.output = output
         self.is_entry_point = is_entry_point
+        # Hoist the work that does not change between the iterations of a loop, the samples are the same either way
+        self.optimise = optimise
+
+        # Compilers of the expressions, by type
+        self.expression_compilers = {}
 
         self.type_code_generator = ValueCodeGenerator(
             ks_helper_instance_name=self.KS_HELPER_INSTANCE)
@@ -83,131 +92,42 @@ class Python3CodeGenerator(Generator):
         fn_call += ")"
         return fn_call
 
+    def get_expression_compiler(self, class_name: str, available_ref: List[str], static_ref: List[str]) -> Python3ExpressionCompiler:
+        """Get the compiler of the expressions of a type, shared by every key of the type"""
+        key = (class_name, tuple(available_ref), tuple(static_ref))
+        if key not in self.expression_compilers:
+            self.expression_compilers[key] = Python3ExpressionCompiler(class_name, available_ref, static_ref)
+        return self.expression_compilers[key]
+
     @staticmethod
-    def _transpile_namespace(expression: str) -> str:
-        cleaned_expression = []
-        for ns in expression.split("::"):
-            ns = ns.strip()
-            if len(ns) <= 0:
-                continue
-            cleaned_expression.append(ns)
-        for i in range(len(cleaned_expression) - 1):
-            cleaned_expression[i] = sanitiser.sanitise_class_name(
-                cleaned_expression[i])
-        return ".".join(cleaned_expression)
+    def _str_tuple_literal(values: List[str]) -> str:
+        if len(values) == 1:
+            return f"(\"{values[0]}\", )"
+        return "(" + ", ".join(f"\"{value}\"" for value in values) + ")"
 
     @staticmethod
-    def _transpile_local_ref(class_name: str, available_ref: List[str], static_ref: List[str], expression: str) -> str:
-        cleaned_expression = []
-        for value in expression.split():
-            instance = "self"
-            if value in static_ref:
-                instance = class_name
-            if value in available_ref:
-                cleaned_expression.append(f"{instance}.{value}")
-            else:
-                cleaned_expression.append(value)
-        return " ".join(cleaned_expression)
-
-    @classmethod
-    def _transpile_local_ref_to_bytes(cls, class_name: str, available_ref: List[str], static_ref: List[str], expression: str) -> str:
-        expression = cls._transpile_local_ref(
-            class_name, available_ref, static_ref, expression)
-        cleaned_expression = []
-        for value in expression.split():
-            # "_" is a special variable, representing the previously parsed/generated object
-            if value.startswith("self.") or value.startswith("_."):
-                cleaned_expression.append(f"{value}_to_bytes()")
-            else:
-                cleaned_expression.append(value)
-        return " ".join(cleaned_expression)
+    def _bytes_expression_to_size(parts: Optional[List[str | bytes]]) -> Optional[str]:
+        """Turn the parts of an expression concatenating fields and literals into an expression adding up their sizes"""
+        if parts is None:
+            return None
+        sizes = [f"{part}_size()" for part in parts if isinstance(part, str)]
+        literal_size = sum(len(part) for part in parts if isinstance(part, bytes))
+        if literal_size > 0 or len(sizes) == 0:
+            sizes.append(f"{literal_size}")
+        return " + ".join(sizes)
 
     @staticmethod
-    def _transpile_ternary(expression: str) -> str:
-        # FIXME This is very hacky
-        last_quote_type = None
-        ternary_question_mark_pos = None
-        ternary_colon_pos = None
-        regex_result = re.search(r"\(.*\?.*:.*\)", expression)
-        condition = ""
-        if_true = ""
-        if_false = ""
-        if regex_result is not None:
-            ternary = regex_result.group(0).strip().strip("()")
-            condition, if_results = ternary.split("?", 1)
-            condition = condition.strip()
-            if_true, if_false = if_results.split(":", 1)
-            condition = condition.strip()
-            if_true = if_true.strip()
-            if_false = if_false.strip()
-            res = expression.replace(regex_result.group(0), f"( {if_true} if {condition} else {if_false} )")
-            return res
-        else:
-            for i, c in enumerate(expression):
-                if last_quote_type is None and (c == "\"" or c == "'"):
-                    if i > 0 and expression[i - 1] == "\\":
-                        # Escaped quote
-                        continue
-                    else:
-                        # Opening quote
-                        last_quote_type = c
-                        continue
-                elif last_quote_type == c:
-                    # Closing quote
-                    last_quote_type = None
-                    continue
-                if last_quote_type is None and c == "?":
-                    if ternary_question_mark_pos is None:
-                        ternary_question_mark_pos = i
-                    else:
-                        raise ValueError("Stray `?` in ternary?")
-                elif last_quote_type is None and ternary_question_mark_pos is not None and c == ":":
-                    if ternary_colon_pos is None:
-                        ternary_colon_pos = i
-                    else:
-                        raise ValueError("Stray `:` in ternary?")
-
-            if last_quote_type is not None:
-                raise ValueError("Unmatched quote in ternary")
-            elif ternary_question_mark_pos is None:
-                # Not a ternary
-                return expression
-            elif ternary_colon_pos is None:
-                raise ValueError("Invalid ternary syntax")
-
-            condition = expression[:ternary_question_mark_pos]
-            if_true = expression[ternary_question_mark_pos + 1: ternary_colon_pos]
-            if_false = expression[ternary_colon_pos + 1:]
-        return f"{if_true} if {condition} else {if_false}"
-
-    @classmethod
-    def _expression_transpiler(cls, class_name: str, available_ref: List[str], static_ref: List[str], expression: str, produce_bytes: bool = False) -> str:
+    def _bytes_expression_to_write_fns(parts: Optional[List[str | bytes]]) -> Optional[List[str]]:
+        """Turn the parts of an expression concatenating fields into the methods writing them, if it only has fields"""
+        if parts is None or not all(isinstance(part, str) for part in parts):
+            return None
+        return [f"{part}_write_to" for part in parts]
+
+    def _expression_transpiler(self, class_name: str, available_ref: List[str], static_ref: List[str], expression: str, produce_bytes: bool = False) -> str:
         # Do not process anything other than string (int, list etc.)
         if not isinstance(expression, str):
             return expression
-        expression = cls._transpile_ternary(expression)
-        result = []
-        for expression_component in expression.split(" "):
-            if expression_component in OPERATORS:
-                result.append(expression_component)
-                continue
-            expression_component = cls._transpile_namespace(
-                expression_component)
-            if expression_component.startswith("_root") or expression_component.startswith("(_root"):
-                expression_component = expression_component.replace(
-                    "_root", "self._root", 1)
-            elif expression_component.startswith("_parent") or expression_component.startswith("(_parent"):
-                expression_component = expression_component.replace(
-                    "_parent", "self._parent", 1)
-            if produce_bytes:
-                expression_component = cls._transpile_local_ref_to_bytes(
-                    class_name, available_ref, static_ref, expression_component)
-            else:
-                expression_component = cls._transpile_local_ref(
-                    class_name, available_ref, static_ref, expression_component)
-            result.append(expression_component)
-        result = " ".join(result)
-        return result
+        return self.get_expression_compiler(class_name, available_ref, static_ref).compile(expression, produce_bytes)
 
     # def _process_expression_in_seq(self):
     #     pass
@@ -232,6 +152,19 @@ class Python3CodeGenerator(Generator):
                 # Add 2 new lines after every include
                 self.output.write("\n\n")
 
+    @staticmethod
+    def generate_afl_mutator(fuzzer_module_name: str) -> str:
+        """Generate an AFL++ Python custom mutator module, which generates and mutates samples with the generated fuzzer
+        module `fuzzer_module_name`"""
+        with open(Path(__file__).parent / "afl" / "custom_mutator.py", "r") as f:
+            mutator_code = f.read()
+        return "".join([
+            f"# AFL++ custom mutator of the `{fuzzer_module_name}` fuzzer\n",
+            "import importlib\n",
+            f"fuzzer = importlib.import_module(\"{fuzzer_module_name}\")\n",
+            mutator_code,
+        ])
+
     def write_class(self) -> None:
         meta_val = self.ir.source["meta"]
         doc_val = self.ir.source["doc"]
@@ -240,9 +173,10 @@ class Python3CodeGenerator(Generator):
         available_ref = self.ir.source["_available_ref"]
         static_ref = self.ir.source["_static_ref"]
         dependency_graph = self.ir.source["_dependency_graph"]
+        object_ref = self.ir.source["_object_ref"]
         self.output.writelines(
             self.generate_class(meta_val, seq_val, instances_val, doc_val,
-                                available_ref, static_ref, dependency_graph)
+                                available_ref, static_ref, dependency_graph, object_ref)
         )
 
     def write_enums(self) -> None:
@@ -277,44 +211,95 @@ class Python3CodeGenerator(Generator):
             enum_int_id = enum_val["id"]
             indenter.append_line(f"{enum_int_id} = {enum_int_key}", code)
         indenter.reset()
+        indenter.append_line("", code)
+        indenter.append_line(f"{ValueCodeGenerator.get_enum_values_var_name(enum_name)} = tuple({enum_name})", code)
         indenter.append_line("\n", code)
         return code
 
-    def generate_class_static_var(self, seq: List[SeqEntry], class_name: str, instances: dict[dict[str, Any]], available_ref: List[str], static_ref: List[str]) -> List[str]:
-        """Handle static variable for a type, such as those using `-fz-order`"""
-        indenter = Indenter(add_newline=True)
-        code = []
+    @staticmethod
+    def get_choice_point_id(class_name: str, entry_name: str, is_count: bool = False) -> str:
+        """ID of the choice point of a field, given to `KsHelper` so it can weight and trace the decisions made there"""
+        return f"{class_name}.{entry_name}.count" if is_count else f"{class_name}.{entry_name}"
+
+    @staticmethod
+    def get_options_var_name(entry_name: str) -> str:
+        """Name of the constant holding every value of a `-fz-random-order` or `-fz-choice` list, in the order of its
+        options"""
+        return f"_{entry_name}_options"
+
+    @staticmethod
+    def has_constant_choices(seq_entry: SeqEntry) -> bool:
+        """Check if the `-fz-choice` list of a field only holds literals, values of an enum can be defined after the
+        class using them"""
+        return "-fz-choice" in seq_entry and "enum" not in seq_entry and "repeat" not in seq_entry \
+            and "-fz-random-order" not in seq_entry and "-fz-order" not in seq_entry
+
+    @staticmethod
+    def get_order_var_name(entry_name: str) -> str:
+        """Name of the static variable holding the values left for a field using `-fz-order` or `-fz-random-order`,
+        it cannot share the name of the field since the field is a slot"""
+        return f"_{entry_name}_order"
+
+    def get_slots(self, seq: List[SeqEntry], instances: dict[str, dict[str, Any]]) -> List[str]:
+        """Get the attributes of an instance: the fields, and the attributes used to serialise it"""
+        slots = ["_parent", "_root", "_depth", "_io", "_cached", "_bytes_cache"]
+        slots.extend(seq_entry["id"] for seq_entry in seq)
+        slots.extend(instance_name for instance_name, instance_entry in instances.items() if not instance_entry["-fz-static"])
+        return slots
+
+    def get_class_static_var(self, seq: List[SeqEntry], class_name: str, instances: dict[dict[str, Any]], available_ref: List[str], static_ref: List[str]) -> List[tuple[str, str]]:
+        """Get the name and the initial value of the static variables for a type, such as those using `-fz-order`"""
+        static_var = []
         # Handle seq entry
         for seq_entry in seq:
             generate_order = seq_entry.get("-fz-order")
             if generate_order is not None and len(generate_order) > 0:
-                entry_name = seq_entry["id"]
-                indenter.append_line(f"{entry_name} = {generate_order}", code)
+                if self.optimise:
+                    # Values are taken from the end of the list, which does not move the values left
+                    generate_order = list(reversed(generate_order))
+                static_var.append((self.get_order_var_name(seq_entry["id"]), f"{generate_order}"))
             generate_random_order = seq_entry.get("-fz-random-order")
             if generate_random_order is not None and len(generate_random_order) > 0:
-                entry_name = seq_entry["id"]
-                indenter.append_line(
-                    f"{entry_name} = {generate_random_order}", code)
+                static_var.append((self.get_order_var_name(seq_entry["id"]), f"{generate_random_order}"))
         # Handle instances
         for instance_name, instance_entry in instances.items():
             if instance_entry["-fz-static"]:
                 val = self._expression_transpiler(
                     class_name, available_ref, static_ref, instance_entry["value"])
-                indenter.append_line(f"{instance_name} = {val}", code)
-        code.append("")
-        return code
+                static_var.append((instance_name, f"{val}"))
+        return static_var
 
-    def generate_class_init_method(self, class_name: str, seq: List[SeqEntry], instances: dict[str, dict[str, Any]], available_ref: List[str], static_ref: List[str], dependency_graph: DependencyGraph) -> List[str]:
+    def generate_class_static_var(self, seq: List[SeqEntry], class_name: str, instances: dict[dict[str, Any]], available_ref: List[str], static_ref: List[str]) -> List[str]:
+        """Handle static variable for a type, such as those using `-fz-order`"""
         indenter = Indenter(add_newline=True)
         code = []
-        indenter.append_lines([
-            "def __init__(self, _parent=None, _root=None) -> None:",
-            "    self._parent = _parent",
-            "    self._root = _root if _root is not None else self",
-            "    self._io = SeekableBuffer()",
-            "    self._cached = False",
-        ], code)
-        indenter.indent()
+        static_var = self.get_class_static_var(seq, class_name, instances, available_ref, static_ref)
+        for seq_entry in seq:
+            generate_random_order = seq_entry.get("-fz-random-order")
+            if generate_random_order is not None and len(generate_random_order) > 0:
+                indenter.append_line(f"{self.get_options_var_name(seq_entry['id'])} = {tuple(generate_random_order)}", code)
+            elif self.has_constant_choices(seq_entry):
+                # Built once instead of on every call
+                indenter.append_line(f"{self.get_options_var_name(seq_entry['id'])} = {tuple(seq_entry['-fz-choice'])}", code)
+        for var_name, val in static_var:
+            indenter.append_line(f"{var_name} = {val}", code)
+        code.append("")
+        if len(static_var) > 0:
+            # Static variables are consumed while generating, restore them before generating another sample
+            indenter.append_lines([
+                "@classmethod",
+                "def _reset_static(cls) -> None:",
+            ], code)
+            indenter.indent()
+            for var_name, val in static_var:
+                indenter.append_line(f"cls.{var_name} = {val}", code)
+            indenter.unindent()
+            indenter.append_line("", code)
+        return code
+
+    def generate_field_code(self, class_name: str, seq: List[SeqEntry], instances: dict[str, dict[str, Any]], available_ref: List[str], static_ref: List[str], dependency_graph: DependencyGraph) -> dict[str, List[str]]:
+        """Generate the code setting every field, in the order the fields have to be generated"""
+        field_code = {}
         # Generate data for each field taking into account dependencies on each other
         for dependency_node in dependency_graph.linearise_graph():
             seq_entry = None
@@ -333,16 +318,83 @@ class Python3CodeGenerator(Generator):
             if seq_entry is None and instance_entry is None:
                 raise ValueError(
                     f"Invalid reference `{dependency_node.data}`.")
-        # for seq_entry in seq:
             if seq_entry is not None:
-                indenter.append_lines(self.generate_seq_entry(
-                    class_name, seq_entry, available_ref, static_ref), code)
+                field_code[seq_entry["id"]] = self.generate_seq_entry(
+                    class_name, seq_entry, available_ref, static_ref)
             if instance_entry is not None and not instance_entry["-fz-static"]:
-                indenter.append_lines(self.generate_instance_entry(
-                    class_name, instance_name, instance_entry, available_ref, static_ref), code)
+                field_code[instance_name] = self.generate_instance_entry(
+                    class_name, instance_name, instance_entry, available_ref, static_ref)
+        return field_code
+
+    def generate_class_init_method(self, field_code: dict[str, List[str]]) -> List[str]:
+        indenter = Indenter(add_newline=True)
+        code = []
+        indenter.append_lines([
+            "def __init__(self, _parent=None, _root=None) -> None:",
+            "    self._parent = _parent",
+            "    self._root = _root if _root is not None else self",
+            "    self._depth = 0 if _parent is None else _parent._depth + 1",
+            "    budget.n_objects += 1",
+            "    self._io = SeekableBuffer()",
+            "    self._cached = False",
+            "    self._bytes_cache = {}",
+        ], code)
+        indenter.indent()
+        for code_lines in field_code.values():
+            # Copy, `append_lines` indents the lines in place
+            indenter.append_lines(list(code_lines), code)
         indenter.append_line("", code)
         return code
 
+    def is_mutable_seq_entry(self, seq_entry: SeqEntry) -> bool:
+        """Check if a field can be generated again on its own, fields computed from other fields or taken from a static
+        variable cannot"""
+        if seq_entry["-fz-static"] or seq_entry.get("contents") is not None:
+            return False
+        for key in seq_entry:
+            if key in ("valid", "-fz-attr-len", "-fz-order", "-fz-random-order", "-fz-increment") or key.startswith("-fz-process-"):
+                return False
+        return True
+
+    def generate_mutation_var(self, seq: List[SeqEntry], dependency_graph: DependencyGraph, object_ref: dict[str, List[Tuple[str, ...]]], field_code: dict[str, List[str]]) -> List[str]:
+        """Generate the class attributes used to generate fields again in mutation mode: the fields that can be
+        generated again, the fields that have to be generated again after a field changes, and the fields of other
+        objects each field is generated from"""
+        indenter = Indenter(add_newline=True)
+        code = []
+        mutable_fields = [seq_entry["id"] for seq_entry in seq if seq_entry["id"] in field_code and self.is_mutable_seq_entry(seq_entry)]
+        order = dependency_graph.get_order()
+        indenter.append_line(f"_mutable_fields = {self._str_tuple_literal(mutable_fields)}", code)
+        indenter.append_line("_dependents = {", code)
+        indenter.indent()
+        for node in dependency_graph.nodes:
+            dependents = [dependee.data for dependee in dependency_graph.get_dependees(node, order) if dependee.data in field_code]
+            if node.data in field_code and len(dependents) > 0:
+                indenter.append_line(f"\"{node.data}\": {self._str_tuple_literal(dependents)},", code)
+        indenter.unindent()
+        indenter.append_line("}", code)
+        indenter.append_line("_object_ref = {", code)
+        indenter.indent()
+        for field_name in order:
+            if field_name in field_code and field_name in object_ref:
+                paths = ", ".join(self._str_tuple_literal(list(path)) for path in object_ref[field_name])
+                indenter.append_line(f"\"{field_name}\": ({paths}, ),", code)
+        indenter.unindent()
+        indenter.append_lines(["}", ""], code)
+        return code
+
+    def generate_field_generate_method(self, field_code: dict[str, List[str]]) -> List[str]:
+        """Generate a method per field that generates the field again"""
+        indenter = Indenter(add_newline=True)
+        code = []
+        for field_name, code_lines in field_code.items():
+            indenter.append_line(f"def _generate_{field_name}(self) -> None:", code)
+            indenter.indent()
+            indenter.append_lines(list(code_lines), code)
+            indenter.unindent()
+            indenter.append_line("", code)
+        return code
+
     def generate_seq_to_bytes_method(self, seq: List[SeqEntry]) -> List[str]:
         indenter = Indenter(add_newline=True)
         code = []
@@ -350,10 +402,19 @@ class Python3CodeGenerator(Generator):
             enum_name = seq_entry.get("enum")
             process_key = seq_entry.get("process")
             entry_name = f"{seq_entry['id']}"  # FIXME sanitise name?
-            indenter.append_lines(
-                [f"def {entry_name}_to_bytes(self) -> bytes:"], code)
-            indenter.indent()
             self_entry_name = f"self.{seq_entry['id']}"
+            # Serialise a field at most once, unless it is assigned another value
+            indenter.append_lines([
+                f"def {entry_name}_to_bytes(self) -> bytes:",
+                f"    value, result = self._bytes_cache.get(\"{entry_name}\", (None, None))",
+                f"    if result is None or value is not {self_entry_name}:",
+                f"        result = self._serialise_{entry_name}()",
+                f"        self._bytes_cache[\"{entry_name}\"] = ({self_entry_name}, result)",
+                "    return result",
+                "",
+                f"def _serialise_{entry_name}(self) -> bytes:",
+            ], code)
+            indenter.indent()
             process_fn_prepend, process_fn_append = ("", "")
             if process_key is not None:
                 process_fn_prepend = f"{process_key}_("
@@ -377,37 +438,311 @@ class Python3CodeGenerator(Generator):
                 get_byte_method = f"{item}.result()"
             elif entry_type in self.NUM_TYPE_STRUCT_PACK_FORMAT_MAP:
                 get_byte_method = f"struct.pack(\"{self.NUM_TYPE_STRUCT_PACK_FORMAT_MAP[entry_type]}\", {item})"
+            elif self.type_code_generator.is_str_as_bytes(**seq_entry):
+                # Already encoded
+                get_byte_method = item
             elif entry_type == "str" or entry_type == "strz":
                 get_byte_method = f"{item}.encode(encoding=\"{seq_entry['encoding'].lower()}\")"
             elif entry_type is None:
-                get_byte_method = f"{item}"
+                # May be lazily generated random bytes
+                get_byte_method = f"bytes({item})"
             else:
                 # Custom type
                 get_byte_method = f"{item}.result()"
 
             # Handle `repeat` key
-            if "repeat" in seq_entry:
-                indenter.append_lines([
-                    "result = b''",
-                    f"for entry_instance in {self_entry_name}:",
-                    f"    result += {get_byte_method}",
-                    f"return {process_fn_prepend}result{process_fn_append}",
-                ], code)
+            if self.type_code_generator.can_generate_array(**seq_entry):
+                byteorder = "big" if entry_type.endswith("be") else "little"
+                indenter.append_line(
+                    f"return {process_fn_prepend}{self.KS_HELPER_INSTANCE}.array_to_bytes({self_entry_name}, \"{byteorder}\"){process_fn_append}", code)
+            elif "repeat" in seq_entry and is_base_type(entry_type) and entry_type in self.NUM_TYPE_STRUCT_PACK_FORMAT_MAP:
+                # Pack every item with a single call
+                pack_format = self.NUM_TYPE_STRUCT_PACK_FORMAT_MAP[entry_type]
+                byteorder_format, item_format = pack_format[:-1], pack_format[-1]
+                items = f"*{self_entry_name}"
+                if enum_name is not None:
+                    items = f"*(entry_instance.value for entry_instance in {self_entry_name})"
+                indenter.append_line(
+                    f"return {process_fn_prepend}struct.pack(f\"{byteorder_format}{{len({self_entry_name})}}{item_format}\", {items}){process_fn_append}", code)
+            elif "repeat" in seq_entry:
+                indenter.append_line(
+                    f"return {process_fn_prepend}b\"\".join({get_byte_method} for entry_instance in {self_entry_name}){process_fn_append}", code)
             else:
                 indenter.append_line(f"return {process_fn_prepend}{get_byte_method}{process_fn_append}", code)
             indenter.append_line("", code)
             indenter.unindent()
         return code
 
-    def generate_fz_process_code(self, fz_process_key: str, class_name: str, seq_entry: SeqEntry) -> List[str]:
+    def get_seq_entry_size(self, seq_entry: SeqEntry) -> int | str:
+        """Get the size in bytes of a field that is set, as a constant if it is known at compile time, otherwise as an
+        expression. The field is only serialised if its size depends on the data."""
+        entry_name = seq_entry["id"]
+        entry_type = seq_entry["type"]
+        self_entry_name = f"self.{entry_name}"
+        is_repeat = "repeat" in seq_entry
+        if "process" in seq_entry:
+            return f"len({self_entry_name}_to_bytes())"
+        constant_bytes = self.get_constant_bytes(seq_entry)
+        if constant_bytes is not None:
+            return len(constant_bytes)
+        if isinstance(entry_type, dict):
+            is_custom_type = all(not is_base_type(case_type) for case_type in entry_type["cases"].values())
+        else:
+            is_custom_type = not is_base_type(entry_type)
+        if is_base_type(entry_type) and entry_type in self.NUM_TYPE_STRUCT_PACK_FORMAT_MAP:
+            item_size = struct.calcsize(self.NUM_TYPE_STRUCT_PACK_FORMAT_MAP[entry_type])
+            return f"len({self_entry_name}) * {item_size}" if is_repeat else item_size
+        if is_custom_type:
+            item_size = "entry_instance._size()"
+        elif entry_type is None or (entry_type in ("str", "strz") and self.type_code_generator.is_str_len_n_bytes(**seq_entry)):
+            item_size = "len(entry_instance)"
+        else:
+            return f"len({self_entry_name}_to_bytes())"
+        if is_repeat:
+            return f"sum({item_size} for entry_instance in {self_entry_name})"
+        return item_size.replace("entry_instance", self_entry_name)
+
+    def generate_seq_size_method(self, seq: List[SeqEntry]) -> List[str]:
+        """Generate a method per field, and one for the whole object, computing the size in bytes without serialising"""
+        indenter = Indenter(add_newline=True)
+        code = []
+        constant_size = 0
+        field_sizes = []
+        for seq_entry in seq:
+            entry_name = seq_entry["id"]
+            entry_size = self.get_seq_entry_size(seq_entry)
+            indenter.append_lines([
+                f"def {entry_name}_size(self) -> int:",
+                f"    if self.{entry_name} is None:",
+                "        return 0",
+                f"    return {entry_size}",
+                "",
+            ], code)
+            if isinstance(entry_size, int) and "if" not in seq_entry:
+                constant_size += entry_size
+            else:
+                field_sizes.append(f"self.{entry_name}_size()")
+        indenter.append_lines([
+            "def _size(self) -> int:",
+            "    if self._cached:",
+            "        return len(self._io)",
+            f"    return {' + '.join([str(constant_size)] + field_sizes)}",
+            "",
+        ], code)
+        return code
+
+    def get_constant_bytes(self, seq_entry: SeqEntry) -> Optional[bytes]:
+        """Get the serialised bytes of a field that has the same value in every sample (`contents`, or a number with a
+        constant `valid`), None if the value of the field can change"""
+        if seq_entry["-fz-static"]:
+            return None
+        for key in seq_entry:
+            if key in ("if", "repeat", "process", "enum", "-fz-attr-len") or key.startswith("-fz-process-"):
+                return None
+        entry_type = seq_entry["type"]
+        if entry_type is None and seq_entry.get("contents") is not None:
+            return self.type_code_generator.get_fixed_contents(seq_entry["contents"])
+        valid = seq_entry.get("valid")
+        if not isinstance(entry_type, str) or entry_type not in INT_TYPE or entry_type not in self.NUM_TYPE_STRUCT_PACK_FORMAT_MAP or valid is None:
+            return None
+        if isinstance(valid, str):
+            # The expression may already be transpiled, a constant expression is transpiled to its value either way
+            valid = get_constant_value(valid)
+        if not isinstance(valid, int) or isinstance(valid, bool):
+            return None
+        try:
+            return struct.pack(self.NUM_TYPE_STRUCT_PACK_FORMAT_MAP[entry_type], valid)
+        except struct.error:
+            return None
+
+    def is_fusable_seq_entry(self, seq_entry: SeqEntry) -> bool:
+        """Check if a field is a single fixed size number, or a constant, which can be packed together with its
+        neighbours"""
+        if self.get_constant_bytes(seq_entry) is not None:
+            return True
+        entry_type = seq_entry["type"]
+        if not is_base_type(entry_type) or entry_type not in self.NUM_TYPE_STRUCT_PACK_FORMAT_MAP:
+            return False
+        for key in seq_entry:
+            if key in ("if", "repeat", "process") or key.startswith("-fz-process-"):
+                return False
+        return True
+
+    def get_fusable_pack_format(self, seq_entry: SeqEntry) -> str:
+        """Constants are packed as bytes serialised at compile time, so they do not constrain the byte order"""
+        constant_bytes = self.get_constant_bytes(seq_entry)
+        if constant_bytes is not None:
+            return f"{len(constant_bytes)}s"
+        return self.NUM_TYPE_STRUCT_PACK_FORMAT_MAP[seq_entry["type"]]
+
+    def group_seq_entries(self, seq: List[SeqEntry]) -> List[List[SeqEntry]]:
+        """Group runs of consecutive fields that can be packed with a single `struct.Struct`, fields that cannot be
+        packed together are in a group of their own"""
+        groups = []
+        group_byteorder = None
+        for seq_entry in seq:
+            if not self.is_fusable_seq_entry(seq_entry):
+                groups.append([seq_entry])
+                group_byteorder = None
+                continue
+            pack_format = self.get_fusable_pack_format(seq_entry)
+            byteorder = pack_format[0] if pack_format[0] in "<>" else None
+            can_join = (len(groups) > 0 and self.is_fusable_seq_entry(groups[-1][-1])
+                        and (byteorder is None or group_byteorder is None or byteorder == group_byteorder))
+            if can_join:
+                groups[-1].append(seq_entry)
+            else:
+                groups.append([seq_entry])
+                group_byteorder = None
+            if byteorder is not None:
+                group_byteorder = byteorder
+        return groups
+
+    def get_fused_struct_format(self, group: List[SeqEntry]) -> str:
+        byteorder = "<"  # Only matters for the byte order, all groups use standard sizes without padding
+        item_formats = []
+        for seq_entry in group:
+            pack_format = self.get_fusable_pack_format(seq_entry)
+            if pack_format[0] in "<>":
+                byteorder, pack_format = pack_format[0], pack_format[1:]
+            item_formats.append(pack_format)
+        return byteorder + "".join(item_formats)
+
+    def is_constant_group(self, group: List[SeqEntry]) -> bool:
+        return all(self.get_constant_bytes(seq_entry) is not None for seq_entry in group)
+
+    def get_packed_groups(self, class_name: str, seq: List[SeqEntry]) -> List[tuple[List[SeqEntry], str]]:
+        """Group the fields, and get the expression serialising every group of fields that is packed together: the bytes
+        precomputed at compile time for a group of constants, or a call to the precompiled `struct.Struct` of the group.
+        The expression is None for a field that is serialised on its own."""
+        groups = []
+        struct_index = 0
+        template_index = 0
+        for group in self.group_seq_entries(seq):
+            if self.is_constant_group(group):
+                groups.append((group, f"{class_name}._template_{template_index}"))
+                template_index += 1
+            elif len(group) > 1:
+                groups.append((group, f"{class_name}._fused_struct_{struct_index}.pack({self.generate_fused_pack_args(group)})"))
+                struct_index += 1
+            else:
+                groups.append((group, None))
+        return groups
+
+    def generate_fused_struct_var(self, seq: List[SeqEntry]) -> List[str]:
+        """Generate a class attribute holding the precomputed bytes of every group of constants, and a precompiled
+        `struct.Struct` for every other group of fields packed together"""
+        indenter = Indenter(add_newline=True)
+        code = []
+        struct_index = 0
+        template_index = 0
+        for group in self.group_seq_entries(seq):
+            if self.is_constant_group(group):
+                template = b"".join(self.get_constant_bytes(seq_entry) for seq_entry in group)
+                indenter.append_line(f"_template_{template_index} = {template!r}", code)
+                template_index += 1
+            elif len(group) > 1:
+                indenter.append_line(f"_fused_struct_{struct_index} = struct.Struct(\"{self.get_fused_struct_format(group)}\")", code)
+                struct_index += 1
+        if len(code) > 0:
+            indenter.append_line("", code)
+        return code
+
+    def generate_fused_pack_args(self, group: List[SeqEntry]) -> str:
+        """Generate the arguments packing a group of fields with its precompiled `struct.Struct`, constants are passed
+        as bytes literals"""
+        values = []
+        for seq_entry in group:
+            constant_bytes = self.get_constant_bytes(seq_entry)
+            if constant_bytes is not None:
+                values.append(repr(constant_bytes))
+                continue
+            value = f"self.{seq_entry['id']}"
+            if "enum" in seq_entry:
+                value = f"{value}.value"
+            values.append(value)
+        return ", ".join(values)
+
+    def get_seq_entry_write_code(self, seq_entry: SeqEntry) -> List[str]:
+        """Get the code writing a field that is set to `sink`, nested objects and large byte fields are streamed instead
+        of being serialised in memory first"""
+        entry_name = seq_entry["id"]
+        entry_type = seq_entry["type"]
+        is_custom_type = isinstance(entry_type, dict) or not is_base_type(entry_type)
+        if "process" in seq_entry or not (is_custom_type or entry_type is None):
+            # Processed fields and numbers/strings are small enough, or need to be serialised as a whole anyway
+            return [f"sink.write(self.{entry_name}_to_bytes())"]
+        write_fn = "entry_instance.write_to(sink)" if is_custom_type else f"{self.KS_HELPER_INSTANCE}.write_bytes(sink, entry_instance)"
+        if "repeat" in seq_entry:
+            return [
+                f"for entry_instance in self.{entry_name}:",
+                f"    {write_fn}",
+            ]
+        return [write_fn.replace("entry_instance", f"self.{entry_name}")]
+
+    def generate_seq_write_to_method(self, seq: List[SeqEntry]) -> List[str]:
+        """Generate a method per field writing it to a sink, bytes that are already serialised are reused"""
+        indenter = Indenter(add_newline=True)
+        code = []
+        for seq_entry in seq:
+            entry_name = seq_entry["id"]
+            indenter.append_lines([
+                f"def {entry_name}_write_to(self, sink) -> None:",
+                f"    value, result = self._bytes_cache.get(\"{entry_name}\", (None, None))",
+                f"    if result is not None and value is self.{entry_name}:",
+                "        sink.write(result)",
+                f"    elif self.{entry_name} is not None:",
+            ], code)
+            indenter.indent(2)
+            indenter.append_lines(self.get_seq_entry_write_code(seq_entry), code)
+            indenter.unindent(2)
+            indenter.append_line("", code)
+        return code
+
+    def generate_write_to_method(self, class_name: str, seq: List[SeqEntry]) -> List[str]:
+        """Generate a method that writes the serialised object to a sink field by field"""
+        indenter = Indenter(add_newline=True)
+        code = indenter.apply([
+            "def write_to(self, sink) -> None:",
+            "    if self._cached:",
+            "        with self._io.get_full_view() as view:",
+            "            sink.write(view)",
+            "        return",
+        ])
+        indenter.indent()
+        for group, packed_code in self.get_packed_groups(class_name, seq):
+            if packed_code is not None:
+                indenter.append_line(f"sink.write({packed_code})", code)
+                continue
+            seq_entry = group[0]
+            write_code = self.get_seq_entry_write_code(seq_entry)
+            if "if" in seq_entry:
+                # Expression already parsed when we generate data for the field, no need to parse again
+                indenter.append_line(f"if {seq_entry['if']}:", code)
+                indenter.indent()
+                indenter.append_lines(write_code, code)
+                indenter.unindent()
+            else:
+                indenter.append_lines(write_code, code)
+        indenter.unindent()
+        indenter.append_line("", code)
+        return code
+
+    def generate_fz_process_code(self, fz_process_key: str, expression_compiler: Python3ExpressionCompiler, seq_entry: SeqEntry) -> List[str]:
         indenter = Indenter(add_newline=True)
         code = []
         entry_name = seq_entry["id"]
         expression = seq_entry[fz_process_key]
         if fz_process_key in self.CHECKSUM_FN_NAME_MAP.keys():
             fn_name = self.CHECKSUM_FN_NAME_MAP[fz_process_key]
-            indenter.append_line(
-                f"self.{entry_name} = {fn_name}({expression})", code)
+            write_fns = self._bytes_expression_to_write_fns(expression_compiler.compile_bytes_parts(expression))
+            if write_fns is not None:
+                # Feed the fields into the checksum one by one, without concatenating them first
+                indenter.append_line(
+                    f"self.{entry_name} = digest(\"{fn_name}\", {', '.join(write_fns)})", code)
+            else:
+                indenter.append_line(
+                    f"self.{entry_name} = {fn_name}({expression_compiler.compile(expression, produce_bytes=True)})", code)
         else:
             raise ValueError(f"Unknown key: '{fz_process_key}'")
         return code
@@ -418,12 +753,12 @@ class Python3CodeGenerator(Generator):
         indenter.indent()
         for match_value, type_name in cases.items():
             indenter.append_lines([
-                f"case {self._transpile_namespace(match_value)}:",
+                f"case {match_value}:",
                 f"    {assign_to} = {self.type_code_generator.generate_code(type=type_name)}",
             ], code)
         return code
 
-    def generate_class(self, meta: dict[str, Any], seq: List[SeqEntry], instances: dict[str, dict[str, Any]], doc: str, available_ref: List[str], static_ref: List[str], dependency_graph: DependencyGraph) -> List[str]:
+    def generate_class(self, meta: dict[str, Any], seq: List[SeqEntry], instances: dict[str, dict[str, Any]], doc: str, available_ref: List[str], static_ref: List[str], dependency_graph: DependencyGraph, object_ref: dict[str, List[Tuple[str, ...]]]) -> List[str]:
         class_name = sanitiser.sanitise_class_name(meta["id"])
         self.logger.debug(f"Generating class \"{class_name}\"")
         indenter = Indenter(add_newline=True)
@@ -433,11 +768,20 @@ class Python3CodeGenerator(Generator):
         indenter.indent()
         if len(doc) > 0:
             indenter.append_lines(self.generate_doc(doc), code)
+        indenter.append_lines([
+            f"__slots__ = {self._str_tuple_literal(self.get_slots(seq, instances))}",
+            "",
+        ], code)
         indenter.append_lines(self.generate_class_static_var(
             seq, class_name, instances, available_ref, static_ref), code)
-        indenter.append_lines(
-            self.generate_class_init_method(class_name, seq, instances, available_ref, static_ref, dependency_graph), code)
+        indenter.append_lines(self.generate_fused_struct_var(seq), code)
+        field_code = self.generate_field_code(class_name, seq, instances, available_ref, static_ref, dependency_graph)
+        indenter.append_lines(self.generate_mutation_var(seq, dependency_graph, object_ref, field_code), code)
+        indenter.append_lines(self.generate_class_init_method(field_code), code)
+        indenter.append_lines(self.generate_field_generate_method(field_code), code)
         indenter.append_lines(self.generate_seq_to_bytes_method(seq), code)
+        indenter.append_lines(self.generate_seq_size_method(seq), code)
+        indenter.append_lines(self.generate_seq_write_to_method(seq), code)
 
         indenter.append_lines([
             "def result(self) -> bytes:",
@@ -446,7 +790,12 @@ class Python3CodeGenerator(Generator):
             "        return self._io.get_data()",  # Return bytes using pointer,
         ], code)
         indenter.indent()
-        for seq_entry in seq:
+        for group, packed_code in self.get_packed_groups(class_name, seq):
+            if packed_code is not None:
+                # Pack consecutive numbers and constants with a single call
+                indenter.append_line(f"self._io.append({packed_code})", code)
+                continue
+            seq_entry = group[0]
             # FIXME sanitise name?
             to_bytes_fn = f"self.{seq_entry['id']}_to_bytes()"
             if "if" in seq_entry:
@@ -468,9 +817,11 @@ class Python3CodeGenerator(Generator):
         ], code)
         indenter.unindent()
 
+        indenter.append_lines(self.generate_write_to_method(class_name, seq), code)
+
         indenter.append_lines([
             "def __len__(self) -> int:",
-            "    return len(self.result())",
+            "    return self._size()",
         ], code)
         indenter.reset()
         indenter.append_line("\n", code)
@@ -479,31 +830,31 @@ class Python3CodeGenerator(Generator):
 
     def generate_seq_entry(self, class_name: str, seq_entry: SeqEntry, available_ref: List[str], static_ref: List[str]) -> List[str]:
         entry_name = f"{seq_entry['id']}"  # FIXME sanitise name?
+        choice_point = self.get_choice_point_id(class_name, entry_name)
         self.logger.debug(f"Generating seq entry \"{entry_name}\"")
         indenter = Indenter(add_newline=True)
         code = []
 
+        expression_compiler = self.get_expression_compiler(class_name, available_ref, static_ref)
+        # Expressions of the items of a repeat, with the loop invariants hoisted, compiled before the entry is processed
+        loop_entry, hoisted_chains = seq_entry, {}
+        if self.optimise and "repeat" in seq_entry:
+            loop_entry, hoisted_chains = self.compile_loop_entry(expression_compiler, seq_entry)
         fz_process_key = None
-        # Process expression
+        # Process expression, the expressions producing bytes are compiled where they are used, from their parts
         for key in seq_entry.keys():
-            for regex_key in KEY_WITH_EXPRESSION:
-                if re.fullmatch(regex_key, key) is not None:
-                    seq_entry[key] = self._expression_transpiler(
-                        class_name, available_ref, static_ref, seq_entry[key])
-            for regex_key in KEY_WITH_EXPRESSION_PRODUCE_BYTES:
-                if re.fullmatch(regex_key, key) is not None:
-                    seq_entry[key] = self._expression_transpiler(
-                        class_name, available_ref, static_ref, seq_entry[key], produce_bytes=True)
+            if KEY_WITH_EXPRESSION_REGEX.fullmatch(key) is not None:
+                seq_entry[key] = self._expression_transpiler(
+                    class_name, available_ref, static_ref, seq_entry[key])
             if re.fullmatch(r"\-fz\-process\-.+", key):
                 fz_process_key = key
         # Process expression in a `type` block
         if isinstance(seq_entry["type"], dict):
             type_block: dict = seq_entry["type"]
             for key in type_block.keys():
-                for regex_key in KEY_WITH_EXPRESSION:
-                    if re.fullmatch(regex_key, key) is not None:
-                        type_block[key] = self._expression_transpiler(
-                            class_name, available_ref, static_ref, type_block[key])
+                if KEY_WITH_EXPRESSION_REGEX.fullmatch(key) is not None:
+                    type_block[key] = self._expression_transpiler(
+                        class_name, available_ref, static_ref, type_block[key])
             if "switch-on" in type_block:
                 new_cases = dict()
                 for k, v in type_block["cases"].items():
@@ -519,79 +870,136 @@ class Python3CodeGenerator(Generator):
             indenter.indent()
         if "-fz-attr-len" in seq_entry:
             expression = seq_entry["-fz-attr-len"]
+            size_expression = self._bytes_expression_to_size(expression_compiler.compile_bytes_parts(expression))
+            if size_expression is None:
+                size_expression = f"len({expression_compiler.compile(expression, produce_bytes=True)})"
             indenter.append_line(
-                f"self.{entry_name} = len({expression})",
+                f"self.{entry_name} = {size_expression}",
                 code
             )
+        elif self.type_code_generator.can_generate_array(**seq_entry):
+            # Generate all items with a single call
+            if seq_entry["repeat"] == "expr":
+                n_items = f'int({seq_entry["repeat-expr"]})'
+            else:
+                n_items = "repeat_n_times"
+                count_point = self.get_choice_point_id(class_name, entry_name, is_count=True)
+                indenter.append_line(
+                    f'repeat_n_times = {self._ks_helper_fn_call("rand_count", seq_entry["-fz-repeat-min"], seq_entry["-fz-repeat-max"], repr(count_point))}', code)
+            indenter.append_line(
+                f"self.{entry_name} = {self.type_code_generator.generate_array_code(n_items, **seq_entry)}", code)
         elif "repeat" in seq_entry:
             indenter.append_line(
                 f"self.{entry_name} = []",
                 code
             )
+            generates_objects = True
             # Handle switch-on combined with repeat
             if isinstance(seq_entry["type"], dict):
-                match_on = seq_entry["type"]["switch-on"]
+                match_on = loop_entry["type"]["switch-on"]
                 cases = seq_entry["type"]["cases"]
                 code_to_initialise_object = ["_ = None"]
                 code_to_initialise_object.extend(
                     self.generate_switch_type("_", match_on, cases))
             else:
                 if is_base_type(seq_entry["type"]):
+                    generates_objects = False
                     code_to_initialise_object = [
-                        f"_ = {self.type_code_generator.generate_code(**seq_entry)}"
+                        f"_ = {self.type_code_generator.generate_code(**loop_entry, _choice_point=choice_point)}"
                     ]
                     if "-fz-increment-step" in seq_entry:
-                        code_to_initialise_object.append(f'{seq_entry["-fz-increment"]} += ({seq_entry["-fz-increment-step"]})')
+                        code_to_initialise_object.append(f'{loop_entry["-fz-increment"]} += ({loop_entry["-fz-increment-step"]})')
                 else:
                     seq_class_name = sanitiser.sanitise_class_name(
                         seq_entry["type"])
                     code_to_initialise_object = [
                         f"_ = {seq_class_name}(_parent=self, _root=self._root)"]
+            # Loops stop once the budget is exhausted, loops generating objects also stop if an object cannot be generated
+            budget_check = "budget.exhausted()"
+            if generates_objects:
+                budget_check = "budget.exhausted(self._depth + 1)"
+                code_to_initialise_object = [
+                    "try:",
+                    *(f"    {line}" for line in code_to_initialise_object),
+                    "except StopGeneration:",
+                    "    break",
+                ]
+            append_item = f"self.{entry_name}.append(_)"
+            if self.optimise:
+                indenter.append_lines([
+                    f"append_item = self.{entry_name}.append",
+                    "exhausted = budget.exhausted",
+                ], code)
+                append_item = "append_item(_)"
+                budget_check = "exhausted()"
+                if generates_objects:
+                    indenter.append_line("child_depth = self._depth + 1", code)
+                    budget_check = "exhausted(child_depth)"
             repeat_type = seq_entry["repeat"]
             match repeat_type:
                 case "until":
-                    # loop_conditions = seq_entry["repeat-until"].replace("_io.eof", "self._io.is_eos()")
-                    # Ignore eos/eof for now
-                    loop_conditions = seq_entry["repeat-until"].replace(
-                        "_io.eof", "False")
+                    # `_io.eof` is compiled to False, eos/eof is ignored for now
+                    loop_conditions = seq_entry["repeat-until"]
+                    indenter.append_lines(self.generate_hoisted_chains(hoisted_chains, f"not {budget_check}"), code)
                     # Do while loop
-                    do_while_loop_code = ["while True:"]
+                    do_while_loop_code = [f"while not {budget_check}:"]
                     for line in code_to_initialise_object:
                         do_while_loop_code.append(f"    {line}")
                     do_while_loop_code.extend([
-                        f"    self.{entry_name}.append(_)",
+                        f"    {append_item}",
                         f"    if ({loop_conditions}):",
                         "        break",])
                     indenter.append_lines(do_while_loop_code, code)
                 case "expr":
                     loop_conditions = f'int({seq_entry["repeat-expr"]})'
-                    for_loop_code = [f"for _i in range({loop_conditions}):",]
+                    if self.optimise:
+                        indenter.append_line(f"repeat_n_times = {loop_conditions}", code)
+                        loop_conditions = "repeat_n_times"
+                        indenter.append_lines(self.generate_hoisted_chains(hoisted_chains, f"repeat_n_times > 0 and not {budget_check}"), code)
+                    for_loop_code = [
+                        f"for _i in range({loop_conditions}):",
+                        f"    if {budget_check}:",
+                        "        break",]
                     for line in code_to_initialise_object:
                         for_loop_code.append(f"    {line}")
-                    for_loop_code.extend([f"    self.{entry_name}.append(_)",])
+                    for_loop_code.extend([f"    {append_item}",])
                     indenter.append_lines(for_loop_code, code)
                 case "eos":
                     min_n_loop = seq_entry["-fz-repeat-min"]
                     max_n_loop = seq_entry["-fz-repeat-max"]
+                    count_point = self.get_choice_point_id(class_name, entry_name, is_count=True)
+                    indenter.append_line(
+                        f'repeat_n_times = {self._ks_helper_fn_call("rand_count", min_n_loop, max_n_loop, repr(count_point))}', code)
+                    indenter.append_lines(self.generate_hoisted_chains(hoisted_chains, f"repeat_n_times > 0 and not {budget_check}"), code)
                     for_loop_code = [
-                        f'repeat_n_times = {self._ks_helper_fn_call("rand_int", start=min_n_loop, end=max_n_loop)}',
-                        "for _i in range(repeat_n_times):",]
+                        "for _i in range(repeat_n_times):",
+                        f"    if {budget_check}:",
+                        "        break",]
                     for line in code_to_initialise_object:
                         for_loop_code.append(f"    {line}")
-                    for_loop_code.extend([f"    self.{entry_name}.append(_)",])
+                    for_loop_code.extend([f"    {append_item}",])
                     indenter.append_lines(for_loop_code, code)
                 case _:
                     raise NotImplementedError("Unknown loop type")
         elif "-fz-random-order" in seq_entry:
-            fn_name = "rand_int"
-            end_val = f"(0 if (len({class_name}.{entry_name}) - 1) < 0 else (len({class_name}.{entry_name}) - 1))"
+            order_var = f"{class_name}.{self.get_order_var_name(entry_name)}"
+            options_var = f"{class_name}.{self.get_options_var_name(entry_name)}"
+            if self.optimise:
+                indenter.append_line(f"order = {order_var}", code)
+                order_var = "order"
+            indenter.append_lines(self.generate_order_empty_check(entry_name, order_var), code)
             indenter.append_line(
-                f"self.{entry_name} = {class_name}.{entry_name}.pop({self._ks_helper_fn_call(fn_name, start=0, end=end_val)})",
+                f"self.{entry_name} = {self._ks_helper_fn_call('rand_pop', order_var, repr(choice_point), options_var)}",
                 code
             )
         elif "-fz-order" in seq_entry:
+            order_var = f"{class_name}.{self.get_order_var_name(entry_name)}"
+            if self.optimise:
+                indenter.append_line(f"order = {order_var}", code)
+                order_var = "order"
+            indenter.append_lines(self.generate_order_empty_check(entry_name, order_var), code)
             indenter.append_line(
-                f"self.{entry_name} = {class_name}.{entry_name}.pop(0)",
+                f"self.{entry_name} = {order_var}.pop({'' if self.optimise else 0})",
                 code
             )
         elif "-fz-choice" in seq_entry:
@@ -599,19 +1007,19 @@ class Python3CodeGenerator(Generator):
             if "enum" in seq_entry:
                 choice_list = []
                 for choice in seq_entry["-fz-choice"]:
-                    choice_list.append(self._transpile_namespace(choice))
+                    choice_list.append(f"{self._expression_transpiler(class_name, available_ref, static_ref, choice)}")
                 # Remove quotes from enum string
                 choice_list = "[" + ", ".join(choice_list) + "]"
             else:
-                choice_list = seq_entry["-fz-choice"]
+                choice_list = f"{class_name}.{self.get_options_var_name(entry_name)}"
 
             indenter.append_line(
-                f"self.{entry_name} = {self.KS_HELPER_INSTANCE}.rand_choice({choice_list})",
+                f"self.{entry_name} = {self.KS_HELPER_INSTANCE}.rand_choice({choice_list}, {choice_point!r})",
                 code
             )
         elif fz_process_key is not None:
             indenter.append_lines(self.generate_fz_process_code(
-                fz_process_key, class_name, seq_entry), code)
+                fz_process_key, expression_compiler, seq_entry), code)
         elif isinstance(seq_entry["type"], dict):
             # Switch on type
             match_on = seq_entry["type"]["switch-on"]
@@ -620,7 +1028,7 @@ class Python3CodeGenerator(Generator):
                 f"self.{entry_name}", match_on, cases), code)
         else:
             indenter.append_line(
-                f"self.{entry_name} = {self.type_code_generator.generate_code(**seq_entry)}",
+                f"self.{entry_name} = {self.type_code_generator.generate_code(**seq_entry, _choice_point=choice_point)}",
                 code
             )
             fz_increment_step = seq_entry.get("-fz-increment-step")
@@ -636,6 +1044,50 @@ class Python3CodeGenerator(Generator):
             indenter.indent()
         return code
 
+    # Keys of a repeated seq entry used to generate every item, the other ones are evaluated once
+    LOOP_BODY_KEYS = ("size", "valid", "value", "-fz-increment", "-fz-increment-step", "-fz-range-min", "-fz-range-max")
+
+    def compile_loop_entry(self, expression_compiler: Python3ExpressionCompiler, seq_entry: SeqEntry) -> tuple[SeqEntry, dict[str, str]]:
+        """Compile the expressions a repeated seq entry generates every item with, hoisting the attribute chains that do
+        not change while the loop runs. Get a copy of the entry with the compiled expressions, and the hoisted chains:
+        code -> local. The field incremented by the loop changes, it is read again for every item."""
+        entry_name = seq_entry["id"]
+        assigned = []
+        increment = seq_entry.get("-fz-increment")
+        if isinstance(increment, str):
+            increment_path = get_attribute_path(parse_expression(increment))
+            if increment_path is not None:
+                assigned.append(increment_path)
+        hoisted = {}
+        loop_entry = dict(seq_entry)
+        for key in self.LOOP_BODY_KEYS:
+            if isinstance(seq_entry.get(key), str):
+                loop_entry[key] = expression_compiler.compile_in_loop(seq_entry[key], entry_name, assigned, hoisted)
+        if isinstance(seq_entry["type"], dict):
+            loop_entry["type"] = dict(seq_entry["type"])
+            loop_entry["type"]["switch-on"] = expression_compiler.compile_in_loop(
+                seq_entry["type"]["switch-on"], entry_name, assigned, hoisted)
+        return loop_entry, hoisted
+
+    @staticmethod
+    def generate_hoisted_chains(hoisted_chains: dict[str, str], condition: str) -> List[str]:
+        """Set the locals of the attribute chains hoisted out of a loop, only if the loop runs at least once so a chain is
+        evaluated whenever it was before"""
+        if len(hoisted_chains) == 0:
+            return []
+        return [
+            f"if {condition}:",
+            *(f"    {local} = {chain}" for chain, local in hoisted_chains.items()),
+        ]
+
+    @staticmethod
+    def generate_order_empty_check(entry_name: str, order_var: str) -> List[str]:
+        """Stop generating the object once the values of a `-fz-order` or `-fz-random-order` list are used up"""
+        return [
+            f"if not {order_var}:",
+            f"    raise StopGeneration(\"No value left for `{entry_name}`\")",
+        ]
+
     def generate_instance_entry(self, class_name: str, instance_name: str, instance_entry: dict[str, Any], available_ref: List[str], static_ref: List[str]) -> List[str]:
         self.logger.debug(f"Generating instance entry \"{instance_name}\"")
         indenter = Indenter(add_newline=True)
@@ -646,16 +1098,133 @@ class Python3CodeGenerator(Generator):
         indenter.append_line(f"self.{instance_name} = {val}", code)
         return code
 
+    def get_class_name_with_static_var(self, source: dict[str, Any]) -> List[str]:
+        """Get the name of every generated class (including subtypes) that has static variables"""
+        class_names = []
+        class_name = sanitiser.sanitise_class_name(source["meta"]["id"])
+        if len(self.get_class_static_var(source["seq"], class_name, source["instances"], source["_available_ref"], source["_static_ref"])) > 0:
+            class_names.append(class_name)
+        for t_val in source["types"].values():
+            class_names.extend(self.get_class_name_with_static_var(t_val))
+        return class_names
+
+    def get_enum_sizes(self, source: dict[str, Any]) -> dict[str, int]:
+        """Get the number of values of every enum (including those of subtypes), by generated class name"""
+        enum_sizes = {sanitiser.sanitise_class_name(enum_name): len(enum_entries) for enum_name, enum_entries in source["enums"].items()}
+        for t_val in source["types"].values():
+            enum_sizes.update(self.get_enum_sizes(t_val))
+        return enum_sizes
+
+    def get_choice_points(self, source: dict[str, Any], enum_sizes: dict[str, int]) -> dict[str, tuple[str, Optional[int]]]:
+        """Get the choice points of a type (including subtypes): ID -> (kind, number of options), the number of options
+        is None if it is only known at run time"""
+        choice_points = {}
+        class_name = sanitiser.sanitise_class_name(source["meta"]["id"])
+        for seq_entry in source["seq"]:
+            entry_name = seq_entry["id"]
+            if "-fz-attr-len" in seq_entry or "-fz-order" in seq_entry:
+                continue
+            if seq_entry.get("repeat") == "eos":
+                start, end = seq_entry["-fz-repeat-min"], seq_entry["-fz-repeat-max"]
+                n_options = (end - start).bit_length() + 1 if isinstance(start, int) and isinstance(end, int) else None
+                choice_points[self.get_choice_point_id(class_name, entry_name, is_count=True)] = ("count", n_options)
+            if "-fz-random-order" in seq_entry and "repeat" not in seq_entry:
+                choice_points[self.get_choice_point_id(class_name, entry_name)] = ("order", len(seq_entry["-fz-random-order"]))
+            elif "-fz-choice" in seq_entry and "repeat" not in seq_entry:
+                choice_points[self.get_choice_point_id(class_name, entry_name)] = ("choice", len(seq_entry["-fz-choice"]))
+            elif "enum" in seq_entry and seq_entry.get("valid") is None and "-fz-increment" not in seq_entry \
+                    and not any(key.startswith("-fz-process-") for key in seq_entry):
+                enum_name = sanitiser.sanitise_class_name(seq_entry["enum"])
+                choice_points[self.get_choice_point_id(class_name, entry_name)] = ("enum", enum_sizes.get(enum_name))
+        for t_val in source["types"].values():
+            choice_points.update(self.get_choice_points(t_val, enum_sizes))
+        return choice_points
+
+    def get_choice_weights(self, source: dict[str, Any], choice_points: dict[str, tuple[str, Optional[int]]]) -> dict[str, List[float]]:
+        """Get the weights given in the definition (including subtypes) with `-fz-choice-weights` (for `-fz-choice` and
+        enum fields) and `-fz-random-order-weights`: ID -> weights, in the order of the options"""
+        choice_weights = {}
+        class_name = sanitiser.sanitise_class_name(source["meta"]["id"])
+        for seq_entry in source["seq"]:
+            for key, kinds in (("-fz-choice-weights", ("choice", "enum")), ("-fz-random-order-weights", ("order", ))):
+                if key not in seq_entry:
+                    continue
+                point = self.get_choice_point_id(class_name, seq_entry["id"])
+                kind, n_options = choice_points.get(point, (None, None))
+                if kind not in kinds:
+                    raise ValueError(f"`{key}` of `{point}` requires a {' or '.join(kinds)} field")
+                weights = seq_entry[key]
+                if not isinstance(weights, list) or len(weights) != n_options:
+                    raise ValueError(f"`{key}` of `{point}` must be a list of {n_options} weights")
+                choice_weights[point] = weights
+        for t_val in source["types"].values():
+            choice_weights.update(self.get_choice_weights(t_val, choice_points))
+        return choice_weights
+
     def generate_entry_point(self) -> List[str]:
         indenter = Indenter(add_newline=True)
         entry_point_class_name = sanitiser.sanitise_class_name(
             self.ir.entry_point_class_name)
-        code = indenter.apply([
+        code = []
+        choice_points = self.get_choice_points(self.ir.source, self.get_enum_sizes(self.ir.source))
+        choice_weights = self.get_choice_weights(self.ir.source, choice_points)
+        alias_tables = {}
+        for point, weights in choice_weights.items():
+            try:
+                alias_tables[point] = KsHelper.alias_table(weights)
+            except ValueError as e:
+                raise ValueError(f"Invalid weights of `{point}`: {e}") from None
+        indenter.append_lines([
+            "# Choice points: ID -> (kind, number of options, None if only known at run time), see `KsHelper`",
+            "CHOICE_POINTS = {",
+            *(f"    {point!r}: {value!r}," for point, value in choice_points.items()),
+            "}",
+            "# Weights given in the definition: ID -> weights, and their alias tables",
+            "CHOICE_WEIGHTS = {",
+            *(f"    {point!r}: {weights!r}," for point, weights in choice_weights.items()),
+            "}",
+            "CHOICE_ALIAS_TABLES = {",
+            *(f"    {point!r}: {table!r}," for point, table in alias_tables.items()),
+            "}",
+            "ks_helper.set_choice_weights(CHOICE_WEIGHTS, CHOICE_ALIAS_TABLES)",
+            "",
+            "",
+            "def reset_static() -> None:",
+        ], code)
+        indenter.indent()
+        class_names = self.get_class_name_with_static_var(self.ir.source)
+        for class_name in class_names:
+            indenter.append_line(f"{class_name}._reset_static()", code)
+        if len(class_names) == 0:
+            indenter.append_line("pass", code)
+        indenter.unindent()
+        indenter.append_lines([
+            "",
+            "",
+            f"def create_sample() -> {entry_point_class_name}:",
+            "    reset_static()",
+            "    budget.start()",
+            f"    return {entry_point_class_name}(_parent=None, _root=None)",
+            "",
+            "",
+            f"def mutate_sample(sample: {entry_point_class_name}) -> None:",
+            "    budget.start()",
+            "    mutate(sample, reset_static)",
+            "",
+            "",
+            "def generate_sample() -> bytes:",
+            "    return create_sample().result()",
+            "",
+            "",
+            "def generate(count: Optional[int] = None, seed: Optional[int] = None, start: int = 0, mutate: bool = False) -> Iterator[bytes]:",
+            "    \"\"\"Generate `count` samples (forever if None) starting from sample `start`, as `--count`, `--seed`, `--index`",
+            "    and `--mutate` would\"\"\"",
+            "    return iter_samples(create_sample, mutate_sample, count=count, seed=seed, start=start, mutate=mutate)",
+            "",
+            "",
             'if "__main__" == __name__:',
-            f'    entry_point = {entry_point_class_name}(_parent=None, _root=None)',
-            '    sys.stdout.buffer.write(entry_point.result())',
-            '    sys.stdout.flush()',
-        ])
+            "    sys.exit(main(sys.argv[1:], create_sample, mutate_sample))",
+        ], code)
         return code
 
     def generate_code(self) -> None:
@@ -671,7 +1240,7 @@ class Python3CodeGenerator(Generator):
             ir = IntermediateRepresentation(
                 t_val, self.ir.entry_point_class_name)
             code_gen = Python3CodeGenerator(
-                ir, self.output, is_entry_point=False)
+                ir, self.output, is_entry_point=False, optimise=self.optimise)
             code_gen.generate_code()
         if self.is_entry_point:
             self.write_entry_point()
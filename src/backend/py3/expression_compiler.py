@@ -0,0 +1,306 @@
+from datastructure.expression import (Node, Literal, ArrayLiteral, Name, EnumRef, Attribute, MethodCall, Subscript, UnaryOp,
+                                     BinaryOp, Ternary, parse_expression, get_attribute_path, map_child_nodes)
+import backend.py3.utils.sanitiser as sanitiser
+from typing import Any, List, Optional, Tuple, Union
+import json
+import math
+import operator
+
+
+# Precedence of the Python code of a node, higher binds more tightly
+TERNARY_PRECEDENCE = 1
+BINARY_PRECEDENCE = {
+    "or": 2,
+    "and": 3,
+    "==": 5, "!=": 5, "<": 5, "<=": 5, ">": 5, ">=": 5,
+    "|": 6,
+    "^": 7,
+    "&": 8,
+    "<<": 9, ">>": 9,
+    "+": 10, "-": 10,
+    "*": 11, "/": 11, "%": 11,
+}
+NOT_PRECEDENCE = 4
+COMPARISON_PRECEDENCE = 5
+UNARY_PRECEDENCE = 12
+POSTFIX_PRECEDENCE = 13
+ATOM_PRECEDENCE = 14
+
+BINARY_FNS = {
+    "==": operator.eq, "!=": operator.ne, "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+    "|": operator.or_, "^": operator.xor, "&": operator.and_, "<<": operator.lshift, ">>": operator.rshift,
+    "+": operator.add, "-": operator.sub, "*": operator.mul, "/": operator.truediv, "%": operator.mod,
+}
+UNARY_FNS = {"-": operator.neg, "~": operator.invert, "not": operator.not_}
+# Larger shifts are left to the generated code, so a typo does not make the compiler build a huge number
+MAX_FOLDED_SHIFT = 64
+# Names that do not refer to a field
+LOOP_ITEM_NAME = "_"
+PARENT_NAMES = {"_root": "self._root", "_parent": "self._parent"}
+
+
+def is_constant(node: Node) -> bool:
+    return isinstance(node, Literal)
+
+
+def is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def can_be_literal(value: Any) -> bool:
+    """Check if a value computed while folding can be written back as a literal"""
+    if isinstance(value, float):
+        return math.isfinite(value)
+    return isinstance(value, (int, str, bool))
+
+
+def fold_constants(node: Node) -> Node:
+    """Compute the operations on literals, the result is the value the generated code would compute. Operations that
+    would raise an exception are left to the generated code."""
+    if isinstance(node, ArrayLiteral):
+        return ArrayLiteral(tuple(fold_constants(item) for item in node.items))
+    if isinstance(node, Attribute):
+        return Attribute(fold_constants(node.value), node.name)
+    if isinstance(node, MethodCall):
+        return MethodCall(fold_constants(node.value), node.name, tuple(fold_constants(arg) for arg in node.args))
+    if isinstance(node, Subscript):
+        return Subscript(fold_constants(node.value), fold_constants(node.index))
+    if isinstance(node, UnaryOp):
+        operand = fold_constants(node.operand)
+        if is_constant(operand) and (node.op == "not" or is_number(operand.value)) and not (node.op == "~" and isinstance(operand.value, float)):
+            return Literal(UNARY_FNS[node.op](operand.value))
+        return UnaryOp(node.op, operand)
+    if isinstance(node, BinaryOp):
+        left = fold_constants(node.left)
+        right = fold_constants(node.right)
+        if node.op in ("and", "or"):
+            if not is_constant(left):
+                return BinaryOp(node.op, left, right)
+            # `and` and `or` give one of their operands
+            return right if bool(left.value) == (node.op == "and") else left
+        if is_constant(left) and is_constant(right):
+            value = fold_binary_op(node.op, left.value, right.value)
+            if value is not None:
+                return Literal(value)
+        return BinaryOp(node.op, left, right)
+    if isinstance(node, Ternary):
+        condition = fold_constants(node.condition)
+        if_true = fold_constants(node.if_true)
+        if_false = fold_constants(node.if_false)
+        if is_constant(condition):
+            return if_true if condition.value else if_false
+        return Ternary(condition, if_true, if_false)
+    return node
+
+
+def fold_binary_op(op: str, left: Any, right: Any) -> Optional[Any]:
+    """Compute an operation on two literals, None if it is not done at compile time"""
+    if op in ("<<", ">>") and (not isinstance(right, int) or not 0 <= right <= MAX_FOLDED_SHIFT):
+        return None
+    if op == "*" and not (is_number(left) and is_number(right)):
+        # Repeating a string
+        return None
+    try:
+        value = BINARY_FNS[op](left, right)
+    except (TypeError, ArithmeticError):
+        return None
+    return value if can_be_literal(value) else None
+
+
+def get_constant_value(expression: str) -> Optional[Any]:
+    """Get the value of an expression that only uses literals, None if it is not constant or not valid"""
+    try:
+        node = fold_constants(parse_expression(expression))
+    except ValueError:
+        return None
+    return node.value if is_constant(node) else None
+
+
+class Python3ExpressionCompiler():
+    """Compile the expressions of a type to Python code. Names are resolved to the fields of the type: `self.name`, or
+    `ClassName.name` for a static field. A compiled expression is cached, it is compiled once however many keys use
+    it."""
+
+    def __init__(self, class_name: str, available_ref: List[str], static_ref: List[str]) -> None:
+        self.class_name = class_name
+        self.references = {name: f"self.{name}" for name in available_ref}
+        self.references.update({name: f"{class_name}.{name}" for name in static_ref if name in self.references})
+        self.static_ref = set(static_ref)
+        self.compiled = {}
+
+    @staticmethod
+    def literal_code(value: Union[int, float, str, bool, bytes]) -> str:
+        if isinstance(value, str):
+            # A JSON string is a Python string too, with double quotes like the rest of the generated code
+            return json.dumps(value, ensure_ascii=False)
+        return repr(value)
+
+    @staticmethod
+    def enum_ref_code(path: Tuple[str, ...]) -> str:
+        return ".".join([*(sanitiser.sanitise_class_name(name) for name in path[:-1]), path[-1]])
+
+    @staticmethod
+    def parenthesise(code: str, precedence: int, min_precedence: int) -> str:
+        return code if precedence >= min_precedence else f"({code})"
+
+    def is_field_name(self, name: str) -> bool:
+        """Check if a name refers to a field of an instance, which has methods to serialise it"""
+        return name in self.references and name not in self.static_ref
+
+    def compile_node(self, node: Node, produce_bytes: bool = False) -> Tuple[str, int]:
+        """Compile a node, get the code and its precedence. If `produce_bytes`, the fields are serialised, that is only
+        the case for the operands of a concatenation."""
+        if isinstance(node, Literal):
+            value = node.value
+            if produce_bytes and isinstance(value, str):
+                value = value.encode("utf8")
+            precedence = UNARY_PRECEDENCE if is_number(value) and value < 0 else ATOM_PRECEDENCE
+            return self.literal_code(value), precedence
+        if isinstance(node, ArrayLiteral):
+            items = node.items
+            if produce_bytes and all(is_constant(item) and is_number(item.value) and isinstance(item.value, int) and 0 <= item.value <= 255 for item in items):
+                return repr(bytes(item.value for item in items)), ATOM_PRECEDENCE
+            return "[" + ", ".join(self.compile_node(item)[0] for item in node.items) + "]", ATOM_PRECEDENCE
+        if isinstance(node, Name):
+            if produce_bytes and self.is_field_name(node.name):
+                return f"self.{node.name}_to_bytes()", POSTFIX_PRECEDENCE
+            if node.name in self.references:
+                return self.references[node.name], POSTFIX_PRECEDENCE
+            if node.name in PARENT_NAMES:
+                return PARENT_NAMES[node.name], POSTFIX_PRECEDENCE
+            # Not a field, such as `_`, the item of a loop
+            return node.name, ATOM_PRECEDENCE
+        if isinstance(node, EnumRef):
+            return self.enum_ref_code(node.path), POSTFIX_PRECEDENCE
+        if isinstance(node, Attribute):
+            if isinstance(node.value, Name) and node.value.name == "_io" and node.name == "eof":
+                # The end of the stream is not known while generating
+                return "False", ATOM_PRECEDENCE
+            value, precedence = self.compile_node(node.value)
+            if precedence < POSTFIX_PRECEDENCE or (isinstance(node.value, Literal) and is_number(node.value.value)):
+                value = f"({value})"
+            if produce_bytes and self.is_reference(node.value):
+                return f"{value}.{node.name}_to_bytes()", POSTFIX_PRECEDENCE
+            return f"{value}.{node.name}", POSTFIX_PRECEDENCE
+        if isinstance(node, MethodCall):
+            value, precedence = self.compile_node(node.value)
+            if precedence < POSTFIX_PRECEDENCE or (isinstance(node.value, Literal) and is_number(node.value.value)):
+                value = f"({value})"
+            args = ", ".join(self.compile_node(arg)[0] for arg in node.args)
+            return f"{value}.{node.name}({args})", POSTFIX_PRECEDENCE
+        if isinstance(node, Subscript):
+            value, precedence = self.compile_node(node.value)
+            return f"{self.parenthesise(value, precedence, POSTFIX_PRECEDENCE)}[{self.compile_node(node.index)[0]}]", POSTFIX_PRECEDENCE
+        if isinstance(node, UnaryOp):
+            operand, precedence = self.compile_node(node.operand)
+            if node.op == "not":
+                return f"not {self.parenthesise(operand, precedence, NOT_PRECEDENCE)}", NOT_PRECEDENCE
+            return f"{node.op}{self.parenthesise(operand, precedence, UNARY_PRECEDENCE)}", UNARY_PRECEDENCE
+        if isinstance(node, BinaryOp):
+            op_precedence = BINARY_PRECEDENCE[node.op]
+            # Only a concatenation serialises its operands
+            operand_bytes = produce_bytes and node.op == "+"
+            left, left_precedence = self.compile_node(node.left, operand_bytes)
+            right, right_precedence = self.compile_node(node.right, operand_bytes)
+            # Operators are left associative, comparisons must not chain
+            left_min_precedence = op_precedence + 1 if op_precedence == COMPARISON_PRECEDENCE else op_precedence
+            left = self.parenthesise(left, left_precedence, left_min_precedence)
+            right = self.parenthesise(right, right_precedence, op_precedence + 1)
+            return f"{left} {node.op} {right}", op_precedence
+        if isinstance(node, Ternary):
+            condition, condition_precedence = self.compile_node(node.condition)
+            if_true, if_true_precedence = self.compile_node(node.if_true, produce_bytes)
+            if_false, if_false_precedence = self.compile_node(node.if_false, produce_bytes)
+            condition = self.parenthesise(condition, condition_precedence, TERNARY_PRECEDENCE + 1)
+            if_true = self.parenthesise(if_true, if_true_precedence, TERNARY_PRECEDENCE + 1)
+            return f"{if_true} if {condition} else {if_false}", TERNARY_PRECEDENCE
+        raise TypeError(f"Unknown expression node: {node!r}")
+
+    def is_reference(self, node: Node) -> bool:
+        """Check if a node refers to an object: a field, `_root`, `_parent`, the item of a loop, or an attribute of one
+        of these"""
+        if isinstance(node, Attribute):
+            return self.is_reference(node.value)
+        return isinstance(node, Name) and (self.is_field_name(node.name) or node.name in PARENT_NAMES or node.name == LOOP_ITEM_NAME)
+
+    def compile(self, expression: str, produce_bytes: bool = False) -> str:
+        """Compile an expression to Python code, a ternary is in parentheses so the code can be used as an operand"""
+        key = (expression, produce_bytes)
+        if key not in self.compiled:
+            code, precedence = self.compile_node(fold_constants(parse_expression(expression)), produce_bytes)
+            self.compiled[key] = self.parenthesise(code, precedence, TERNARY_PRECEDENCE + 1)
+        return self.compiled[key]
+
+    def compile_in_loop(self, expression: str, loop_field: str, assigned: List[Tuple[str, ...]], hoisted: dict[str, str]) -> str:
+        """Compile an expression evaluated for every item of the repeated field `loop_field`. The attribute chains that
+        do not change while the items are generated, such as `_root.header.n_items`, are replaced with locals, added to
+        `hoisted` (code of the chain -> local) so they are set once before the loop. `assigned` holds the attribute
+        chains the loop changes, such as the one of `-fz-increment`."""
+        node = self.hoist_invariants(fold_constants(parse_expression(expression)), loop_field, assigned, hoisted)
+        code, precedence = self.compile_node(node)
+        return self.parenthesise(code, precedence, TERNARY_PRECEDENCE + 1)
+
+    def hoist_invariants(self, node: Node, loop_field: str, assigned: List[Tuple[str, ...]], hoisted: dict[str, str]) -> Node:
+        """Replace the loop invariant attribute chains of a node with the names of their locals, see `compile_in_loop`.
+        Only the chains evaluated whenever the node is are hoisted, not the ones in a branch of a ternary or in the
+        right operand of `and` and `or`, which may not be valid when they are skipped."""
+        path = get_attribute_path(node)
+        if path is not None:
+            if not self.is_loop_invariant(path, loop_field, assigned):
+                return node
+            code = self.compile_node(node)[0]
+            if code not in hoisted:
+                local = "_".join(name.strip("_") for name in path)
+                while local in hoisted.values() or local in self.references or local in PARENT_NAMES:
+                    local += "_"
+                hoisted[code] = local
+            return Name(hoisted[code])
+        if isinstance(node, Ternary):
+            return Ternary(self.hoist_invariants(node.condition, loop_field, assigned, hoisted), node.if_true, node.if_false)
+        if isinstance(node, BinaryOp) and node.op in ("and", "or"):
+            return BinaryOp(node.op, self.hoist_invariants(node.left, loop_field, assigned, hoisted), node.right)
+        return map_child_nodes(node, lambda child: self.hoist_invariants(child, loop_field, assigned, hoisted))
+
+    def is_loop_invariant(self, path: Tuple[str, ...], loop_field: str, assigned: List[Tuple[str, ...]]) -> bool:
+        """Check if an attribute chain of at least one attribute does not change while the items of `loop_field` are
+        generated. Static fields may be incremented, and `_io` changes as the object is serialised. A field may be
+        reached through `_root` and `_parent` too, so the chains are compared without them."""
+        if len(path) < 2 or "_io" in path or not (self.is_field_name(path[0]) or path[0] in PARENT_NAMES):
+            return False
+        fields = tuple(name for name in path if name not in PARENT_NAMES)
+        if len(fields) > 0 and fields[0] == loop_field:
+            return False
+        for assigned_path in assigned:
+            assigned_fields = tuple(name for name in assigned_path if name not in PARENT_NAMES)
+            n_common = min(len(fields), len(assigned_fields))
+            if fields[:n_common] == assigned_fields[:n_common]:
+                return False
+        return True
+
+    def compile_bytes_parts(self, expression: str) -> Optional[List[Union[str, bytes]]]:
+        """Get the parts of an expression that only concatenates fields and literals, in order: the code referring to
+        a field (`self.body`, `self._root.header`), or the bytes of a literal. None if it does something else."""
+        parts = []
+        for node in self.get_concatenated(fold_constants(parse_expression(expression))):
+            if isinstance(node, Literal) and isinstance(node.value, str):
+                parts.append(node.value.encode("utf8"))
+            elif isinstance(node, Name) and self.is_field_name(node.name):
+                parts.append(self.references[node.name])
+            elif isinstance(node, Attribute) and self.is_reference(node.value):
+                parts.append(self.compile_node(node)[0])
+            else:
+                return None
+        # Literal bytes next to each other are a single part
+        merged_parts = []
+        for part in parts:
+            if isinstance(part, bytes) and len(merged_parts) > 0 and isinstance(merged_parts[-1], bytes):
+                merged_parts[-1] += part
+            else:
+                merged_parts.append(part)
+        return merged_parts
+
+    @classmethod
+    def get_concatenated(cls, node: Node) -> List[Node]:
+        if isinstance(node, BinaryOp) and node.op == "+":
+            return cls.get_concatenated(node.left) + cls.get_concatenated(node.right)
+        return [node]
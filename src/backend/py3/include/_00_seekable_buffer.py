@@ -3,6 +3,14 @@ from typing import Optional
 
 
 class SeekableBuffer():
+    """Seekable byte buffer.
+
+    The buffer holds the bytes between `start_pos` and `end_pos` of `data`. A buffer that owns its data grows with
+    amortised capacity, so `data` can be longer than the buffer, the spare capacity after `end_pos` is always zeroed.
+    A sub-buffer shares `data` with the buffer it was created from and cannot be grown.
+
+    Views returned by `get_view` and `get_full_view` do not copy, the buffer cannot grow while they are alive.
+    """
 
     def __init__(self, data: Optional[bytearray] = None, start_pos: Optional[int] = None, end_pos: Optional[int] = None) -> None:
         data = bytearray() if data is None else data
@@ -20,11 +28,18 @@ class SeekableBuffer():
         self.start_pos = start_pos
         self.end_pos = end_pos
         self.ptr = self.start_pos
+        self._is_subbuffer = start_pos != 0 or end_pos != len(data)
+
+    def _reserve(self, capacity: int) -> None:
+        """Make sure the underlying data can hold `capacity` bytes, at least doubling its size when it has to grow."""
+        if capacity <= len(self.data):
+            return
+        self.data.extend(bytes(max(capacity - len(self.data), len(self.data))))
 
     def _grow_buf(self, n_bytes: int) -> None:
         if self.is_subbuffer():
             raise BufferError("Sub-buffer cannot be grown")
-        self.data.extend(b"\0" * n_bytes)
+        self._reserve(self.end_pos + n_bytes)
         self.end_pos += n_bytes
 
     def _move_data(self, offset: int, write_null_bytes: bool = True) -> None:
@@ -39,51 +54,88 @@ class SeekableBuffer():
             return
         elif self.ptr + offset < self.start_pos:
             raise ValueError("Cannot move data beyond the start of the buffer")
-        data_to_move = self.data[self.ptr:]
-        for i, b in enumerate(data_to_move):
-            if self.ptr + offset + i >= self.end_pos:
-                break
-            self.data[self.ptr + offset + i] = b
-        if write_null_bytes:
-            if offset > 0:
-                for i in range(self.ptr, self.ptr + offset):
-                    self.data[i] = 0
-            else:
-                for i in range(self.end_pos + offset, self.end_pos):
-                    self.data[i] = 0
-
-    def append(self, buffer: bytes | bytearray):
-        # FIXME does not take into account ptr
-        self.data += buffer
-        self.end_pos += len(buffer)
-
-    def write(self, buffer: bytes | bytearray):
-        # TODO
-        for b in buffer:
-            pass
-
-    def get_data(self, n_bytes: Optional[int] = None):
-        """Get data using the pointer"""
+        # Data moved past the end of the buffer is dropped
+        n_bytes = max(self.end_pos - self.ptr - max(offset, 0), 0)
+        with memoryview(self.data) as view:
+            view[self.ptr + offset:self.ptr + offset + n_bytes] = view[self.ptr:self.ptr + n_bytes]
+            if write_null_bytes:
+                if offset > 0:
+                    null_start, null_end = self.ptr, min(self.ptr + offset, self.end_pos)
+                else:
+                    null_start, null_end = self.end_pos + offset, self.end_pos
+                view[null_start:null_end] = bytes(null_end - null_start)
+
+    def append(self, buffer: bytes | bytearray | memoryview) -> None:
+        """Add data to the end of the buffer, will not change the pointer position
+
+        :raises BufferError: Buffer is a sub-buffer
+        """
+        if self._is_subbuffer:
+            raise BufferError("Sub-buffer cannot be grown")
+        end_pos = self.end_pos
+        if end_pos == len(self.data):
+            # No spare capacity, let bytearray grow itself (it over-allocates, so growth is amortised as well)
+            self.data += buffer
+            self.end_pos = len(self.data)
+        else:
+            new_end_pos = end_pos + len(buffer)
+            self._reserve(new_end_pos)
+            self.data[end_pos:new_end_pos] = buffer
+            self.end_pos = new_end_pos
+
+    def write(self, buffer: bytes | bytearray | memoryview) -> None:
+        """Write data at the pointer, overwriting existing data and growing the buffer if needed. The pointer is moved
+        to the end of the written data.
+
+        :raises BufferError: Data does not fit into a sub-buffer
+        """
+        write_end = self.ptr + len(buffer)
+        if write_end > self.end_pos:
+            self._grow_buf(write_end - self.end_pos)
+        self.data[self.ptr:write_end] = buffer
+        self.ptr = write_end
+
+    def get_view(self, n_bytes: Optional[int] = None) -> memoryview:
+        """Get data using the pointer, without copying"""
         if n_bytes is not None:
             end = self.ptr + n_bytes
         else:
             end = self.end_pos
         if end > self.end_pos:
             end = self.end_pos
-        result = bytes(self.data[self.ptr:end])
+        result = memoryview(self.data)[self.ptr:end]
         self.ptr = end
         return result
 
+    def get_data(self, n_bytes: Optional[int] = None) -> bytes:
+        """Get data using the pointer"""
+        with self.get_view(n_bytes) as view:
+            return view.tobytes()
+
+    def get_full_view(self) -> memoryview:
+        """Get the data in the buffer, without copying"""
+        return memoryview(self.data)[self.start_pos:self.end_pos]
+
     def get_full_data(self) -> bytes:
         """Get a copy of the data in the buffer"""
-        return bytes(self.data[self.start_pos:self.end_pos])
+        with self.get_full_view() as view:
+            return view.tobytes()
+
+    def get_subbuffer(self, offset: int, n_bytes: Optional[int] = None) -> SeekableBuffer:
+        """Get a buffer sharing the data from `offset` (relative to the start of the buffer), without copying"""
+        if offset < 0:
+            raise ValueError("Offset cannot be negative")
+        start = self.start_pos + offset
+        end = self.end_pos if n_bytes is None else min(start + n_bytes, self.end_pos)
+        subbuffer = SeekableBuffer(self.data, start_pos=start, end_pos=end)
+        subbuffer._is_subbuffer = True
+        return subbuffer
 
     def is_eos(self) -> bool:
         return self.ptr == self.end_pos
 
     def is_subbuffer(self) -> bool:
-        # Not sub buffer if length is equal to underlying data length
-        return len(self) != len(self.data)
+        return self._is_subbuffer
 
     def seek(self, offset: int) -> None:
         """Set pointer be at an offset relative to the start of the buffer"""
@@ -0,0 +1,74 @@
+import time
+from typing import Optional
+
+
+class StopGeneration(Exception):
+    """Raised when an object cannot be generated, such as when every value of a `-fz-order` list has been used. The
+    innermost loop generating objects stops, and keeps the objects generated so far."""
+
+
+class Budget():
+    """Limits on the work spent generating a single sample. A limit that is None is not enforced.
+
+    max_bytes: Number of bytes of random data, such as byte fields, strings and number arrays.
+    max_depth: Nesting depth of objects, the root object is at depth 0.
+    max_objects: Number of objects.
+    max_time: Number of seconds.
+
+    Once a limit is reached, loops stop adding items, and random sized fields are shrunk to the bytes that are left.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None, max_depth: Optional[int] = None, max_objects: Optional[int] = None, max_time: Optional[float] = None) -> None:
+        self.configure(max_bytes=max_bytes, max_depth=max_depth, max_objects=max_objects, max_time=max_time)
+        self.start()
+
+    def configure(self, max_bytes: Optional[int] = None, max_depth: Optional[int] = None, max_objects: Optional[int] = None, max_time: Optional[float] = None) -> None:
+        for name, limit in (("max_bytes", max_bytes), ("max_depth", max_depth), ("max_objects", max_objects), ("max_time", max_time)):
+            if limit is not None and limit < 0:
+                raise ValueError(f"`{name}` cannot be less than 0.")
+        self.max_bytes = max_bytes
+        self.max_depth = max_depth
+        self.max_objects = max_objects
+        self.max_time = max_time
+        self.enabled = any(limit is not None for limit in (max_bytes, max_depth, max_objects, max_time))
+
+    @property
+    def limits(self) -> dict[str, Optional[int | float]]:
+        return {
+            "max_bytes": self.max_bytes,
+            "max_depth": self.max_depth,
+            "max_objects": self.max_objects,
+            "max_time": self.max_time,
+        }
+
+    def start(self) -> None:
+        """Reset the budget before generating a sample"""
+        self.n_bytes = 0
+        self.n_objects = 0
+        self.deadline = None if self.max_time is None else time.monotonic() + self.max_time
+
+    def remaining_bytes(self) -> Optional[int]:
+        if self.max_bytes is None:
+            return None
+        return max(self.max_bytes - self.n_bytes, 0)
+
+    def limit_bytes(self, n_bytes: int, min_n_bytes: int = 0) -> int:
+        """Shrink a random number of bytes to the bytes that are left, but not below `min_n_bytes`"""
+        remaining_bytes = self.remaining_bytes()
+        if remaining_bytes is None or n_bytes <= remaining_bytes:
+            return n_bytes
+        return max(remaining_bytes, min_n_bytes)
+
+    def exhausted(self, depth: int = 0) -> bool:
+        """Check if any limit has been reached, `depth` is the depth of the object about to be generated"""
+        if not self.enabled:
+            return False
+        if self.max_depth is not None and depth > self.max_depth:
+            return True
+        if self.max_objects is not None and self.n_objects >= self.max_objects:
+            return True
+        if self.max_bytes is not None and self.n_bytes >= self.max_bytes:
+            return True
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return True
+        return False
@@ -1,5 +1,6 @@
 import zlib
 import hashlib
+from typing import Any, BinaryIO, Callable
 
 
 def crc32(data: bytes) -> bytes:
@@ -48,3 +49,47 @@ def sha3_512(data: bytes) -> bytes:
 
 def zlib_(data: bytes) -> bytes:
     return zlib.compress(data)
+
+
+class Crc32():
+    """Running CRC-32, with the interface of the `hashlib` objects"""
+
+    def __init__(self) -> None:
+        self.value = 0
+
+    def update(self, data: bytes) -> None:
+        self.value = zlib.crc32(data, self.value)
+
+    def digest(self) -> bytes:
+        return int.to_bytes(self.value, 4)
+
+
+class HashSink():
+    """Sink that feeds everything written to it into a hash object"""
+
+    def __init__(self, hash_obj: Any) -> None:
+        self.hash_obj = hash_obj
+        self.write = hash_obj.update
+
+
+HASH_CONSTRUCTORS = {
+    "crc32": Crc32,
+    "md5": lambda: hashlib.md5(usedforsecurity=False),
+    "sha1": lambda: hashlib.sha1(usedforsecurity=False),
+    "sha224": hashlib.sha224,
+    "sha256": hashlib.sha256,
+    "sha384": hashlib.sha384,
+    "sha512": hashlib.sha512,
+    "sha3_224": hashlib.sha3_224,
+    "sha3_256": hashlib.sha3_256,
+    "sha3_384": hashlib.sha3_384,
+    "sha3_512": hashlib.sha3_512,
+}
+
+
+def digest(hash_name: str, *write_fns: Callable[[BinaryIO], None]) -> bytes:
+    """Hash the data written by every function in `write_fns`, in order, as if it was concatenated"""
+    sink = HashSink(HASH_CONSTRUCTORS[hash_name]())
+    for write_fn in write_fns:
+        write_fn(sink)
+    return sink.hash_obj.digest()
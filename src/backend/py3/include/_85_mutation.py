@@ -0,0 +1,143 @@
+from typing import Any, Callable, List, Optional, Tuple
+
+
+def find_field(obj: Any, child: Any) -> Optional[str]:
+    """Get the name of the field of `obj` that holds `child`, directly or as an item of a repeated field. None if `obj`
+    does not hold `child` anymore."""
+    for name in obj.__slots__:
+        if name.startswith("_"):
+            continue
+        value = getattr(obj, name, None)
+        if value is child or (isinstance(value, list) and any(item is child for item in value)):
+            return name
+    return None
+
+
+def is_attached(obj: Any) -> bool:
+    """Check if an object is still part of its tree, an object is dropped when the field holding it is generated again"""
+    while obj._parent is not None:
+        if find_field(obj._parent, obj) is None:
+            return False
+        obj = obj._parent
+    return True
+
+
+def invalidate(objects: List[Any]) -> List[Tuple[Any, str]]:
+    """Drop the serialised bytes of objects that changed and of their ancestors, then generate the fields of the
+    ancestors that depend on them again, deepest first, so each of them is generated once however many of the objects
+    below it changed. Objects that did not change keep their serialised bytes. Return the fields generated again."""
+    held_by = {}
+    # Holds the objects too, so their IDs are not reused
+    visited = {}
+    for obj in objects:
+        while id(obj) not in visited:
+            visited[id(obj)] = obj
+            obj._cached = False
+            obj._io = SeekableBuffer()
+            parent = obj._parent
+            if parent is None:
+                break
+            name = find_field(parent, obj)
+            parent._bytes_cache.pop(name, None)
+            held_by[(id(parent), name)] = (parent, name)
+            obj = parent
+    regenerated = []
+    for parent, name in sorted(held_by.values(), key=lambda field: field[0]._depth, reverse=True):
+        for dependent in parent._dependents.get(name, ()):
+            getattr(parent, f"_generate_{dependent}")()
+            regenerated.append((parent, dependent))
+    return regenerated
+
+
+def regenerate_field(obj: Any, name: str) -> List[Tuple[Any, str]]:
+    """Generate a field again, followed by the fields of the same object that depend on it. Return the fields generated
+    again. The object has to be invalidated afterwards."""
+    getattr(obj, f"_generate_{name}")()
+    regenerated = [(obj, name)]
+    for dependent in obj._dependents.get(name, ()):
+        getattr(obj, f"_generate_{dependent}")()
+        regenerated.append((obj, dependent))
+    return regenerated
+
+
+def resolve_object_ref(obj: Any, path: Tuple[str, ...]) -> List[Tuple[Any, str]]:
+    """Get the fields read by an attribute chain of another object, such as `_root.ihdr.height`: the `ihdr` field of the
+    root object and the `height` field of the object it holds"""
+    fields = []
+    for name in path:
+        if name == "_root":
+            obj = obj._root
+        elif name == "_parent":
+            obj = obj._parent
+        else:
+            fields.append((obj, name))
+            obj = getattr(obj, name, None)
+        if not hasattr(obj, "_object_ref"):
+            # Not an object generated by the fuzzer, such as a number or a list of objects
+            break
+    return fields
+
+
+def get_object_dependents(root: Any) -> dict[Tuple[int, str], List[Tuple[Any, str]]]:
+    """Map every field read by a field of another object, by the ID of its object and its name, to the fields reading it.
+    The fields of an object come before the ones of the objects it holds."""
+    dependents = {}
+    objects = [root]
+    while len(objects) > 0:
+        obj = objects.pop()
+        for name, paths in obj._object_ref.items():
+            for path in paths:
+                for ref_obj, ref_name in resolve_object_ref(obj, path):
+                    dependents.setdefault((id(ref_obj), ref_name), []).append((obj, name))
+        children = []
+        for name in obj.__slots__:
+            if name.startswith("_"):
+                continue
+            value = getattr(obj, name, None)
+            children.extend(item for item in (value if isinstance(value, list) else [value]) if hasattr(item, "_object_ref"))
+        objects.extend(reversed(children))
+    return dependents
+
+
+def regenerate_fields(root: Any, obj: Any, name: str) -> None:
+    """Generate a field again, followed by the fields that depend on it, in the same object or in another one. A field
+    is generated at most once, so fields that depend on each other through other objects cannot loop forever."""
+    changed = regenerate_field(obj, name)
+    changed.extend(invalidate([obj]))
+    # Holds the objects too, so the IDs of the dropped ones are not reused
+    done = {(id(changed_obj), changed_name): changed_obj for changed_obj, changed_name in changed}
+    while len(changed) > 0:
+        dependents = get_object_dependents(root)
+        pending = []
+        for changed_obj, changed_name in changed:
+            for dependent_obj, dependent_name in dependents.get((id(changed_obj), changed_name), ()):
+                if (id(dependent_obj), dependent_name) not in done:
+                    done[(id(dependent_obj), dependent_name)] = dependent_obj
+                    pending.append((dependent_obj, dependent_name))
+        changed = []
+        for dependent_obj, dependent_name in pending:
+            # Objects held by a field generated again before are replaced by new ones, generated from the new values
+            if is_attached(dependent_obj):
+                changed.extend(regenerate_field(dependent_obj, dependent_name))
+        changed.extend(invalidate([changed_obj for changed_obj, _ in changed]))
+        for changed_obj, changed_name in changed:
+            done[(id(changed_obj), changed_name)] = changed_obj
+
+
+def mutate(root: Any, reset_static: Callable[[], None]) -> None:
+    """Generate one field of an object tree again. The field is picked by walking down from the root. A field holding
+    nested objects is picked as a whole, or one of the nested objects is walked into, with the same probability."""
+    obj = root
+    while len(obj._mutable_fields) > 0:
+        name = ks_helper.rand_choice(obj._mutable_fields)
+        value = getattr(obj, name)
+        children = [item for item in (value if isinstance(value, list) else [value])
+                    if len(getattr(item, "_mutable_fields", ())) > 0]
+        child_index = ks_helper.rand_int(0, len(children))
+        if child_index < len(children):
+            obj = children[child_index]
+            continue
+        # The field may take values from static variables again
+        reset_static()
+        regenerate_fields(root, obj, name)
+        return
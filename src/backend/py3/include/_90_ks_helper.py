@@ -1,6 +1,11 @@
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
 from random import Random
+import hashlib
 import struct
-from typing import Any, Optional, Literal, Sequence, TypeVar
+import sys
+from typing import Any, BinaryIO, Iterator, Mapping, NamedTuple, Optional, Literal, Sequence, TypeVar
 
 
 UTF8_CODEPOINT_MIN_RANGE = 0
@@ -16,13 +21,102 @@ UTF8_CODEPOINT_TWO_BYTE_MAX_RANGE = 0x07FF
 UTF8_CODEPOINT_THREE_BYTE_MAX_RANGE = 0xFFFF
 UTF8_CODEPOINT_FOUR_BYTE_MAX_RANGE = UTF8_CODEPOINT_MAX_RANGE
 ENABLE_UTF8_SURROGATE = False  # Must be False since Python cannot encode surrogate
+UTF8_MAX_SEQUENCE_SIZE = 4
+# Largest code point that fits into the number of bytes remaining
+UTF8_CODEPOINT_MAX_RANGE_BY_SIZE = (None, UTF8_CODEPOINT_ONE_BYTE_MAX_RANGE,
+                                    UTF8_CODEPOINT_TWO_BYTE_MAX_RANGE, UTF8_CODEPOINT_THREE_BYTE_MAX_RANGE)
+UTF8_SURROGATE_SIZE = UTF8_CODEPOINT_SURROGATE_MAX_RANGE - UTF8_CODEPOINT_SURROGATE_MIN_RANGE + 1
+# Number of code points that can be encoded, surrogates are skipped by shifting the code points above them
+UTF8_N_CODEPOINTS = UTF8_CODEPOINT_MAX_RANGE + 1 - (0 if ENABLE_UTF8_SURROGATE else UTF8_SURROGATE_SIZE)
+RAND_BYTES_CHUNK_SIZE = 65536
+LAZY_BYTES_THRESHOLD = 2**20
+# Largest range that `rand_int_array` draws from with `Random.choices`, it only has 53 bits of randomness per item
+RAND_CHOICES_MAX_SPAN = 2**32
+# Number of draws `rand_pop` tries before picking among the weights of the values left one by one
+REJECTION_MAX_TRIES = 32
+# (item size, signed) -> array typecode, sizes of the C types are platform dependent
+INT_ARRAY_TYPECODE = {}
+for _typecode in "bBhHiIlLqQ":
+    INT_ARRAY_TYPECODE.setdefault((array(_typecode).itemsize, _typecode.islower()), _typecode)
+
+# Encoding (lower case) -> (bytes defined in the encoding, translation table), filled on first use
+BYTE_ALPHABETS = {}
 
 T = TypeVar('T')
+ISO8859Encoding = Literal["ISO8859-1", "ISO8859-2", "ISO8859-3", "ISO8859-4", "ISO8859-5", "ISO8859-6", "ISO8859-7", "ISO8859-8", "ISO8859-9",
+                          "ISO8859-10", "ISO8859-11", "ISO8859-13", "ISO8859-14", "ISO8859-15", "ISO8859-16"]
+
+
+class ChoiceWeights(NamedTuple):
+    """Weights of the options of a choice point, with the largest one and their alias table (see `KsHelper.alias_table`)"""
+    weights: tuple[float, ...]
+    max_weight: float
+    prob: tuple[float, ...]
+    alias: tuple[int, ...]
+
+
+class LazyRandomBytes():
+    """Random bytes generated from their own seed only when they are used. The bytes are produced in chunks, so they
+    can be written to a sink without holding all of them in memory."""
+
+    def __init__(self, n_bytes: int, seed: int) -> None:
+        if n_bytes < 0:
+            raise ValueError("Number of bytes cannot be less than 0.")
+        self.n_bytes = n_bytes
+        self.seed = seed
+
+    def iter_chunks(self) -> Iterator[bytes]:
+        rng = Random(self.seed)
+        remaining_bytes = self.n_bytes
+        while remaining_bytes > 0:
+            chunk_size = min(remaining_bytes, RAND_BYTES_CHUNK_SIZE)
+            yield rng.randbytes(chunk_size)
+            remaining_bytes -= chunk_size
+
+    def __bytes__(self) -> bytes:
+        return b"".join(self.iter_chunks())
+
+    def __len__(self) -> int:
+        return self.n_bytes
 
 
 class KsHelper:
-    def __init__(self, seed: Any = None) -> None:
+    """Source of the random decisions of the generated code.
+
+    Decisions made at a choice point, such as `-fz-choice`, `-fz-random-order`, enum and repeat count fields, are
+    identified by the ID of the choice point, `<class>.<field>` (`<class>.<field>.count` for repeat counts). Every
+    option of a choice point is equally likely unless it is given weights with `set_choice_weights`, and the option
+    picked at every choice point is appended to `trace` as `(ID, option index)` if `trace` is a list.
+    """
+
+    def __init__(self, seed: Any = None, budget: Optional["Budget"] = None) -> None:
         self.rng = Random(seed)
+        # Random data generated is counted against the budget, if any
+        self.budget = budget
+        # Choice point ID -> `ChoiceWeights`. The weights may be set from another thread while samples are generated, so
+        # the dict is never modified, it is replaced as a whole, and a draw reads the weights of a point from it once.
+        self._choices: dict[str, ChoiceWeights] = {}
+        # Choice point ID -> value -> option index, for `-fz-random-order` fields
+        self._option_indices = {}
+        self.trace: Optional[list[tuple[str, int]]] = None
+
+    @staticmethod
+    def derive_seed(seed: int, index: int) -> int:
+        """Derive the seed of the `index`-th independent stream from a master seed."""
+        if index < 0:
+            raise ValueError("Index cannot be negative.")
+        digest = hashlib.blake2b(f"{seed}:{index}".encode(encoding="ascii"), digest_size=8).digest()
+        return int.from_bytes(digest, byteorder="big")
+
+    def seed(self, seed: Any = None) -> None:
+        self.rng.seed(seed)
+
+    def seed_sample(self, seed: int, index: int) -> None:
+        """Seed the generator for sample `index` of the run using master seed `seed`.
+
+        Every sample gets its own random stream, so any sample can be regenerated without generating the ones before it.
+        """
+        self.rng.seed(KsHelper.derive_seed(seed, index))
 
     @staticmethod
     def _utf8_byte_size(codepoint: int) -> int:
@@ -38,111 +132,153 @@ class KsHelper:
             return 4
         raise ValueError("UTF-8 codepoint out of range")
 
-    def rand_bytes(self, n_bytes: int, min_n_bytes: int = 0, max_n_bytes: Optional[int] = None) -> bytes:
-        """Generate `n_bytes` if it is a valid value, otherwise, generate based on `min_n_bytes` and `max_n_bytes`."""
+    @staticmethod
+    def write_bytes(sink: BinaryIO, data: bytes | LazyRandomBytes) -> None:
+        """Write a byte field to a sink, lazy random bytes are written chunk by chunk."""
+        if isinstance(data, LazyRandomBytes):
+            for chunk in data.iter_chunks():
+                sink.write(chunk)
+        else:
+            sink.write(data)
+
+    def _rand_n_bytes(self, n_bytes: int, min_n_bytes: int = 0, max_n_bytes: Optional[int] = None) -> int:
         if n_bytes < 0 and max_n_bytes is not None:
             if max_n_bytes < 0:
                 raise ValueError("`max_n_bytes` cannot be less than 0.")
             if min_n_bytes < 0:
                 raise ValueError("`min_n_bytes` cannot be less than 0.")
+            if self.budget is not None:
+                max_n_bytes = self.budget.limit_bytes(max_n_bytes, min_n_bytes)
             n_bytes = self.rng.randint(min_n_bytes, max_n_bytes)
         if n_bytes < 0:
             raise ValueError("Number of bytes cannot be less than 0.")
-        result = bytes()
-        C_INT_MAX = 65536
+        self._spend_bytes(n_bytes)
+        return n_bytes
+
+    def _spend_bytes(self, n_bytes: int) -> None:
+        if self.budget is not None:
+            self.budget.n_bytes += n_bytes
+
+    def _limit_items(self, n_items: int, item_size: int) -> int:
+        """Shrink the number of items of an array to the bytes left in the budget"""
+        if self.budget is not None:
+            n_items = self.budget.limit_bytes(n_items * item_size) // item_size
+        self._spend_bytes(n_items * item_size)
+        return n_items
+
+    def rand_bytes(self, n_bytes: int, min_n_bytes: int = 0, max_n_bytes: Optional[int] = None) -> bytes:
+        """Generate `n_bytes` if it is a valid value, otherwise, generate based on `min_n_bytes` and `max_n_bytes`."""
+        return self._rand_bytes(self._rand_n_bytes(n_bytes, min_n_bytes, max_n_bytes))
+
+    def _rand_bytes(self, n_bytes: int) -> bytes:
+        """Generate `n_bytes` without counting them against the budget"""
+        result = []
         remaining_bytes = n_bytes
         # Workaround for n_bytes that is larger than C int
         while remaining_bytes > 0:
-            result += self.rng.randbytes(C_INT_MAX if remaining_bytes
-                                         > C_INT_MAX else remaining_bytes)
-            remaining_bytes -= C_INT_MAX
-        return result
+            result.append(self.rng.randbytes(min(remaining_bytes, RAND_BYTES_CHUNK_SIZE)))
+            remaining_bytes -= RAND_BYTES_CHUNK_SIZE
+        return b"".join(result)
 
-    def rand_utf8(self, n_bytes: int, terminator: Optional[bytes] = None, min_n_bytes: int = 0, max_n_bytes: Optional[int] = None) -> str:
-        if n_bytes < 0 and max_n_bytes is not None:
-            if max_n_bytes < 0:
-                raise ValueError("`max_n_bytes` cannot be less than 0.")
-            if min_n_bytes < 0:
-                raise ValueError("`min_n_bytes` cannot be less than 0.")
-            n_bytes = self.rng.randint(min_n_bytes, max_n_bytes)
-        if n_bytes < 0:
-            raise ValueError("Number of bytes cannot be less than 0.")
-        bytes_remaining = n_bytes
+    def rand_bytes_lazy(self, n_bytes: int, min_n_bytes: int = 0, max_n_bytes: Optional[int] = None) -> bytes | LazyRandomBytes:
+        """Same as `rand_bytes`, except more than `LAZY_BYTES_THRESHOLD` bytes are only generated when they are used."""
+        n_bytes = self._rand_n_bytes(n_bytes, min_n_bytes, max_n_bytes)
+        if n_bytes > LAZY_BYTES_THRESHOLD:
+            return LazyRandomBytes(n_bytes, self.rng.getrandbits(64))
+        return self._rand_bytes(n_bytes)
+
+    def _rand_str_n_bytes(self, n_bytes: int, terminator: Optional[bytes], min_n_bytes: int, max_n_bytes: Optional[int]) -> int:
+        """Number of bytes to generate before the terminator"""
+        n_bytes = self._rand_n_bytes(n_bytes, min_n_bytes, max_n_bytes)
         if terminator is not None:
-            bytes_remaining -= 1
-            if bytes_remaining < 0:
+            n_bytes -= 1
+            if n_bytes < 0:
                 raise ValueError("Terminator cannot fit into the specified size.")
-        ret = ""
+        return n_bytes
+
+    def _rand_utf8_codepoint(self, max_codepoint: int) -> int:
+        while True:
+            codepoint = self.rng.randint(UTF8_CODEPOINT_MIN_RANGE, max_codepoint)
+            if (ENABLE_UTF8_SURROGATE
+                    or codepoint < UTF8_CODEPOINT_SURROGATE_MIN_RANGE
+                    or codepoint > UTF8_CODEPOINT_SURROGATE_MAX_RANGE):
+                return codepoint
+
+    def rand_utf8_bytes(self, n_bytes: int, terminator: Optional[bytes] = None, min_n_bytes: int = 0, max_n_bytes: Optional[int] = None) -> bytes:
+        """Generate exactly `n_bytes` of UTF-8 encoded text, including the terminator.
+
+        Code points are picked uniformly from the ones that still fit. While 4 or more bytes remain, every code point
+        fits, so they are drawn and encoded in batches.
+        """
+        bytes_remaining = self._rand_str_n_bytes(n_bytes, terminator, min_n_bytes, max_n_bytes)
+        result = []
+        while bytes_remaining >= UTF8_MAX_SEQUENCE_SIZE:
+            codepoints = self.rng.choices(range(UTF8_N_CODEPOINTS), k=bytes_remaining // UTF8_MAX_SEQUENCE_SIZE)
+            if not ENABLE_UTF8_SURROGATE:
+                codepoints = [codepoint + UTF8_SURROGATE_SIZE if codepoint >= UTF8_CODEPOINT_SURROGATE_MIN_RANGE else codepoint
+                              for codepoint in codepoints]
+            encoded = "".join(map(chr, codepoints)).encode("utf-8")
+            result.append(encoded)
+            bytes_remaining -= len(encoded)
         while bytes_remaining > 0:
-            if bytes_remaining == 1:
-                code_point = self.rng.randint(
-                    UTF8_CODEPOINT_MIN_RANGE, UTF8_CODEPOINT_ONE_BYTE_MAX_RANGE)
-            elif bytes_remaining == 2:
-                code_point = self.rng.randint(
-                    UTF8_CODEPOINT_MIN_RANGE, UTF8_CODEPOINT_TWO_BYTE_MAX_RANGE)
-            elif bytes_remaining == 3:
-                code_point = self.rng.randint(
-                    UTF8_CODEPOINT_MIN_RANGE, UTF8_CODEPOINT_THREE_BYTE_MAX_RANGE)
-            else:
-                code_point = self.rng.randint(
-                    UTF8_CODEPOINT_MIN_RANGE, UTF8_CODEPOINT_MAX_RANGE)
+            codepoint = self._rand_utf8_codepoint(UTF8_CODEPOINT_MAX_RANGE_BY_SIZE[bytes_remaining])
+            result.append(chr(codepoint).encode("utf-8"))
+            bytes_remaining -= KsHelper._utf8_byte_size(codepoint)
+        if terminator is not None:
+            result.append(terminator)
+        return b"".join(result)
+
+    def rand_utf8(self, n_bytes: int, terminator: Optional[bytes] = None, min_n_bytes: int = 0, max_n_bytes: Optional[int] = None) -> str:
+        return self.rand_utf8_bytes(n_bytes, terminator, min_n_bytes, max_n_bytes).decode("utf-8")
+
+    @staticmethod
+    def _byte_alphabet(encoding: str) -> tuple[bytes, Optional[bytes]]:
+        """Bytes that are defined in a single byte encoding, and a translation table mapping random bytes uniformly to
+        them (None if the number of defined bytes does not divide 256)."""
+        key = encoding.lower()
+        if key not in BYTE_ALPHABETS:
+            alphabet = bytearray()
+            for i in range(256):
+                try:
+                    bytes((i, )).decode(encoding)
+                except UnicodeDecodeError:
+                    continue
+                alphabet.append(i)
+            table = None
+            if 256 % len(alphabet) == 0:
+                table = bytes(alphabet[i % len(alphabet)] for i in range(256))
+            BYTE_ALPHABETS[key] = (bytes(alphabet), table)
+        return BYTE_ALPHABETS[key]
 
-            if (not ENABLE_UTF8_SURROGATE
-                    and code_point >= UTF8_CODEPOINT_SURROGATE_MIN_RANGE
-                    and code_point <= UTF8_CODEPOINT_SURROGATE_MAX_RANGE):
-                continue
+    def rand_encoded_bytes(self, n_bytes: int, encoding: str) -> bytes:
+        """Generate `n_bytes` bytes that are each valid on their own in a single byte encoding."""
+        alphabet, table = KsHelper._byte_alphabet(encoding)
+        if len(alphabet) == 256:
+            return self._rand_bytes(n_bytes)
+        if table is not None:
+            return self._rand_bytes(n_bytes).translate(table)
+        return bytes(self.rng.choices(alphabet, k=n_bytes))
 
-            ret += chr(code_point)
-            bytes_remaining -= KsHelper._utf8_byte_size(code_point)
+    def rand_ascii_bytes(self, n_bytes: int, terminator: Optional[bytes] = None, min_n_bytes: int = 0, max_n_bytes: Optional[int] = None) -> bytes:
+        result = self.rand_encoded_bytes(self._rand_str_n_bytes(n_bytes, terminator, min_n_bytes, max_n_bytes), "ascii")
         if terminator is not None:
-            ret += terminator.decode(encoding="utf-8")
-        return ret
+            result += terminator
+        return result
 
     def rand_ascii(self, n_bytes: int, terminator: Optional[bytes] = None, min_n_bytes: int = 0, max_n_bytes: Optional[int] = None) -> str:
-        encoding = "ascii"
-        if n_bytes < 0 and max_n_bytes is not None:
-            if max_n_bytes < 0:
-                raise ValueError("`max_n_bytes` cannot be less than 0.")
-            if min_n_bytes < 0:
-                raise ValueError("`min_n_bytes` cannot be less than 0.")
-            n_bytes = self.rng.randint(min_n_bytes, max_n_bytes)
-        if n_bytes < 0:
-            raise ValueError("Number of bytes cannot be less than 0.")
-        bytes_remaining = n_bytes
-        if terminator is not None:
-            bytes_remaining -= 1
-            if bytes_remaining < 0:
-                raise ValueError("Terminator cannot fit into the specified size.")
-        ret = b""
-        b_length = 1
-        while bytes_remaining > 0:
-            code_point = self.rng.randint(0, 127)
-            ret += int.to_bytes(code_point, length=b_length)
-            bytes_remaining -= b_length
-        if terminator is not None:
-            ret += terminator
-        return ret.decode(encoding=encoding)
+        return self.rand_ascii_bytes(n_bytes, terminator, min_n_bytes, max_n_bytes).decode("ascii")
 
-    def rand_iso8859(self, n_bytes: int, encoding: Literal["ISO8859-1", "ISO8859-2", "ISO8859-3", "ISO8859-4", "ISO8859-5", "ISO8859-6", "ISO8859-7", "ISO8859-8", "ISO8859-9", "ISO8859-10", "ISO8859-11", "ISO8859-13", "ISO8859-14", "ISO8859-15", "ISO8859-16"], terminator: Optional[bytes] = None, min_n_bytes: int = 0, max_n_bytes: Optional[int] = None) -> str:
+    def rand_iso8859_bytes(self, n_bytes: int, encoding: ISO8859Encoding, terminator: Optional[bytes] = None, min_n_bytes: int = 0, max_n_bytes: Optional[int] = None) -> bytes:
+        """Generate ISO 8859 encoded text, the positions that are not defined by the encoding are never generated."""
         if not encoding.lower().startswith("iso8859"):
             raise ValueError("Invalid ISO 8859 encoding type.")
-        if n_bytes < 0 and max_n_bytes is not None:
-            if max_n_bytes < 0:
-                raise ValueError("`max_n_bytes` cannot be less than 0.")
-            if min_n_bytes < 0:
-                raise ValueError("`min_n_bytes` cannot be less than 0.")
-            n_bytes = self.rng.randint(min_n_bytes, max_n_bytes)
-        if n_bytes < 0:
-            raise ValueError("Number of bytes cannot be less than 0.")
-        bytes_remaining = n_bytes
-        if terminator is not None:
-            bytes_remaining -= 1
-            if bytes_remaining < 0:
-                raise ValueError("Terminator cannot fit into the specified size.")
-        ret = self.rand_bytes(bytes_remaining)
+        result = self.rand_encoded_bytes(self._rand_str_n_bytes(n_bytes, terminator, min_n_bytes, max_n_bytes), encoding)
         if terminator is not None:
-            ret += terminator
-        return ret.decode(encoding=encoding)
+            result += terminator
+        return result
+
+    def rand_iso8859(self, n_bytes: int, encoding: ISO8859Encoding, terminator: Optional[bytes] = None, min_n_bytes: int = 0, max_n_bytes: Optional[int] = None) -> str:
+        return self.rand_iso8859_bytes(n_bytes, encoding, terminator, min_n_bytes, max_n_bytes).decode(encoding)
 
     def rand_int(self, start: int = -32767, end: int = 32767) -> int:
         return self.rng.randint(start, end)
@@ -153,5 +289,182 @@ class KsHelper:
     def rand_double(self) -> float:
         return struct.unpack("=d", self.rand_bytes(8))[0]
 
-    def rand_choice(self, seq: Sequence[T]) -> T:
-        return self.rng.choice(seq)
+    def rand_int_array(self, n_items: int, start: int, end: int, item_size: int, signed: bool) -> array:
+        """Generate `n_items` integers between `start` and `end` (inclusive) in one go, as an array of `item_size` byte
+        integers."""
+        if n_items < 0:
+            raise ValueError("Number of items cannot be less than 0.")
+        if start > end:
+            raise ValueError("`start` cannot be greater than `end`.")
+        n_items = self._limit_items(n_items, item_size)
+        result = array(INT_ARRAY_TYPECODE[(item_size, signed)])
+        n_bits = item_size * 8
+        type_min, type_max = (-(1 << (n_bits - 1)), (1 << (n_bits - 1)) - 1) if signed else (0, (1 << n_bits) - 1)
+        if start < type_min or end > type_max:
+            raise ValueError("Range does not fit into the item size.")
+        if start == type_min and end == type_max:
+            # Every bit pattern is valid
+            result.frombytes(self._rand_bytes(n_items * item_size))
+        elif end - start < RAND_CHOICES_MAX_SPAN:
+            result.extend(self.rng.choices(range(start, end + 1), k=n_items))
+        else:
+            randint = self.rng.randint
+            result.extend(randint(start, end) for _ in range(n_items))
+        return result
+
+    def rand_float_array(self, n_items: int) -> array:
+        """Same as calling `rand_float` `n_items` times, as an array."""
+        result = array("f")
+        result.frombytes(self._rand_bytes(self._limit_items(n_items, result.itemsize) * result.itemsize))
+        return result
+
+    def rand_double_array(self, n_items: int) -> array:
+        """Same as calling `rand_double` `n_items` times, as an array."""
+        result = array("d")
+        result.frombytes(self._rand_bytes(self._limit_items(n_items, result.itemsize) * result.itemsize))
+        return result
+
+    @staticmethod
+    def array_to_bytes(arr: array, byteorder: Literal["little", "big"]) -> bytes:
+        """Pack all items of an array with the specified byte order."""
+        if byteorder != sys.byteorder and arr.itemsize > 1:
+            arr = array(arr.typecode, arr)
+            arr.byteswap()
+        return arr.tobytes()
+
+    @staticmethod
+    def alias_table(weights: Sequence[float]) -> tuple[tuple[float, ...], tuple[int, ...]]:
+        """Build the alias table of some weights with Vose's method: option `i` is kept with probability `prob[i]`,
+        otherwise replaced with `alias[i]`, after picking `i` uniformly. Weighted draws then take constant time."""
+        if any(weight < 0 for weight in weights) or sum(weights) <= 0:
+            raise ValueError("Weights must not be negative, and must not be all 0")
+        n_options = len(weights)
+        total = sum(weights)
+        prob = [weight * n_options / total for weight in weights]
+        alias = list(range(n_options))
+        small = [i for i, p in enumerate(prob) if p < 1]
+        large = [i for i, p in enumerate(prob) if p >= 1]
+        while len(small) > 0 and len(large) > 0:
+            i, j = small.pop(), large[-1]
+            alias[i] = j
+            prob[j] -= 1 - prob[i]
+            if prob[j] < 1:
+                small.append(large.pop())
+        # Left overs are only off 1 by rounding errors
+        for i in small + large:
+            prob[i] = 1.0
+        return tuple(prob), tuple(alias)
+
+    @property
+    def choice_weights(self) -> dict[str, list[float]]:
+        """Weights of the choice points, ID -> weights in option order"""
+        return {point: list(choice.weights) for point, choice in self._choices.items()}
+
+    @property
+    def alias_tables(self) -> dict[str, tuple[tuple[float, ...], tuple[int, ...]]]:
+        """Alias tables of the weights of the choice points, ID -> `(prob, alias)`"""
+        return {point: (choice.prob, choice.alias) for point, choice in self._choices.items()}
+
+    def set_choice_weights(self, choice_weights: Mapping[str, Sequence[float]],
+                           alias_tables: Mapping[str, tuple[Sequence[float], Sequence[int]]] = {}) -> None:
+        """Set the weight of every option of some choice points, ID -> weights in option order, and forget the weights
+        of the other choice points. Weights are ignored at a choice point with another number of options, the options
+        are then equally likely. The alias tables of the weights are built unless given in `alias_tables`."""
+        self._choices = KsHelper._build_choices(choice_weights, alias_tables)
+
+    def update_choice_weights(self, choice_weights: Mapping[str, Sequence[float]]) -> None:
+        """Set the weights of some choice points, keeping the weights of the other ones"""
+        # The other points are taken from a single snapshot, and the alias tables are only built for the new weights
+        self._choices = {**self._choices, **KsHelper._build_choices(choice_weights, {})}
+
+    @staticmethod
+    def _build_choices(choice_weights: Mapping[str, Sequence[float]],
+                       alias_tables: Mapping[str, tuple[Sequence[float], Sequence[int]]]) -> dict[str, ChoiceWeights]:
+        choices = {}
+        for point, weights in choice_weights.items():
+            try:
+                prob, alias = alias_tables[point] if point in alias_tables else KsHelper.alias_table(weights)
+            except ValueError as e:
+                raise ValueError(f"Invalid weights of `{point}`: {e}") from None
+            choices[point] = ChoiceWeights(tuple(weights), max(weights), tuple(prob), tuple(alias))
+        return choices
+
+    def _rand_option(self, point: str, n_options: int, choice: Optional[ChoiceWeights]) -> int:
+        """Pick the index of an option of a choice point with the weights `choice`, and record it in the trace"""
+        if choice is not None and len(choice.prob) == n_options:
+            # The integer part picks a column of the table, the fractional part decides between it and its alias
+            x = self.rng.random() * n_options
+            index = int(x)
+            if x - index >= choice.prob[index]:
+                index = choice.alias[index]
+        else:
+            # Same draw as `rng.choice`, so a choice point without weights gives the same samples as before
+            index = self.rng.randrange(n_options)
+        if self.trace is not None:
+            self.trace.append((point, index))
+        return index
+
+    def _is_tracked(self, point: Optional[str]) -> bool:
+        return point is not None and (self.trace is not None or point in self._choices)
+
+    def rand_choice(self, seq: Sequence[T], point: Optional[str] = None) -> T:
+        if not self._is_tracked(point):
+            return self.rng.choice(seq)
+        return seq[self._rand_option(point, len(seq), self._choices.get(point))]
+
+    def rand_count(self, start: int, end: int, point: Optional[str] = None) -> int:
+        """Pick a repeat count between `start` and `end` (inclusive). The options of the choice point are ranges of
+        counts doubling in size: `start`, `start + 1`, `start + 2` to `start + 3`, `start + 4` to `start + 7`..."""
+        if not self._is_tracked(point):
+            return self.rng.randint(start, end)
+        if start > end:
+            raise ValueError("`start` cannot be greater than `end`.")
+        n_options = (end - start).bit_length() + 1
+        choice = self._choices.get(point)
+        if choice is not None and len(choice.prob) == n_options:
+            option = self._rand_option(point, n_options, choice)
+            low = (1 << option) >> 1
+            high = min((1 << option) - 1, end - start)
+            return start + low + self.rng.randrange(high - low + 1)
+        count = self.rng.randint(start, end)
+        if self.trace is not None:
+            self.trace.append((point, (count - start).bit_length()))
+        return count
+
+    def rand_pop(self, items: list[T], point: Optional[str] = None, options: Sequence[T] = ()) -> T:
+        """Remove a random item from `items`, the values left of the `-fz-random-order` list `options`. Weights of the
+        choice point apply to the options, in the order of `options`. The order of the items left is not kept, the
+        last item takes the place of the one removed."""
+        if not self._is_tracked(point):
+            index = self.rng.randrange(len(items))
+        else:
+            option_indices = self._option_indices.get(point)
+            if option_indices is None:
+                option_indices = self._option_indices[point] = {value: i for i, value in reversed(list(enumerate(options)))}
+            choice = self._choices.get(point)
+            if choice is not None and len(choice.weights) == len(options):
+                index = self._rand_weighted_index(items, choice.weights, option_indices, choice.max_weight)
+            else:
+                index = self.rng.randrange(len(items))
+            if self.trace is not None:
+                self.trace.append((point, option_indices[items[index]]))
+        item = items[index]
+        items[index] = items[-1]
+        items.pop()
+        return item
+
+    def _rand_weighted_index(self, items: list[T], weights: Sequence[float], option_indices: dict[T, int], max_weight: float) -> int:
+        """Pick the index of an item of `items` by the weight of its option. Items are drawn uniformly and kept with
+        probability `weight / max_weight`, which takes constant time while the values left hold most of the weight.
+        Falls back to the cumulative weights of the values left."""
+        randrange, random = self.rng.randrange, self.rng.random
+        n_items = len(items)
+        for _ in range(REJECTION_MAX_TRIES):
+            index = randrange(n_items)
+            weight = weights[option_indices[items[index]]]
+            if weight > 0 and (weight >= max_weight or random() * max_weight < weight):
+                return index
+        cum = list(accumulate(weights[option_indices[item]] for item in items))
+        if cum[-1] <= 0:
+            return randrange(n_items)
+        return bisect_right(cum, random() * cum[-1], 0, n_items - 1)
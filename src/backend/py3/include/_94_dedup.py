@@ -0,0 +1,121 @@
+import hashlib
+import math
+from typing import Optional
+
+DEFAULT_EXACT_LIMIT = 1000000
+DEFAULT_BLOOM_CAPACITY = 10000000
+DEFAULT_ERROR_RATE = 1e-4
+
+
+class BloomFilter():
+    """Set of sample digests that may report a digest it has never seen (with probability `error_rate` once
+    `capacity` digests were added), but never misses one it has seen"""
+
+    def __init__(self, capacity: int, error_rate: float = DEFAULT_ERROR_RATE) -> None:
+        if capacity < 1:
+            raise ValueError("`capacity` cannot be less than 1")
+        if not 0 < error_rate < 1:
+            raise ValueError("`error_rate` must be between 0 and 1")
+        self.n_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2)**2)
+        self.n_hashes = max(1, round(self.n_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.n_bits + 7) // 8)
+
+    def _positions(self, digest: bytes) -> list[int]:
+        # Derive every position from two hashes (Kirsch and Mitzenmacher)
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:16], "little") | 1
+        return [(h1 + i * h2) % self.n_bits for i in range(self.n_hashes)]
+
+    def add(self, digest: bytes) -> bool:
+        """Add a 16 byte digest, return False if it was (probably) added before"""
+        is_new = False
+        bits = self.bits
+        for position in self._positions(digest):
+            mask = 1 << (position & 7)
+            if not bits[position >> 3] & mask:
+                bits[position >> 3] |= mask
+                is_new = True
+        return is_new
+
+    def __contains__(self, digest: bytes) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(digest))
+
+    def merge(self, other: "BloomFilter") -> None:
+        """Add every digest of a filter with the same parameters"""
+        if (self.n_bits, self.n_hashes) != (other.n_bits, other.n_hashes):
+            raise ValueError("Bloom filters with different parameters cannot be merged")
+        self.bits = bytearray(a | b for a, b in zip(self.bits, other.bits))
+
+
+class DuplicateFilter():
+    """Drop samples that were seen before.
+
+    The digests of the samples are kept in a set until there are `exact_limit` of them, then they are moved to a Bloom
+    filter sized for `bloom_capacity` digests, which uses a fixed amount of memory but drops a unique sample once in a
+    while (with probability `error_rate`).
+    """
+
+    def __init__(self, exact_limit: int = DEFAULT_EXACT_LIMIT, bloom_capacity: int = DEFAULT_BLOOM_CAPACITY, error_rate: float = DEFAULT_ERROR_RATE) -> None:
+        if exact_limit < 0:
+            raise ValueError("`exact_limit` cannot be negative")
+        self.exact_limit = exact_limit
+        self.bloom_capacity = bloom_capacity
+        self.error_rate = error_rate
+        self.digests: Optional[set[bytes]] = set()
+        self.bloom_filter: Optional[BloomFilter] = None
+        self.n_samples = 0
+        self.n_duplicates = 0
+
+    @staticmethod
+    def digest(sample: bytes) -> bytes:
+        return hashlib.blake2b(sample, digest_size=16).digest()
+
+    def _switch_to_bloom_filter(self) -> None:
+        self.bloom_filter = BloomFilter(self.bloom_capacity, self.error_rate)
+        for digest in self.digests:
+            self.bloom_filter.add(digest)
+        self.digests = None
+
+    def add_digest(self, digest: bytes) -> bool:
+        """Record the digest of a sample, return False if it is a duplicate"""
+        self.n_samples += 1
+        if self.bloom_filter is not None:
+            is_new = self.bloom_filter.add(digest)
+        elif digest in self.digests:
+            is_new = False
+        else:
+            self.digests.add(digest)
+            is_new = True
+            if len(self.digests) > self.exact_limit:
+                self._switch_to_bloom_filter()
+        if not is_new:
+            self.n_duplicates += 1
+        return is_new
+
+    def add(self, sample: bytes) -> bool:
+        """Record a sample, return False if it is a duplicate"""
+        return self.add_digest(self.digest(sample))
+
+    def merge(self, other: "DuplicateFilter") -> None:
+        """Add the samples seen by another filter, such as the filter of another process, the counts are added up"""
+        if other.digests is not None and self.digests is not None:
+            self.digests |= other.digests
+            if len(self.digests) > self.exact_limit:
+                self._switch_to_bloom_filter()
+        else:
+            if self.bloom_filter is None:
+                self._switch_to_bloom_filter()
+            if other.bloom_filter is not None:
+                self.bloom_filter.merge(other.bloom_filter)
+            else:
+                for digest in other.digests:
+                    self.bloom_filter.add(digest)
+        self.n_samples += other.n_samples
+        self.n_duplicates += other.n_duplicates
+
+    @property
+    def duplicate_rate(self) -> float:
+        return 0.0 if self.n_samples == 0 else self.n_duplicates / self.n_samples
+
+    def report(self) -> str:
+        return f"{self.n_duplicates} of {self.n_samples} samples were duplicates ({self.duplicate_rate:.2%})"
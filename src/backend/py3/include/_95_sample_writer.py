@@ -0,0 +1,87 @@
+import os
+import struct
+from typing import BinaryIO, Callable, Optional
+
+
+class SampleWriter():
+    """Base class for the destinations that generated samples are written to"""
+
+    def write(self, index: int, sample: bytes) -> None:
+        raise NotImplementedError
+
+    def write_with(self, index: int, write_sample: Callable[[BinaryIO], None], size: Optional[int] = None) -> None:
+        """Write a sample by letting `write_sample` write it to the destination piece by piece. Some destinations need
+        the `size` of the sample up front."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> "SampleWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class DirectorySampleWriter(SampleWriter):
+    """Write every sample to its own file in a directory, named after the index of the sample"""
+
+    def __init__(self, directory: str, suffix: str = ".bin", width: int = 1) -> None:
+        if width < 1:
+            raise ValueError("`width` cannot be less than 1")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.suffix = suffix
+        self.width = width
+
+    def get_path(self, index: int) -> str:
+        if index < 0:
+            raise ValueError("Sample index cannot be negative")
+        return os.path.join(self.directory, f"{index:0{self.width}d}{self.suffix}")
+
+    def write(self, index: int, sample: bytes) -> None:
+        with open(self.get_path(index), "wb") as f:
+            f.write(sample)
+
+    def write_with(self, index: int, write_sample: Callable[[BinaryIO], None], size: Optional[int] = None) -> None:
+        with open(self.get_path(index), "wb") as f:
+            write_sample(f)
+
+
+class StreamSampleWriter(SampleWriter):
+    """Write samples one after another to a binary stream.
+
+    raw: Samples are concatenated as is.
+    length-prefixed: Every sample is preceded by its length, packed with `LENGTH_PREFIX_FORMAT`.
+    delimited: Every sample is followed by the delimiter.
+    """
+
+    FORMATS = ("raw", "length-prefixed", "delimited")
+    LENGTH_PREFIX_FORMAT = ">Q"
+
+    def __init__(self, stream: BinaryIO, stream_format: str = "raw", delimiter: bytes = b"\n") -> None:
+        if stream_format not in self.FORMATS:
+            raise ValueError(f"Unknown stream format `{stream_format}`")
+        self.stream = stream
+        self.stream_format = stream_format
+        self.delimiter = delimiter
+
+    def write(self, index: int, sample: bytes) -> None:
+        if self.stream_format == "length-prefixed":
+            self.stream.write(struct.pack(self.LENGTH_PREFIX_FORMAT, len(sample)))
+        self.stream.write(sample)
+        if self.stream_format == "delimited":
+            self.stream.write(self.delimiter)
+
+    def write_with(self, index: int, write_sample: Callable[[BinaryIO], None], size: Optional[int] = None) -> None:
+        if self.stream_format == "length-prefixed":
+            if size is None:
+                raise ValueError("The length-prefixed format needs the size of the sample before writing it")
+            self.stream.write(struct.pack(self.LENGTH_PREFIX_FORMAT, size))
+        write_sample(self.stream)
+        if self.stream_format == "delimited":
+            self.stream.write(self.delimiter)
+
+    def close(self) -> None:
+        self.stream.flush()
@@ -0,0 +1,98 @@
+import os
+import socketserver
+import stat
+import struct
+import sys
+from typing import Any, BinaryIO, Callable, Optional
+
+# Length prefix of an error response, followed by the length prefixed message
+ERROR_LENGTH = 2**64 - 1
+
+
+def parse_request(line: bytes) -> tuple[int, Optional[int], int]:
+    """Parse a request line `<count> [<seed> [<index>]]` into the number of samples, the master seed and the index of
+    the first sample"""
+    fields = line.split()
+    if len(fields) < 1 or len(fields) > 3:
+        raise ValueError("Expected `<count> [<seed> [<index>]]`")
+    count = int(fields[0])
+    seed = int(fields[1]) if len(fields) > 1 else None
+    index = int(fields[2]) if len(fields) > 2 else 0
+    if count < 0:
+        raise ValueError("Count cannot be negative")
+    if index < 0:
+        raise ValueError("Index cannot be negative")
+    return count, seed, index
+
+
+def write_error(stream: BinaryIO, message: str) -> None:
+    encoded = message.encode("utf-8")
+    stream.write(struct.pack(StreamSampleWriter.LENGTH_PREFIX_FORMAT, ERROR_LENGTH))
+    stream.write(struct.pack(StreamSampleWriter.LENGTH_PREFIX_FORMAT, len(encoded)))
+    stream.write(encoded)
+
+
+def serve_stream(create_sample: Callable[[], Any], mutate_sample: Callable[[Any], None], rfile: BinaryIO, wfile: BinaryIO) -> None:
+    """Answer the requests read from `rfile` until it is closed or an empty line is read.
+
+    Every request is answered with the samples it asked for, in the length-prefixed format, or with an error response.
+    An error response also ends the answer to a request if a sample cannot be generated, after the samples generated
+    before it. A sample is only generated once the previous one has been written, so a client that stops reading stops
+    the server instead of letting samples pile up in memory.
+    """
+    writer = StreamSampleWriter(wfile, stream_format="length-prefixed")
+    while True:
+        line = rfile.readline()
+        if len(line.strip()) == 0:
+            return
+        try:
+            count, seed, start = parse_request(line)
+            samples = iter_samples(create_sample, mutate_sample, count, seed=seed, start=start)
+            for index, sample in enumerate(samples, start=start):
+                writer.write(index, sample)
+        except (ValueError, StopGeneration) as e:
+            write_error(wfile, str(e))
+        wfile.flush()
+
+
+class SampleRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        try:
+            serve_stream(self.server.create_sample, self.server.mutate_sample, self.rfile, self.wfile)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away
+            pass
+
+
+class SampleServer(socketserver.UnixStreamServer):
+    """Serve samples over a Unix domain socket, one client at a time, so every client gets the samples that the
+    command line interface would write"""
+
+    def __init__(self, path: str, create_sample: Callable[[], Any], mutate_sample: Callable[[Any], None]) -> None:
+        # Replace a socket left behind by a previous server, but never another kind of file
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+        self.path = path
+        self.create_sample = create_sample
+        self.mutate_sample = mutate_sample
+        super().__init__(path, SampleRequestHandler)
+
+    def server_close(self) -> None:
+        super().server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def serve(path: str, create_sample: Callable[[], Any], mutate_sample: Callable[[Any], None]) -> None:
+    """Serve samples on the Unix domain socket `path`, or over stdin and stdout if `path` is `-`"""
+    if path == "-":
+        try:
+            serve_stream(create_sample, mutate_sample, sys.stdin.buffer, sys.stdout.buffer)
+        except BrokenPipeError:
+            pass
+        return
+    with SampleServer(path, create_sample, mutate_sample) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
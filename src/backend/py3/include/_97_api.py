@@ -0,0 +1,33 @@
+import itertools
+from typing import Any, Callable, Iterator, Optional
+
+
+def iter_samples(create_sample: Callable[[], Any], mutate_sample: Callable[[Any], None], count: Optional[int] = None, seed: Optional[int] = None, start: int = 0, mutate: bool = False) -> Iterator[bytes]:
+    """Generate samples in the current process, starting from sample `start`. Samples are generated forever if `count`
+    is None.
+
+    The samples are the same as the ones written by the command line interface with the same options, so a sample
+    found by an in-process harness can be reproduced with `--seed` and `--index`.
+    """
+    if count is not None and count < 0:
+        raise ValueError("`count` cannot be negative")
+    if start < 0:
+        raise ValueError("`start` cannot be negative")
+    if start > 0 and seed is None:
+        raise ValueError("`start` requires `seed`")
+    indices = itertools.count(start) if count is None else range(start, start + count)
+    if mutate:
+        sample = None
+        for index in indices:
+            if sample is None:
+                if seed is not None:
+                    ks_helper.seed_sample(seed, index)
+                sample = create_sample()
+            else:
+                mutate_sample(sample)
+            yield sample.result()
+        return
+    for index in indices:
+        if seed is not None:
+            ks_helper.seed_sample(seed, index)
+        yield create_sample().result()
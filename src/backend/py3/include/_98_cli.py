@@ -0,0 +1,221 @@
+import argparse
+import functools
+import json
+import multiprocessing
+import random
+import sys
+from collections import deque
+from typing import Any, Callable, Iterator, List, Optional
+
+DEFAULT_CHUNK_SIZE = 64
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Generate samples of the format described by the Kaitai Struct file.")
+    parser.add_argument("-n", "--count", type=int, default=1,
+                        help="Number of samples to generate. Defaults to 1.")
+    parser.add_argument("-o", "--output-dir", default=None,
+                        help="Write every sample to its own file in this directory instead of stdout.")
+    parser.add_argument("--suffix", default=".bin",
+                        help="File name suffix of the samples written to `--output-dir`. Defaults to `.bin`.")
+    parser.add_argument("-f", "--format", choices=StreamSampleWriter.FORMATS, default="raw",
+                        help="How the samples written to stdout are separated. Defaults to `raw`.")
+    parser.add_argument("-d", "--delimiter", default="\\n",
+                        help="Delimiter written after every sample when `--format` is `delimited`. "
+                        "Supports backslash escapes, such as `\\x00`. Defaults to `\\n`.")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of worker processes used to generate samples. Defaults to 1.")
+    parser.add_argument("-s", "--seed", type=int, default=None,
+                        help="Master seed, makes the run reproducible regardless of `--jobs`. "
+                        "A random master seed is picked (and printed to stderr) if `--jobs` is larger than 1.")
+    parser.add_argument("-i", "--index", type=int, default=0,
+                        help="Index of the first sample to generate, requires `--seed`. Defaults to 0.")
+    parser.add_argument("--stream", action="store_true",
+                        help="Write every sample to the output piece by piece instead of serialising it in memory first. "
+                        "Large fields are generated as they are written. Cannot be used with `--jobs`.")
+    parser.add_argument("-m", "--mutate", action="store_true",
+                        help="Generate the first sample only, every following sample is made from the previous one by "
+                        "generating one of its fields again. Cannot be used with `--jobs`.")
+    parser.add_argument("--serve", default=None, metavar="SOCKET",
+                        help="Serve samples on request over this Unix domain socket, or over stdin and stdout if `-`, "
+                        "instead of writing `--count` samples.")
+    parser.add_argument("--max-bytes", type=int, default=None,
+                        help="Maximum number of bytes of random data generated per sample. Unlimited by default.")
+    parser.add_argument("--max-depth", type=int, default=None,
+                        help="Maximum nesting depth of the objects of a sample, the root object is at depth 0. Unlimited by default.")
+    parser.add_argument("--max-objects", type=int, default=None,
+                        help="Maximum number of objects generated per sample. Unlimited by default.")
+    parser.add_argument("--max-time", type=float, default=None,
+                        help="Maximum number of seconds spent generating a sample. Unlimited by default.")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Drop samples identical to a sample written before, and print the duplicate rate to stderr. "
+                        "Cannot be used with `--stream`.")
+    parser.add_argument("--dedup-exact-limit", type=int, default=DEFAULT_EXACT_LIMIT,
+                        help="Number of unique samples remembered exactly by `--dedup`, a Bloom filter sized for `--count` "
+                        f"samples is used beyond that. Defaults to {DEFAULT_EXACT_LIMIT}.")
+    parser.add_argument("--dedup-error-rate", type=float, default=DEFAULT_ERROR_RATE,
+                        help="Probability that the Bloom filter of `--dedup` drops a unique sample. "
+                        f"Defaults to {DEFAULT_ERROR_RATE}.")
+    parser.add_argument("--choice-weights", default=None, metavar="FILE",
+                        help="JSON file giving the weights of the options of choice points, "
+                        "as an object mapping the ID of a choice point to a list of weights. Replaces the weights given in the "
+                        "definition for these choice points. Options are equally likely by default.")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f"Number of samples handed to a worker process at once. Defaults to {DEFAULT_CHUNK_SIZE}.")
+    args = parser.parse_args(argv)
+    if args.count < 0:
+        parser.error("`--count` cannot be negative")
+    if args.index < 0:
+        parser.error("`--index` cannot be negative")
+    if args.index > 0 and args.seed is None:
+        parser.error("`--index` requires `--seed`")
+    if args.jobs < 1:
+        parser.error("`--jobs` cannot be less than 1")
+    if args.chunk_size < 1:
+        parser.error("`--chunk-size` cannot be less than 1")
+    for name in ("max_bytes", "max_depth", "max_objects", "max_time"):
+        if getattr(args, name) is not None and getattr(args, name) < 0:
+            parser.error(f"`--{name.replace('_', '-')}` cannot be negative")
+    if args.dedup_exact_limit < 0:
+        parser.error("`--dedup-exact-limit` cannot be negative")
+    if not 0 < args.dedup_error_rate < 1:
+        parser.error("`--dedup-error-rate` must be between 0 and 1")
+    if args.dedup and args.stream:
+        parser.error("`--dedup` cannot be used with `--stream`")
+    if args.stream and args.jobs > 1:
+        parser.error("`--stream` cannot be used with `--jobs`")
+    if args.mutate and args.jobs > 1:
+        parser.error("`--mutate` cannot be used with `--jobs`")
+    if args.serve is not None and (args.jobs > 1 or args.output_dir is not None or args.mutate or args.dedup):
+        parser.error("`--serve` cannot be used with `--jobs`, `--output-dir`, `--mutate` or `--dedup`")
+    args.delimiter = args.delimiter.encode("latin-1").decode("unicode_escape").encode("latin-1")
+    return args
+
+
+def create_sample_writer(args: argparse.Namespace) -> SampleWriter:
+    if args.output_dir is not None:
+        width = len(str(max(args.index + args.count - 1, 0)))
+        return DirectorySampleWriter(args.output_dir, suffix=args.suffix, width=width)
+    return StreamSampleWriter(sys.stdout.buffer, stream_format=args.format, delimiter=args.delimiter)
+
+
+def load_choice_weights(path: str) -> dict[str, List[float]]:
+    with open(path, "r") as f:
+        choice_weights = json.load(f)
+    if not isinstance(choice_weights, dict) or not all(isinstance(weights, list) for weights in choice_weights.values()):
+        raise ValueError("Expected an object mapping choice point IDs to lists of weights")
+    return choice_weights
+
+
+def generate_chunk(create_sample: Callable[[], Any], seed: int, limits: dict[str, Any], choice_weights: dict[str, List[float]],
+                   alias_tables: dict[str, tuple], start: int, count: int) -> List[bytes]:
+    """Generate samples `start` to `start + count - 1` of the run seeded with `seed`, within the budget `limits` and
+    with the weights `choice_weights` (and their `alias_tables`). Runs in the worker processes."""
+    budget.configure(**limits)
+    ks_helper.set_choice_weights(choice_weights, alias_tables)
+    samples = []
+    for index in range(start, start + count):
+        ks_helper.seed_sample(seed, index)
+        samples.append(create_sample().result())
+    return samples
+
+
+def generate_samples(create_sample: Callable[[], Any], count: int, seed: Optional[int] = None, start: int = 0, jobs: int = 1, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    """Generate `count` samples in order, starting from sample `start`.
+
+    When a seed is given, or more than one job is used, every sample is seeded with a seed derived from the master seed
+    and the index of the sample. Sample k of a run can then be regenerated on its own, and the output does not depend
+    on the number of jobs.
+    """
+    if seed is None and jobs == 1:
+        for _ in range(count):
+            yield create_sample().result()
+        return
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(64)
+        print(f"Master seed: {seed}", file=sys.stderr)
+    chunks = [(chunk_start, min(chunk_size, start + count - chunk_start))
+              for chunk_start in range(start, start + count, chunk_size)]
+    generate_fn = functools.partial(generate_chunk, create_sample, seed, budget.limits, ks_helper.choice_weights, ks_helper.alias_tables)
+    if jobs == 1:
+        for chunk in chunks:
+            yield from generate_fn(*chunk)
+        return
+    with multiprocessing.Pool(jobs) as pool:
+        # Bound the number of chunks in flight so a slow writer does not let results pile up in memory
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(generate_fn, chunk))
+            if len(pending) >= 2 * jobs:
+                yield from pending.popleft().get()
+        while len(pending) > 0:
+            yield from pending.popleft().get()
+
+
+def stream_samples(create_sample: Callable[[], Any], writer: SampleWriter, count: int, seed: Optional[int] = None, start: int = 0) -> None:
+    """Generate `count` samples starting from sample `start`, writing each one to `writer` as it is serialised"""
+    for index in range(start, start + count):
+        if seed is not None:
+            ks_helper.seed_sample(seed, index)
+        sample = create_sample()
+        writer.write_with(index, sample.write_to, size=len(sample))
+
+
+def drop_duplicates(samples: Iterator[bytes], duplicate_filter: DuplicateFilter, start: int = 0) -> Iterator[tuple[int, bytes]]:
+    """Yield the index and the bytes of the samples not seen by `duplicate_filter` before. The samples of every worker
+    process go through the same filter, in the order they are written."""
+    for index, sample in enumerate(samples, start=start):
+        if duplicate_filter.add(sample):
+            yield index, sample
+
+
+def mutate_samples(create_sample: Callable[[], Any], mutate_sample: Callable[[Any], None], count: int, seed: Optional[int] = None, start: int = 0) -> Iterator[Any]:
+    """Generate sample `start`, then yield `count` samples, mutating the previous sample to get the next one.
+    The same object is yielded every time."""
+    if seed is not None:
+        ks_helper.seed_sample(seed, start)
+    sample = create_sample()
+    for i in range(count):
+        if i > 0:
+            mutate_sample(sample)
+        yield sample
+
+
+def main(argv: List[str], create_sample: Callable[[], Any], mutate_sample: Callable[[Any], None]) -> int:
+    """Entry point of the generated fuzzer, writes `--count` samples of the objects created by `create_sample`"""
+    args = parse_args(argv)
+    budget.configure(max_bytes=args.max_bytes, max_depth=args.max_depth, max_objects=args.max_objects, max_time=args.max_time)
+    if args.choice_weights is not None:
+        try:
+            ks_helper.update_choice_weights(load_choice_weights(args.choice_weights))
+        except (OSError, ValueError, TypeError) as e:
+            print(f"Cannot load `--choice-weights`: {e}", file=sys.stderr)
+            return 2
+    if args.serve is not None:
+        serve(args.serve, create_sample, mutate_sample)
+        return 0
+    with create_sample_writer(args) as writer:
+        if args.mutate and args.stream:
+            for index, sample in enumerate(mutate_samples(create_sample, mutate_sample, args.count, seed=args.seed, start=args.index), start=args.index):
+                writer.write_with(index, sample.write_to, size=len(sample))
+            return 0
+        if args.stream:
+            stream_samples(create_sample, writer, args.count, seed=args.seed, start=args.index)
+            return 0
+        if args.mutate:
+            samples = (sample.result() for sample in mutate_samples(create_sample, mutate_sample, args.count, seed=args.seed, start=args.index))
+        else:
+            samples = generate_samples(create_sample, args.count, seed=args.seed, start=args.index,
+                                       jobs=args.jobs, chunk_size=args.chunk_size)
+        if args.dedup:
+            # Samples keep their index, so a file name still tells which sample of the run it is
+            duplicate_filter = DuplicateFilter(exact_limit=args.dedup_exact_limit, bloom_capacity=max(args.count, 1), error_rate=args.dedup_error_rate)
+            indexed_samples = drop_duplicates(samples, duplicate_filter, start=args.index)
+        else:
+            duplicate_filter = None
+            indexed_samples = enumerate(samples, start=args.index)
+        for index, sample in indexed_samples:
+            writer.write(index, sample)
+    if duplicate_filter is not None:
+        print(duplicate_filter.report(), file=sys.stderr)
+    return 0
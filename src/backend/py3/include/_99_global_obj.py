@@ -3,4 +3,5 @@ import sys
 from enum import Enum, unique
 
 
-ks_helper = KsHelper(seed=None)
+budget = Budget()
+ks_helper = KsHelper(seed=None, budget=budget)
@@ -1,3 +1,6 @@
 from backend.py3.include._00_seekable_buffer import SeekableBuffer  # noqa:F401
+from backend.py3.include._10_budget import Budget, StopGeneration  # noqa:F401
 import backend.py3.include._80_functions as fn  # noqa:F401
-from backend.py3.include._90_ks_helper import KsHelper  # noqa:F401
+from backend.py3.include._90_ks_helper import ChoiceWeights, KsHelper, LazyRandomBytes  # noqa:F401
+from backend.py3.include._94_dedup import BloomFilter, DuplicateFilter  # noqa:F401
+from backend.py3.include._95_sample_writer import SampleWriter, DirectorySampleWriter, StreamSampleWriter  # noqa:F401
@@ -14,10 +14,17 @@ ISO8859_TYPE = ("ISO8859-1", "ISO8859-2", "ISO8859-3", "ISO8859-4", "ISO8859-5",
 
 class ValueCodeGenerator():
 
+    # Keys that need a repeated field to be generated item by item
+    PER_ITEM_KEYS = ("enum", "valid", "process", "-fz-increment", "-fz-choice",
+                     "-fz-order", "-fz-random-order", "-fz-attr-len")
+    # Keys that give a string field a `str` value
+    STR_VALUE_KEYS = ("valid", "-fz-choice", "-fz-order", "-fz-random-order")
+
     def __init__(self, ks_helper_instance_name: str) -> None:
         self.ks_helper_instance_name = ks_helper_instance_name
 
-    def _gen_bytes_fixed_contents(self, contents: str | List[Union[str, int]]) -> str:
+    @staticmethod
+    def get_fixed_contents(contents: str | List[Union[str, int]]) -> bytes:
         byte_val = b''
         for content in contents:
             if isinstance(content, str):
@@ -26,7 +33,10 @@ class ValueCodeGenerator():
                 byte_val += content.to_bytes(1)
             else:
                 raise TypeError("Unknown type in `contents` key")
-        return f"{byte_val!r}"
+        return byte_val
+
+    def _gen_bytes_fixed_contents(self, contents: str | List[Union[str, int]]) -> str:
+        return f"{self.get_fixed_contents(contents)!r}"
 
     def gen_bytes_fn(self, n_bytes: int | str, min_n_bytes: Optional[int] = None, max_n_bytes: Optional[int] = None, contents: Optional[str | List[Union[str, int]]] = None) -> str:
         # Fixed bytes
@@ -35,17 +45,17 @@ class ValueCodeGenerator():
 
         # Generated bytes
         is_expression = isinstance(n_bytes, str)
-        fn_name = "rand_bytes"
+        fn_name = "rand_bytes_lazy"  # Large fields are generated when they are serialised
         fn_args = f"({n_bytes})"
         if is_expression:
             fn_args = f"(int({n_bytes}))"
         else:
             if n_bytes == 0:
                 return 'b\"\"'
-            if n_bytes < 0 and max_n_bytes is not None:
+            if n_bytes < 0:
+                if max_n_bytes is None:
+                    raise ValueError("`n_bytes` cannot be less than 0")
                 fn_args = f"({n_bytes}, min_n_bytes={min_n_bytes}, max_n_bytes={max_n_bytes})"
-            else:
-                raise ValueError("`n_bytes` cannot be less than 0")
 
         return f"{self.ks_helper_instance_name}.{fn_name}{fn_args}"
 
@@ -169,7 +179,7 @@ class ValueCodeGenerator():
     def gen_f8be_fn(self, start: float = const.f8_MIN, end: float = const.f8_MAX) -> str:
         return self.gen_f8_fn(start=start, end=end)
 
-    def gen_str_fn(self, n_bytes: int | str, encoding: Optional[str] = "UTF-8", terminator: Optional[int] = None, min_n_bytes: Optional[int] = None, max_n_bytes: Optional[int] = None) -> str:
+    def gen_str_fn(self, n_bytes: int | str, encoding: Optional[str] = "UTF-8", terminator: Optional[int] = None, min_n_bytes: Optional[int] = None, max_n_bytes: Optional[int] = None, as_bytes: bool = False) -> str:
         is_expression = isinstance(n_bytes, str)
         fn_name = None
         fn_args = f"({n_bytes}"
@@ -179,7 +189,7 @@ class ValueCodeGenerator():
             if n_bytes < 0 and max_n_bytes is None:
                 raise ValueError("`n_bytes` cannot be less than 0")
             if n_bytes == 0 and terminator is None:
-                return "\"\""
+                return "b\"\"" if as_bytes else "\"\""
 
         if terminator is not None and (terminator < 0 or terminator > 255):
             raise ValueError("`terminator` must be between 0 and 255")
@@ -198,20 +208,66 @@ class ValueCodeGenerator():
             fn_args += f", \"{encoding}\", {terminator}, min_n_bytes={min_n_bytes}, max_n_bytes={max_n_bytes})"
         if fn_name is None:
             raise ValueError("Unknown string encoding")
+        if as_bytes:
+            fn_name += "_bytes"
         return f"{self.ks_helper_instance_name}.{fn_name}{fn_args}"
 
-    def gen_strz_fn(self, n_bytes: int, encoding: Optional[str] = "UTF-8", terminator: None = None, min_n_bytes: Optional[int] = None, max_n_bytes: Optional[int] = None) -> str:
-        return self.gen_str_fn(n_bytes=n_bytes, encoding=encoding, terminator=0, min_n_bytes=min_n_bytes, max_n_bytes=max_n_bytes)
+    def gen_strz_fn(self, n_bytes: int, encoding: Optional[str] = "UTF-8", terminator: None = None, min_n_bytes: Optional[int] = None, max_n_bytes: Optional[int] = None, as_bytes: bool = False) -> str:
+        return self.gen_str_fn(n_bytes=n_bytes, encoding=encoding, terminator=0, min_n_bytes=min_n_bytes, max_n_bytes=max_n_bytes, as_bytes=as_bytes)
+
+    @staticmethod
+    def get_enum_values_var_name(enum_class_name: str) -> str:
+        """Name of the constant holding every value of an enum, so they are not listed again on every call"""
+        return f"{enum_class_name}values"
 
-    def gen_enum_fn(self, enum_name: str) -> str:
+    def gen_enum_fn(self, enum_name: str, choice_point: Optional[str] = None) -> str:
         fn_name = "rand_choice"
-        fn_args = f"(list({sanitiser.sanitise_class_name(enum_name)}))"
+        values_var = self.get_enum_values_var_name(sanitiser.sanitise_class_name(enum_name))
+        fn_args = f"({values_var})"
+        if choice_point is not None:
+            fn_args = f"({values_var}, {choice_point!r})"
         return f"{self.ks_helper_instance_name}.{fn_name}{fn_args}"
 
     def gen_custom_type(self, type_name: str) -> str:
         type_name = sanitiser.sanitise_class_name(type_name)
         return f"{type_name}(_parent=self, _root=self._root)"
 
+    def can_generate_array(self, **kwargs) -> bool:
+        """Check if a repeated field can be generated as a whole (an `array`), instead of item by item"""
+        if kwargs.get("repeat") not in ("expr", "eos") or kwargs["type"] not in INT_TYPE + FLOAT_TYPE:
+            return False
+        for key in kwargs:
+            if key in self.PER_ITEM_KEYS or key.startswith("-fz-process-"):
+                return False
+        return True
+
+    def is_str_as_bytes(self, **kwargs) -> bool:
+        """Check if a string field can hold its encoded bytes, instead of a `str`. Only strings that are never used in
+        an expression, and are generated randomly, are kept as bytes."""
+        if kwargs.get("type") not in STR_TYPE or kwargs.get("_in_expression", True):
+            return False
+        for key in kwargs:
+            if key in self.STR_VALUE_KEYS or key.startswith("-fz-process-"):
+                return False
+        return True
+
+    def is_str_len_n_bytes(self, **kwargs) -> bool:
+        """Check if the length of a string field is also its size in bytes"""
+        return self.is_str_as_bytes(**kwargs) or kwargs["encoding"].upper() in ("ASCII", ) + ISO8859_TYPE
+
+    def generate_array_code(self, n_items: str, **kwargs) -> str:
+        """Generate `n_items` values of a number type with a single call"""
+        seq_type = kwargs["type"]
+        # Checks the range against the item type, like a field generated item by item
+        self.get_gen_type_fn(seq_type)(start=kwargs["-fz-range-min"], end=kwargs["-fz-range-max"])
+        if seq_type in FLOAT_TYPE:
+            fn_name = "rand_float_array" if seq_type.startswith("f4") else "rand_double_array"
+            return f"{self.ks_helper_instance_name}.{fn_name}({n_items})"
+        item_size = int(seq_type[1])
+        signed = seq_type.startswith("s")
+        fn_args = f"({n_items}, {kwargs['-fz-range-min']}, {kwargs['-fz-range-max']}, {item_size}, {signed})"
+        return f"{self.ks_helper_instance_name}.rand_int_array{fn_args}"
+
     def generate_code(self, **kwargs) -> str:
         seq_type = kwargs["type"]
         gen_fn = self.get_gen_type_fn(seq_type)
@@ -220,7 +276,7 @@ class ValueCodeGenerator():
                 return f"{kwargs['valid']}"
             enum_name = kwargs.get("enum")  # Enum type can only be int
             if enum_name is not None:
-                return self.gen_enum_fn(enum_name)
+                return self.gen_enum_fn(enum_name, kwargs.get("_choice_point"))
             fz_increment = kwargs.get("-fz-increment")
             if fz_increment is not None:
                 return fz_increment
@@ -232,7 +288,7 @@ class ValueCodeGenerator():
         elif seq_type in BYTE_TYPE:
             return gen_fn(n_bytes=kwargs["size"], min_n_bytes=kwargs["-fz-size-min"], max_n_bytes=kwargs["-fz-size-max"], contents=kwargs["contents"])
         elif seq_type in STR_TYPE:
-            return gen_fn(n_bytes=kwargs["size"], encoding=kwargs["encoding"], terminator=kwargs["terminator"], min_n_bytes=kwargs["-fz-size-min"], max_n_bytes=kwargs["-fz-size-max"])
+            return gen_fn(n_bytes=kwargs["size"], encoding=kwargs["encoding"], terminator=kwargs["terminator"], min_n_bytes=kwargs["-fz-size-min"], max_n_bytes=kwargs["-fz-size-max"], as_bytes=self.is_str_as_bytes(**kwargs))
         else:
             # Not a base type
             return self.gen_custom_type(seq_type)
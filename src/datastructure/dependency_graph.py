@@ -1,5 +1,6 @@
 from __future__ import annotations
-from typing import List, Set, Iterable, TypeVar
+from typing import List, Optional, Set, Iterable, TypeVar
+import heapq
 
 
 _T = TypeVar("_T")
@@ -8,7 +9,8 @@ _T = TypeVar("_T")
 class DependencyGraph():
 
     def __init__(self):
-        self.nodes: Set[DependencyGraphNode[_T]] = set()
+        # Dict is used as an insertion ordered set, so the linearised graph is stable
+        self.nodes: dict[DependencyGraphNode[_T], None] = dict()
         self.num_nodes = 0
 
     def _copy(self) -> DependencyGraph:
@@ -27,7 +29,7 @@ class DependencyGraph():
         return new_graph
 
     def add_node(self, node: DependencyGraphNode[_T]) -> None:
-        self.nodes.add(node)
+        self.nodes[node] = None
         self.num_nodes += 1
 
     def add_nodes(self, nodes: Iterable[DependencyGraphNode[_T]]) -> None:
@@ -36,21 +38,25 @@ class DependencyGraph():
 
     def linearise_graph(self) -> List[DependencyGraphNode]:
         # Run Kahn's algorithm to linearise DAG
+        # When several nodes are ready, the one added first is picked, so nodes keep their insertion order unless a
+        # dependency requires otherwise
         result = []
         # We are modifying the tree when running the algorithm, so we copy the tree
         search_graph = self._copy()
+        node_order = {node: i for i, node in enumerate(search_graph.nodes)}
+        order_node = list(search_graph.nodes)
         queue = []
         # Populate queue
         for node in search_graph.nodes:
             if not node.has_dependents():
-                queue.append(node)
+                heapq.heappush(queue, node_order[node])
 
         while len(queue) > 0:
-            curr_node = queue.pop(0)
+            curr_node = order_node[heapq.heappop(queue)]
             for dependee in list(curr_node.dependees):
                 dependee.remove_dependent(curr_node)
                 if not dependee.has_dependents():
-                    queue.append(dependee)
+                    heapq.heappush(queue, node_order[dependee])
             result.append(curr_node)
 
         if len(result) != self.num_nodes:
@@ -59,6 +65,25 @@ class DependencyGraph():
 
         return result
 
+    def get_order(self) -> dict[_T, int]:
+        """Get the index of the data of every node in the linearised graph, in that order"""
+        # The linearised graph is made of copies of the nodes
+        return {linearised_node.data: i for i, linearised_node in enumerate(self.linearise_graph())}
+
+    def get_dependees(self, node: DependencyGraphNode[_T], order: Optional[dict[_T, int]] = None) -> List[DependencyGraphNode[_T]]:
+        """Get the nodes that depend on a node, directly or indirectly, in the order they are linearised. Pass the result
+        of `get_order` as `order` when getting the dependees of many nodes, so the graph is linearised once."""
+        found = set()
+        to_visit = [node]
+        while len(to_visit) > 0:
+            for dependee in to_visit.pop().dependees:
+                if dependee not in found:
+                    found.add(dependee)
+                    to_visit.append(dependee)
+        if order is None:
+            order = self.get_order()
+        return sorted(found, key=lambda dependee: order[dependee.data])
+
     def __repr__(self) -> str:
         return self.__str__()
 
@@ -0,0 +1,333 @@
+"""Parse Kaitai Struct expressions into a tree.
+
+The grammar is the one of the Kaitai Struct expression language, its operators have the same precedence as in
+Python: ternary (`a ? b : c`), `or`, `and`, `not`, comparisons, `|`, `^`, `&`, shifts, `+ -`, `* / %`, unary `- ~`,
+then attributes, method calls and indexing. The tree is independent of the language the expression is compiled to.
+"""
+from __future__ import annotations
+from dataclasses import dataclass, fields, replace
+from functools import lru_cache
+from typing import Any, Callable, Iterator, List, NamedTuple, Optional, Tuple, Union
+import re
+
+
+class Token(NamedTuple):
+    kind: str  # "int", "float", "str", "name" or "op"
+    text: str
+    value: Any
+    pos: int
+
+
+@dataclass(frozen=True)
+class Literal():
+    value: Union[int, float, str, bool]
+
+
+@dataclass(frozen=True)
+class ArrayLiteral():
+    items: Tuple[Node, ...]
+
+
+@dataclass(frozen=True)
+class Name():
+    name: str
+
+
+@dataclass(frozen=True)
+class EnumRef():
+    """`enum_name::value`, the enum may be in a type: `type_name::enum_name::value`"""
+    path: Tuple[str, ...]
+
+
+@dataclass(frozen=True)
+class Attribute():
+    value: Node
+    name: str
+
+
+@dataclass(frozen=True)
+class MethodCall():
+    value: Node
+    name: str
+    args: Tuple[Node, ...]
+
+
+@dataclass(frozen=True)
+class Subscript():
+    value: Node
+    index: Node
+
+
+@dataclass(frozen=True)
+class UnaryOp():
+    op: str
+    operand: Node
+
+
+@dataclass(frozen=True)
+class BinaryOp():
+    op: str
+    left: Node
+    right: Node
+
+
+@dataclass(frozen=True)
+class Ternary():
+    condition: Node
+    if_true: Node
+    if_false: Node
+
+
+Node = Union[Literal, ArrayLiteral, Name, EnumRef, Attribute, MethodCall, Subscript, UnaryOp, BinaryOp, Ternary]
+NODE_TYPES = (Literal, ArrayLiteral, Name, EnumRef, Attribute, MethodCall, Subscript, UnaryOp, BinaryOp, Ternary)
+
+TOKEN_REGEX = re.compile(r"""
+    (?P<space>\s+)
+    | (?P<float>\d[\d_]*\.\d[\d_]*(?:[eE][+-]?\d+)? | \d[\d_]*[eE][+-]?\d+)
+    | (?P<int>0[xX][0-9a-fA-F_]+ | 0[bB][01_]+ | 0[oO][0-7_]+ | \d[\d_]*)
+    | (?P<str>"(?:[^"\\]|\\.)*" | '[^']*')
+    | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+    | (?P<op>::|<<|>>|<=|>=|==|!=|[-+*/%<>&|^~?:.,()\[\]])
+""", re.VERBOSE)
+ESCAPE_REGEX = re.compile(r"\\(?:u([0-9a-fA-F]{4})|([0-7]{1,3})|(.))", re.DOTALL)
+ESCAPES = {"a": "\a", "b": "\b", "t": "\t", "n": "\n", "v": "\v", "f": "\f", "r": "\r", "e": "\x1b",
+           "\"": "\"", "'": "'", "\\": "\\"}
+KEYWORD_LITERALS = {"true": True, "false": False}
+
+# Binary operators from the lowest precedence to the highest, comparisons do not chain
+BINARY_OPERATOR_LEVELS = (
+    ("or", ),
+    ("and", ),
+    ("==", "!=", "<", "<=", ">", ">="),
+    ("|", ),
+    ("^", ),
+    ("&", ),
+    ("<<", ">>"),
+    ("+", "-"),
+    ("*", "/", "%"),
+)
+NOT_LEVEL = 2  # `not` binds less tightly than the comparisons
+UNARY_OPERATORS = ("-", "~")
+
+
+def _unescape(match: re.Match) -> str:
+    unicode_escape, octal_escape, char = match.groups()
+    if unicode_escape is not None:
+        return chr(int(unicode_escape, 16))
+    if octal_escape is not None:
+        return chr(int(octal_escape, 8))
+    if char not in ESCAPES:
+        raise ValueError(f"Unknown escape sequence `\\{char}`")
+    return ESCAPES[char]
+
+
+def tokenize(expression: str) -> List[Token]:
+    tokens = []
+    pos = 0
+    while pos < len(expression):
+        match = TOKEN_REGEX.match(expression, pos)
+        if match is None:
+            raise ValueError(f"Invalid expression `{expression}`: unexpected `{expression[pos]}` at position {pos}")
+        kind = match.lastgroup
+        text = match.group()
+        if kind == "int":
+            # Decimal numbers may have leading zeros, which `int(text, 0)` rejects
+            tokens.append(Token(kind, text, int(text, 0) if text[:2].lower() in ("0x", "0b", "0o") else int(text), pos))
+        elif kind == "float":
+            tokens.append(Token(kind, text, float(text), pos))
+        elif kind == "str":
+            # Only double quoted strings have escape sequences
+            value = ESCAPE_REGEX.sub(_unescape, text[1:-1]) if text[0] == "\"" else text[1:-1]
+            tokens.append(Token(kind, text, value, pos))
+        elif kind != "space":
+            tokens.append(Token(kind, text, text, pos))
+        pos = match.end()
+    return tokens
+
+
+class Parser():
+    """Recursive descent parser for a single expression"""
+
+    def __init__(self, expression: str) -> None:
+        self.expression = expression
+        self.tokens = tokenize(expression)
+        self.pos = 0
+
+    def error(self, message: str) -> ValueError:
+        return ValueError(f"Invalid expression `{self.expression}`: {message}")
+
+    def peek(self) -> Optional[Token]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def accept(self, *texts: str) -> Optional[Token]:
+        """Consume the next token if it is one of the operators or keywords in `texts`"""
+        token = self.peek()
+        if token is not None and token.kind in ("op", "name") and token.text in texts:
+            self.pos += 1
+            return token
+        return None
+
+    def expect(self, text: str) -> Token:
+        token = self.accept(text)
+        if token is None:
+            found = self.peek()
+            raise self.error(f"expected `{text}`, found " + ("the end" if found is None else f"`{found.text}` at position {found.pos}"))
+        return token
+
+    def expect_name(self) -> str:
+        token = self.peek()
+        if token is None or token.kind != "name":
+            raise self.error("expected a name, found " + ("the end" if token is None else f"`{token.text}` at position {token.pos}"))
+        self.pos += 1
+        return token.text
+
+    def parse(self) -> Node:
+        node = self.parse_ternary()
+        token = self.peek()
+        if token is not None:
+            raise self.error(f"unexpected `{token.text}` at position {token.pos}")
+        return node
+
+    def parse_ternary(self) -> Node:
+        condition = self.parse_binary(0)
+        if self.accept("?") is None:
+            return condition
+        if_true = self.parse_ternary()
+        self.expect(":")
+        if_false = self.parse_ternary()
+        return Ternary(condition, if_true, if_false)
+
+    def parse_binary(self, level: int) -> Node:
+        if level == NOT_LEVEL and self.accept("not") is not None:
+            return UnaryOp("not", self.parse_binary(level))
+        if level == len(BINARY_OPERATOR_LEVELS):
+            return self.parse_unary()
+        operators = BINARY_OPERATOR_LEVELS[level]
+        node = self.parse_binary(level + 1)
+        while (token := self.accept(*operators)) is not None:
+            node = BinaryOp(token.text, node, self.parse_binary(level + 1))
+        return node
+
+    def parse_unary(self) -> Node:
+        token = self.accept(*UNARY_OPERATORS)
+        if token is not None:
+            return UnaryOp(token.text, self.parse_unary())
+        return self.parse_postfix(self.parse_atom())
+
+    def parse_postfix(self, node: Node) -> Node:
+        while True:
+            if self.accept(".") is not None:
+                name = self.expect_name()
+                if self.accept("(") is not None:
+                    node = MethodCall(node, name, self.parse_items(")"))
+                else:
+                    node = Attribute(node, name)
+            elif self.accept("[") is not None:
+                node = Subscript(node, self.parse_ternary())
+                self.expect("]")
+            else:
+                return node
+
+    def parse_items(self, closing: str) -> Tuple[Node, ...]:
+        items = []
+        if self.accept(closing) is not None:
+            return ()
+        while True:
+            items.append(self.parse_ternary())
+            if self.accept(closing) is not None:
+                return tuple(items)
+            self.expect(",")
+
+    def parse_atom(self) -> Node:
+        token = self.peek()
+        if token is None:
+            raise self.error("unexpected end")
+        self.pos += 1
+        if token.kind in ("int", "float", "str"):
+            return Literal(token.value)
+        if token.kind == "name":
+            if token.text in KEYWORD_LITERALS:
+                return Literal(KEYWORD_LITERALS[token.text])
+            path = [token.text]
+            while self.accept("::") is not None:
+                path.append(self.expect_name())
+            return EnumRef(tuple(path)) if len(path) > 1 else Name(token.text)
+        if token.text == "(":
+            node = self.parse_ternary()
+            self.expect(")")
+            return node
+        if token.text == "[":
+            return ArrayLiteral(self.parse_items("]"))
+        raise self.error(f"unexpected `{token.text}` at position {token.pos}")
+
+
+@lru_cache(maxsize=None)
+def parse_expression(expression: str) -> Node:
+    """Parse an expression, an expression is parsed only once however many times it is used"""
+    return Parser(expression).parse()
+
+
+def iter_child_nodes(node: Node) -> Iterator[Node]:
+    for field in fields(node):
+        value = getattr(node, field.name)
+        if isinstance(value, NODE_TYPES):
+            yield value
+        elif isinstance(value, tuple):
+            # Items or arguments, the path of an enum is made of strings
+            yield from (item for item in value if isinstance(item, NODE_TYPES))
+
+
+def map_child_nodes(node: Node, fn: Callable[[Node], Node]) -> Node:
+    """Get a copy of a node with `fn` applied to each of its children"""
+    changes = {}
+    for field in fields(node):
+        value = getattr(node, field.name)
+        if isinstance(value, NODE_TYPES):
+            changes[field.name] = fn(value)
+        elif isinstance(value, tuple):
+            changes[field.name] = tuple(fn(item) if isinstance(item, NODE_TYPES) else item for item in value)
+    return replace(node, **changes)
+
+
+def get_names(node: Node) -> List[str]:
+    """Get the names an expression refers to, in order: `a` for `a.b[c]`, and `c`. Attributes are not names."""
+    names = []
+    if isinstance(node, Name):
+        names.append(node.name)
+    for child in iter_child_nodes(node):
+        names.extend(name for name in get_names(child) if name not in names)
+    return names
+
+
+def get_identifiers(node: Node) -> List[str]:
+    """Get every name and attribute name used in an expression"""
+    identifiers = []
+    if isinstance(node, Name):
+        identifiers.append(node.name)
+    elif isinstance(node, (Attribute, MethodCall)):
+        identifiers.append(node.name)
+    for child in iter_child_nodes(node):
+        identifiers.extend(identifier for identifier in get_identifiers(child) if identifier not in identifiers)
+    return identifiers
+
+
+def get_attribute_path(node: Node) -> Optional[Tuple[str, ...]]:
+    """Get the names of an attribute chain such as `_root.header.len`, None if the node is not one"""
+    if isinstance(node, Name):
+        return (node.name, )
+    if isinstance(node, Attribute):
+        path = get_attribute_path(node.value)
+        return path + (node.name, ) if path is not None else None
+    return None
+
+
+def get_object_paths(node: Node) -> List[Tuple[str, ...]]:
+    """Get the attribute chains that start from another object, in order: `("_root", "header", "len")` for
+    `_root.header.len * 2`, and `("_parent", "items")` for `_parent.items[0]`"""
+    path = get_attribute_path(node)
+    if path is not None:
+        return [path] if path[0] in ("_root", "_parent") and len(path) > 1 else []
+    paths = []
+    for child in iter_child_nodes(node):
+        paths.extend(path for path in get_object_paths(child) if path not in paths)
+    return paths
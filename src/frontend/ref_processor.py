@@ -1,38 +1,30 @@
-from typing import Any, List
-import re
+from typing import Any, List, Optional, Set
 from datastructure.dependency_graph import DependencyGraph, DependencyGraphNode
+from datastructure.expression import parse_expression, get_names, get_identifiers, get_object_paths
 from utils.types import VALID_BASE_TYPE_VAL
-from utils.const import OPERATORS, KEY_WITH_EXPRESSION, KEY_WITH_EXPRESSION_PRODUCE_BYTES
+from utils.const import KEY_WITH_EXPRESSION_REGEX, REFERENCE_KEY_REGEX
 
 
 class RefProcessor():
     """Do processing on references"""
 
-    REFERENCE_KEYS = set(KEY_WITH_EXPRESSION).union(
-        KEY_WITH_EXPRESSION_PRODUCE_BYTES)
-
-    def __init__(self, source: dict[str, Any]):
+    def __init__(self, source: dict[str, Any], expression_ref: Optional[Set[str]] = None):
         self.source = source
+        # Names used in an expression anywhere in the file, shared with the processors of the nested types
+        self.expression_ref = expression_ref
 
     def _breakdown_expression_to_components(self, expression: Any) -> List[str]:
+        """Get the names an expression refers to, `header` for `header.len`"""
         if not isinstance(expression, str):
             return []
-        # Replace all operators with whitespace
-        for op in OPERATORS:
-            expression = expression.replace(op, " ")
-        # Split into components based on whitespace
-        expr_components = expression.split()
-        return list(filter(lambda s: len(s) > 0, expr_components))
+        return get_names(parse_expression(expression))
 
     def _get_valid_references(self, expression: Any, available_ref: List[str]) -> List[str]:
         components = self._breakdown_expression_to_components(expression)
         return list(filter(lambda component: component in available_ref, components))
 
     def _key_can_contain_expression(self, key: str) -> bool:
-        for regex_ref_key in self.REFERENCE_KEYS:
-            if re.fullmatch(regex_ref_key, key) is not None:
-                return True
-        return False
+        return REFERENCE_KEY_REGEX.fullmatch(key) is not None
 
     def _construct_dependency_graph(self) -> None:
         dependency_graph = DependencyGraph()
@@ -87,6 +79,27 @@ class RefProcessor():
                     # print(f"{seq_entry_id} ⭠ {component}", file=sys.stderr)
                     nodes[instance_name].depends_on(nodes[component])
 
+    def _construct_object_ref(self) -> None:
+        """Collect the attribute chains of other objects each entry is generated from, such as `_root.header.len`. They
+        are not part of the dependency graph, which only holds the references to the same object."""
+        object_ref = {}
+        self.source["_object_ref"] = object_ref
+        entries = [(seq_entry["id"], seq_entry) for seq_entry in self.source["seq"]]
+        entries.extend((instance_name, instance_entry) for instance_name, instance_entry in self.source["instances"].items()
+                       if not instance_entry["-fz-static"])
+        for entry_name, entry in entries:
+            is_custom_type = entry.get("type") is not None and entry["type"] not in VALID_BASE_TYPE_VAL
+            expressions = [value for key, value in entry.items()
+                           if self._key_can_contain_expression(key) and not (is_custom_type and key == "size")]
+            if isinstance(entry.get("type"), dict):
+                expressions.append(entry["type"]["switch-on"])
+            paths = []
+            for expression in expressions:
+                if isinstance(expression, str):
+                    paths.extend(path for path in get_object_paths(parse_expression(expression)) if path not in paths)
+            if len(paths) > 0:
+                object_ref[entry_name] = paths
+
     def _construct_available_ref(self) -> None:
         self.source["_available_ref"] = []
         self.source["_static_ref"] = []
@@ -101,14 +114,44 @@ class RefProcessor():
             if is_static:
                 self.source["_static_ref"].append(instance_name)
 
+    def _collect_expression_ref(self, source: dict[str, Any]) -> None:
+        """Collect every name and attribute used in an expression (except the ones that use the bytes of a field), in this
+        type and the nested types. A name is collected even if it refers to something else, so the result can only be too
+        large."""
+        entries = list(source["seq"])
+        entries.extend(source["instances"].values())
+        for entry in entries:
+            expressions = [value for key, value in entry.items()
+                           if KEY_WITH_EXPRESSION_REGEX.fullmatch(key) is not None]
+            if isinstance(entry.get("type"), dict):
+                expressions.append(entry["type"]["switch-on"])
+                expressions.extend(entry["type"]["cases"].keys())
+            for expression in expressions:
+                if isinstance(expression, str):
+                    self.expression_ref.update(get_identifiers(parse_expression(expression)))
+        custom_types = source.get("types")
+        if custom_types is not None:
+            for custom_type_src in custom_types.values():
+                self._collect_expression_ref(custom_type_src)
+
+    def _mark_expression_ref(self) -> None:
+        """Mark the seq entries whose value may be used in an expression"""
+        for seq_entry in self.source["seq"]:
+            seq_entry["_in_expression"] = seq_entry["id"] in self.expression_ref
+
     def pre_process(self):
         pass
 
     def post_process(self):
+        if self.expression_ref is None:
+            self.expression_ref = set()
+            self._collect_expression_ref(self.source)
         self._construct_available_ref()
         self._construct_dependency_graph()
+        self._construct_object_ref()
+        self._mark_expression_ref()
 
         custom_types = self.source.get("types")
         if custom_types is not None:
             for custom_type_src in custom_types.values():
-                RefProcessor(custom_type_src).post_process()
+                RefProcessor(custom_type_src, self.expression_ref).post_process()
@@ -12,12 +12,15 @@ from backend.py3.code_generator import Python3CodeGenerator
 ARGC_MIN = 2
 DEFAULT_OUTPUT_DIR = Path("build")
 DEFAULT_OUTPUT_FILE = DEFAULT_OUTPUT_DIR / "output_fuzzer.py"
+DEFAULT_AFL_MUTATOR_FILE = DEFAULT_OUTPUT_DIR / "afl_mutator.py"
+AFL_MUTATOR_OPTION = "--afl-mutator"
+NO_OPTIMISE_OPTION = "--no-optimise"
 DEFAULT_PROGRAM_NAME = "ks-bin-fuzzer"
 
 
 def main(argv: List[str]) -> int:
     if len(argv) < ARGC_MIN:
-        usage = f"""Usage: {DEFAULT_PROGRAM_NAME if len(argv) < 1 else argv[0]} ksy_file"""
+        usage = f"""Usage: {DEFAULT_PROGRAM_NAME if len(argv) < 1 else argv[0]} ksy_file [{AFL_MUTATOR_OPTION}] [{NO_OPTIMISE_OPTION}]"""
         print(usage, file=sys.stderr)
         return 1
     ksy_file_path = argv[1]
@@ -32,10 +35,14 @@ def main(argv: List[str]) -> int:
         shutil.rmtree(DEFAULT_OUTPUT_DIR)
     DEFAULT_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
     output = open(DEFAULT_OUTPUT_FILE, "w")
-    code_gen = Python3CodeGenerator(ir, output, is_entry_point=True)
+    code_gen = Python3CodeGenerator(ir, output, is_entry_point=True, optimise=NO_OPTIMISE_OPTION not in argv[2:])
     code_gen.generate_code()
     output.close()
 
+    if AFL_MUTATOR_OPTION in argv[2:]:
+        with open(DEFAULT_AFL_MUTATOR_FILE, "w") as f:
+            f.write(Python3CodeGenerator.generate_afl_mutator(DEFAULT_OUTPUT_FILE.stem))
+
     return 0
 
 
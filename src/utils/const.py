@@ -1,4 +1,5 @@
 import math
+import re
 
 
 u1_MIN, u1_MAX = 0, 255
@@ -26,3 +27,6 @@ VALID_PROCESS_KEY_VALUE = ["zlib"]
 KEY_WITH_EXPRESSION = ["size", "switch-on", "repeat-expr", "repeat-until",
                        "valid", "value", "if", "-fz-increment", "-fz-increment-step", "-fz-range-min", "-fz-range-max"]
 KEY_WITH_EXPRESSION_PRODUCE_BYTES = [r"\-fz\-process\-.+", "-fz-attr-len"]
+# Match a key against every pattern at once
+KEY_WITH_EXPRESSION_REGEX = re.compile("|".join(KEY_WITH_EXPRESSION))
+REFERENCE_KEY_REGEX = re.compile("|".join(KEY_WITH_EXPRESSION + KEY_WITH_EXPRESSION_PRODUCE_BYTES))
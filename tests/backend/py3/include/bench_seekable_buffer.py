@@ -0,0 +1,79 @@
+"""Benchmarks for SeekableBuffer, run from the root directory of this repository with:
+
+python tests/backend/py3/include/bench_seekable_buffer.py
+"""
+import sys
+import os
+import timeit
+sys.path.insert(0, os.path.join(os.getcwd(), "src"))  # Include src dir to sys.path
+
+from backend.py3.include import SeekableBuffer  # noqa:E402
+
+N_REPEAT = 5
+
+
+def bench_append_small(n_appends: int = 10000) -> None:
+    buf = SeekableBuffer()
+    chunk = b"\x01\x02\x03\x04"
+    for _ in range(n_appends):
+        buf.append(chunk)
+
+
+def bench_append_large(n_appends: int = 64, chunk_size: int = 2**20) -> None:
+    buf = SeekableBuffer()
+    chunk = bytes(chunk_size)
+    for _ in range(n_appends):
+        buf.append(chunk)
+
+
+def bench_get_data(n_reads: int = 1000, size: int = 2**16) -> None:
+    buf = SeekableBuffer()
+    buf.append(bytes(size))
+    for _ in range(n_reads):
+        buf.seek(0)
+        buf.get_data()
+
+
+def bench_get_view(n_reads: int = 1000, size: int = 2**16) -> None:
+    buf = SeekableBuffer()
+    buf.append(bytes(size))
+    for _ in range(n_reads):
+        buf.seek(0)
+        buf.get_view().release()
+
+
+def bench_write(n_writes: int = 10000) -> None:
+    buf = SeekableBuffer()
+    chunk = b"\x01\x02\x03\x04"
+    for i in range(n_writes):
+        buf.seek((i * 7) % (len(buf) + 1))
+        buf.write(chunk)
+
+
+def bench_move_data(n_moves: int = 100, size: int = 2**16) -> None:
+    buf = SeekableBuffer()
+    buf.append(bytes(size))
+    for i in range(n_moves):
+        buf.seek(1)
+        buf._move_data(1 if i % 2 == 0 else -1)
+
+
+BENCHMARKS = [
+    bench_append_small,
+    bench_append_large,
+    bench_get_data,
+    bench_get_view,
+    bench_write,
+    bench_move_data,
+]
+
+
+def main() -> int:
+    for bench_fn in BENCHMARKS:
+        best = min(timeit.repeat(bench_fn, number=1, repeat=N_REPEAT))
+        print(f"{bench_fn.__name__:<24}{best * 1000:>10.3f} ms")
+    return 0
+
+
+if "__main__" == __name__:
+    sys.exit(main())
@@ -0,0 +1,87 @@
+import unittest
+from unittest import mock
+from backend.py3.include import Budget, KsHelper
+
+
+class TestBudget(unittest.TestCase):
+    def test_unlimited(self):
+        budget = Budget()
+        budget.n_bytes = 2**40
+        budget.n_objects = 2**40
+        self.assertFalse(budget.enabled)
+        self.assertFalse(budget.exhausted(depth=1000))
+        self.assertIsNone(budget.remaining_bytes())
+        self.assertEqual(100, budget.limit_bytes(100))
+
+    def test_negative_limit(self):
+        self.assertRaises(ValueError, Budget, max_bytes=-1)
+        self.assertRaises(ValueError, Budget, max_time=-0.5)
+
+    def test_max_depth(self):
+        budget = Budget(max_depth=2)
+        self.assertFalse(budget.exhausted(depth=2))
+        self.assertTrue(budget.exhausted(depth=3))
+
+    def test_max_objects(self):
+        budget = Budget(max_objects=3)
+        budget.n_objects = 2
+        self.assertFalse(budget.exhausted())
+        budget.n_objects = 3
+        self.assertTrue(budget.exhausted())
+        budget.start()
+        self.assertFalse(budget.exhausted())
+
+    def test_max_bytes(self):
+        budget = Budget(max_bytes=10)
+        budget.n_bytes = 4
+        self.assertEqual(6, budget.remaining_bytes())
+        self.assertEqual(5, budget.limit_bytes(5))
+        self.assertEqual(6, budget.limit_bytes(50))
+        self.assertEqual(8, budget.limit_bytes(50, min_n_bytes=8))
+        self.assertFalse(budget.exhausted())
+        budget.n_bytes = 12
+        self.assertEqual(0, budget.remaining_bytes())
+        self.assertTrue(budget.exhausted())
+
+    def test_max_time(self):
+        budget = Budget(max_time=5)
+        with mock.patch("time.monotonic", return_value=budget.deadline - 1):
+            self.assertFalse(budget.exhausted())
+        with mock.patch("time.monotonic", return_value=budget.deadline):
+            self.assertTrue(budget.exhausted())
+
+    def test_configure(self):
+        budget = Budget(max_bytes=10)
+        budget.configure(**{**budget.limits, "max_objects": 5})
+        self.assertEqual({"max_bytes": 10, "max_depth": None, "max_objects": 5, "max_time": None}, budget.limits)
+
+
+class TestKsHelperBudget(unittest.TestCase):
+    def test_bytes_counted(self):
+        budget = Budget()
+        inst = KsHelper(seed=1, budget=budget)
+        inst.rand_bytes(10)
+        inst.rand_bytes_lazy(5)
+        inst.rand_utf8_bytes(7)
+        inst.rand_ascii_bytes(3, terminator=b"\0")
+        inst.rand_int_array(4, 0, 100, 2, False)
+        inst.rand_double_array(2)
+        self.assertEqual(10 + 5 + 7 + 3 + 8 + 16, budget.n_bytes)
+
+    def test_random_size_limited(self):
+        budget = Budget(max_bytes=100)
+        inst = KsHelper(seed=1, budget=budget)
+        self.assertEqual(60, len(inst.rand_bytes(60)))
+        for _ in range(20):
+            budget.n_bytes = 60
+            self.assertLessEqual(len(inst.rand_bytes(-1, min_n_bytes=0, max_n_bytes=1000)), 40)
+        budget.n_bytes = 100
+        self.assertEqual(10, len(inst.rand_bytes(-1, min_n_bytes=10, max_n_bytes=1000)))
+        # A fixed size is never shrunk
+        self.assertEqual(50, len(inst.rand_bytes(50)))
+
+    def test_array_limited(self):
+        budget = Budget(max_bytes=20)
+        inst = KsHelper(seed=1, budget=budget)
+        self.assertEqual(5, len(inst.rand_int_array(2**32, 0, 2**32 - 1, 4, False)))
+        self.assertEqual(0, len(inst.rand_float_array(10)))
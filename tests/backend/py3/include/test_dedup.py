@@ -0,0 +1,102 @@
+import unittest
+from backend.py3.include import BloomFilter, DuplicateFilter
+
+
+class TestBloomFilter(unittest.TestCase):
+    def test_invalid_parameters(self):
+        self.assertRaises(ValueError, BloomFilter, 0)
+        self.assertRaises(ValueError, BloomFilter, 10, error_rate=0)
+        self.assertRaises(ValueError, BloomFilter, 10, error_rate=1)
+
+    def test_add(self):
+        bloom_filter = BloomFilter(100)
+        digest = DuplicateFilter.digest(b"sample")
+        self.assertNotIn(digest, bloom_filter)
+        self.assertTrue(bloom_filter.add(digest))
+        self.assertIn(digest, bloom_filter)
+        self.assertFalse(bloom_filter.add(digest))
+
+    def test_error_rate(self):
+        bloom_filter = BloomFilter(1000, error_rate=0.01)
+        for i in range(1000):
+            bloom_filter.add(DuplicateFilter.digest(b"in%d" % i))
+        n_false_positives = sum(DuplicateFilter.digest(b"out%d" % i) in bloom_filter for i in range(10000))
+        self.assertLess(n_false_positives, 300)
+
+    def test_merge(self):
+        first, second = BloomFilter(100), BloomFilter(100)
+        first.add(DuplicateFilter.digest(b"first"))
+        second.add(DuplicateFilter.digest(b"second"))
+        first.merge(second)
+        self.assertIn(DuplicateFilter.digest(b"first"), first)
+        self.assertIn(DuplicateFilter.digest(b"second"), first)
+        self.assertRaises(ValueError, first.merge, BloomFilter(1000))
+
+
+class TestDuplicateFilter(unittest.TestCase):
+    def test_exact(self):
+        duplicate_filter = DuplicateFilter()
+        self.assertEqual([True, True, False, True, False],
+                         [duplicate_filter.add(sample) for sample in (b"a", b"b", b"a", b"", b"")])
+        self.assertIsNone(duplicate_filter.bloom_filter)
+        self.assertEqual(5, duplicate_filter.n_samples)
+        self.assertEqual(2, duplicate_filter.n_duplicates)
+        self.assertAlmostEqual(0.4, duplicate_filter.duplicate_rate)
+        self.assertEqual("2 of 5 samples were duplicates (40.00%)", duplicate_filter.report())
+
+    def test_empty(self):
+        self.assertEqual(0.0, DuplicateFilter().duplicate_rate)
+
+    def test_switch_to_bloom_filter(self):
+        duplicate_filter = DuplicateFilter(exact_limit=10, bloom_capacity=100)
+        for i in range(10):
+            duplicate_filter.add(b"%d" % i)
+        self.assertIsNone(duplicate_filter.bloom_filter)
+        duplicate_filter.add(b"10")
+        self.assertIsNone(duplicate_filter.digests)
+        self.assertIsNotNone(duplicate_filter.bloom_filter)
+        # Samples remembered exactly are still known after the switch
+        self.assertEqual([False] * 11, [duplicate_filter.add(b"%d" % i) for i in range(11)])
+        self.assertTrue(duplicate_filter.add(b"11"))
+        self.assertEqual(11, duplicate_filter.n_duplicates)
+
+    def test_exact_limit_zero(self):
+        duplicate_filter = DuplicateFilter(exact_limit=0, bloom_capacity=10)
+        self.assertTrue(duplicate_filter.add(b"a"))
+        self.assertIsNotNone(duplicate_filter.bloom_filter)
+        self.assertFalse(duplicate_filter.add(b"a"))
+
+    def test_merge_exact(self):
+        first, second = DuplicateFilter(), DuplicateFilter()
+        first.add(b"a")
+        second.add(b"b")
+        second.add(b"b")
+        first.merge(second)
+        self.assertEqual(3, first.n_samples)
+        self.assertEqual(1, first.n_duplicates)
+        self.assertFalse(first.add(b"a"))
+        self.assertFalse(first.add(b"b"))
+        self.assertIsNone(first.bloom_filter)
+
+    def test_merge_over_exact_limit(self):
+        first = DuplicateFilter(exact_limit=2, bloom_capacity=100)
+        second = DuplicateFilter(exact_limit=2, bloom_capacity=100)
+        first.add(b"a")
+        first.add(b"b")
+        second.add(b"c")
+        first.merge(second)
+        self.assertIsNotNone(first.bloom_filter)
+        self.assertEqual([False, False, False, True], [first.add(sample) for sample in (b"a", b"b", b"c", b"d")])
+
+    def test_merge_bloom_filters(self):
+        first = DuplicateFilter(exact_limit=0, bloom_capacity=100)
+        second = DuplicateFilter(exact_limit=0, bloom_capacity=100)
+        first.add(b"a")
+        second.add(b"b")
+        first.merge(second)
+        self.assertEqual([False, False], [first.add(sample) for sample in (b"a", b"b")])
+        # A filter still remembering its samples exactly can take the samples of a Bloom filter
+        third = DuplicateFilter(bloom_capacity=100)
+        third.add(b"c")
+        third.merge(first)
+        self.assertEqual([False, False, False], [third.add(sample) for sample in (b"a", b"b", b"c")])
@@ -0,0 +1,20 @@
+import unittest
+import hashlib
+import zlib
+from backend.py3.include import fn
+
+
+class TestDigest(unittest.TestCase):
+    def test_crc32(self):
+        output = fn.digest("crc32", lambda sink: sink.write(b"abc"), lambda sink: sink.write(memoryview(b"def")))
+        self.assertEqual(fn.crc32(b"abcdef"), output)
+        self.assertEqual(zlib.crc32(b"abcdef").to_bytes(4), output)
+
+    def test_hashlib(self):
+        for hash_name in ("md5", "sha1", "sha256", "sha3_512"):
+            output = fn.digest(hash_name, lambda sink: sink.write(b"abc"), lambda sink: sink.write(b"def"))
+            self.assertEqual(getattr(fn, hash_name)(b"abcdef"), output)
+        self.assertEqual(hashlib.sha256(b"").digest(), fn.digest("sha256"))
+
+    def test_unknown(self):
+        self.assertRaises(KeyError, fn.digest, "crc64")
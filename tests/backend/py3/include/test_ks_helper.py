@@ -1,5 +1,9 @@
 import unittest
-from backend.py3.include import KsHelper
+import io
+import struct
+import sys
+import threading
+from backend.py3.include import KsHelper, LazyRandomBytes
 
 
 class TestKsHelper(unittest.TestCase):
@@ -25,6 +29,72 @@ class TestKsHelper(unittest.TestCase):
         inst = KsHelper()
         self.assertRaises(ValueError, inst.rand_bytes, -1)
 
+    def test_rand_bytes_lazy_small(self):
+        inst = KsHelper()
+        output = inst.rand_bytes_lazy(50)
+        self.assertIsInstance(output, bytes)
+        self.assertEqual(50, len(output))
+
+    def test_rand_bytes_lazy_large(self):
+        inst = KsHelper()
+        expected_length = 3 * 2**20
+        output = inst.rand_bytes_lazy(expected_length)
+        self.assertIsInstance(output, LazyRandomBytes)
+        self.assertEqual(expected_length, len(output))
+        data = bytes(output)
+        self.assertEqual(expected_length, len(data))
+        # Generated again from the same seed
+        self.assertEqual(data, bytes(output))
+
+    def test_rand_bytes_lazy_min_max(self):
+        inst = KsHelper()
+        output = inst.rand_bytes_lazy(-1, min_n_bytes=5, max_n_bytes=10)
+        self.assertTrue(5 <= len(output) <= 10)
+
+    def test_write_bytes(self):
+        lazy_bytes = LazyRandomBytes(200000, seed=42)
+        sink = io.BytesIO()
+        KsHelper.write_bytes(sink, lazy_bytes)
+        KsHelper.write_bytes(sink, b"end")
+        self.assertEqual(bytes(lazy_bytes) + b"end", sink.getvalue())
+
+    def test_negative_lazy_random_bytes(self):
+        self.assertRaises(ValueError, LazyRandomBytes, -1, 42)
+
+    def test_rand_int_array_full_range(self):
+        inst = KsHelper()
+        output = inst.rand_int_array(1000, 0, 65535, 2, False)
+        self.assertEqual(1000, len(output))
+        self.assertEqual(2, output.itemsize)
+
+    def test_rand_int_array_range(self):
+        inst = KsHelper()
+        output = inst.rand_int_array(1000, -3, 3, 8, True)
+        self.assertEqual(1000, len(output))
+        self.assertEqual({-3, -2, -1, 0, 1, 2, 3}, set(output))
+
+    def test_rand_int_array_large_range(self):
+        inst = KsHelper()
+        output = inst.rand_int_array(100, 1, 2**64 - 2, 8, False)
+        self.assertTrue(all(1 <= i <= 2**64 - 2 for i in output))
+
+    def test_rand_int_array_invalid(self):
+        inst = KsHelper()
+        self.assertRaises(ValueError, inst.rand_int_array, -1, 0, 255, 1, False)
+        self.assertRaises(ValueError, inst.rand_int_array, 1, 5, 4, 1, False)
+        self.assertRaises(ValueError, inst.rand_int_array, 1, 0, 256, 1, False)
+
+    def test_rand_float_array(self):
+        inst = KsHelper()
+        self.assertEqual(10, len(inst.rand_float_array(10)))
+        self.assertEqual(10, len(inst.rand_double_array(10)))
+
+    def test_array_to_bytes(self):
+        inst = KsHelper()
+        output = inst.rand_int_array(3, 0, 2**32 - 1, 4, False)
+        self.assertEqual(struct.pack(">3I", *output), KsHelper.array_to_bytes(output, "big"))
+        self.assertEqual(struct.pack("<3I", *output), KsHelper.array_to_bytes(output, "little"))
+
     def test_small_rand_utf8(self):
         inst = KsHelper()
         expected_length = 50
@@ -59,6 +129,64 @@ class TestKsHelper(unittest.TestCase):
         self.assertEqual(len(output), expected_length)
         self.assertIsNotNone(output.decode(encoding="utf-8"))
 
+    def test_rand_utf8_bytes(self):
+        inst = KsHelper()
+        for expected_length in range(20):
+            output = inst.rand_utf8_bytes(expected_length)
+            self.assertEqual(expected_length, len(output))
+            output.decode("utf-8")
+
+    def test_rand_utf8_bytes_with_terminator(self):
+        inst = KsHelper()
+        output = inst.rand_utf8_bytes(10, b"\x00")
+        self.assertEqual(10, len(output))
+        self.assertEqual(b"\x00", output[-1:])
+        output.decode("utf-8")
+
+    def test_rand_ascii_bytes(self):
+        inst = KsHelper()
+        output = inst.rand_ascii_bytes(1000)
+        self.assertEqual(1000, len(output))
+        self.assertTrue(output.isascii())
+        self.assertEqual(5, len(inst.rand_ascii_bytes(-1, b"\x00", min_n_bytes=5, max_n_bytes=5)))
+
+    def test_rand_iso8859_bytes_undefined_positions(self):
+        inst = KsHelper()
+        for encoding in ("ISO8859-3", "ISO8859-6", "ISO8859-7", "ISO8859-8", "ISO8859-11"):
+            output = inst.rand_iso8859_bytes(1000, encoding)
+            self.assertEqual(1000, len(output))
+            output.decode(encoding)
+            self.assertEqual(1000, len(inst.rand_iso8859(1000, encoding).encode(encoding)))
+
+    def test_rand_iso8859_bytes_invalid_encoding(self):
+        inst = KsHelper()
+        self.assertRaises(ValueError, inst.rand_iso8859_bytes, 10, "utf-8")
+
+    def test_derive_seed_deterministic(self):
+        self.assertEqual(KsHelper.derive_seed(42, 7), KsHelper.derive_seed(42, 7))
+        self.assertNotEqual(KsHelper.derive_seed(42, 7), KsHelper.derive_seed(42, 8))
+        self.assertNotEqual(KsHelper.derive_seed(42, 7), KsHelper.derive_seed(43, 7))
+
+    def test_seed_sample(self):
+        inst = KsHelper()
+        outputs = []
+        for i in range(3):
+            inst.seed_sample(42, i)
+            outputs.append(inst.rand_bytes(32))
+        inst.seed_sample(42, 2)
+        self.assertEqual(outputs[2], inst.rand_bytes(32))
+        self.assertNotEqual(outputs[0], outputs[1])
+
+    def test_derive_seed_negative_index(self):
+        self.assertRaises(ValueError, KsHelper.derive_seed, 42, -1)
+
+    def test_seed(self):
+        inst = KsHelper()
+        inst.seed(1234)
+        expected_output = inst.rand_bytes(32)
+        inst.seed(1234)
+        self.assertEqual(expected_output, inst.rand_bytes(32))
+
     def test_negative_rand_utf8(self):
         inst = KsHelper()
         self.assertRaises(ValueError, inst.rand_utf8, -1)
@@ -175,3 +303,139 @@ class TestKsHelper(unittest.TestCase):
     #     self.assertEqual(len(output), expected_b_len)
     #     self.assertIs(b_old, output)
     #     self.assertEqual(output.decode(), expected_str)
+
+
+class TestChoicePoints(unittest.TestCase):
+    def test_same_as_untracked(self):
+        # Tracing a choice point does not change the samples
+        untracked, tracked = KsHelper(seed=1), KsHelper(seed=1)
+        tracked.trace = []
+        items = [list(range(10)), list(range(10))]
+        for inst, point, order in ((untracked, None, items[0]), (tracked, "T.f", items[1])):
+            inst.values = [inst.rand_choice("abcdef", point), inst.rand_count(0, 100, point), inst.rand_pop(order, point, range(10))]
+        self.assertEqual(untracked.values, tracked.values)
+        self.assertEqual(items[0], items[1])
+        self.assertEqual(3, len(tracked.trace))
+
+    def test_trace(self):
+        inst = KsHelper(seed=1)
+        inst.trace = []
+        value = inst.rand_choice("abc", "T.a")
+        count = inst.rand_count(3, 20, "T.b.count")
+        item = inst.rand_pop([30, 10, 20], "T.c", (10, 20, 30))
+        self.assertEqual([("T.a", "abc".index(value)), ("T.b.count", (count - 3).bit_length()), ("T.c", item // 10 - 1)], inst.trace)
+        inst.rand_choice("abc")
+        self.assertEqual(3, len(inst.trace))
+
+    def test_weights(self):
+        inst = KsHelper(seed=1)
+        inst.set_choice_weights({"T.a": [0, 1, 0], "T.b.count": [0, 0, 0, 1], "T.c": [1, 0, 0]})
+        self.assertEqual({"b"}, {inst.rand_choice("abc", "T.a") for _ in range(100)})
+        self.assertEqual({4, 5, 6, 7}, {inst.rand_count(0, 7, "T.b.count") for _ in range(200)})
+        self.assertEqual(10, inst.rand_pop([30, 10, 20], "T.c", (10, 20, 30)))
+        # Options without weight are still picked once the other ones are used up
+        self.assertEqual({20, 30}, {inst.rand_pop([30, 20], "T.c", (10, 20, 30)) for _ in range(50)})
+
+    def test_weights_skewed(self):
+        inst = KsHelper(seed=1)
+        inst.set_choice_weights({"T.a": [1, 3]})
+        n_b = sum(inst.rand_choice("ab", "T.a") == "b" for _ in range(4000))
+        self.assertAlmostEqual(0.75, n_b / 4000, delta=0.05)
+
+    def test_weights_other_number_of_options(self):
+        inst = KsHelper(seed=1)
+        inst.set_choice_weights({"T.a": [0, 1, 0]})
+        self.assertEqual({"a", "b"}, {inst.rand_choice("ab", "T.a") for _ in range(100)})
+
+    def test_invalid_weights(self):
+        inst = KsHelper()
+        self.assertRaises(ValueError, inst.set_choice_weights, {"T.a": [0, 0]})
+        self.assertRaises(ValueError, inst.set_choice_weights, {"T.a": [1, -1]})
+
+    def test_alias_table(self):
+        for weights in ([1, 1], [1, 3], [0, 5, 0, 1], [0.1, 2.5, 7, 0.4, 1e-9], [3]):
+            prob, alias = KsHelper.alias_table(weights)
+            # Chance of every option, summed over the columns of the table
+            chances = [0.0] * len(weights)
+            for i, (p, j) in enumerate(zip(prob, alias)):
+                chances[i] += p / len(weights)
+                chances[j] += (1 - p) / len(weights)
+            for chance, weight in zip(chances, weights):
+                self.assertAlmostEqual(weight / sum(weights), chance)
+        self.assertRaises(ValueError, KsHelper.alias_table, [0, 0])
+        self.assertRaises(ValueError, KsHelper.alias_table, [])
+
+    def test_precomputed_alias_table(self):
+        inst = KsHelper(seed=1)
+        # The table given is used as is, even if it does not match the weights
+        inst.set_choice_weights({"T.a": [1, 1]}, {"T.a": ((0.0, 1.0), (1, 1))})
+        self.assertEqual({"b"}, {inst.rand_choice("ab", "T.a") for _ in range(50)})
+
+    def test_update_weights(self):
+        inst = KsHelper(seed=1)
+        inst.set_choice_weights({"T.a": [1, 0], "T.b": [0, 1]}, {"T.a": ((0.0, 1.0), (1, 1))})
+        inst.update_choice_weights({"T.b": [1, 0]})
+        self.assertEqual({"T.a": [1, 0], "T.b": [1, 0]}, inst.choice_weights)
+        self.assertEqual(((0.0, 1.0), (1, 1)), inst.alias_tables["T.a"])
+        self.assertEqual({"a"}, {inst.rand_choice("ab", "T.b") for _ in range(50)})
+
+    def generate_while_setting_weights(self, inst, set_weights, check_choice):
+        """Draw at every kind of choice point while `set_weights(i)` is called in a loop from another thread, as the
+        coverage collector of the harness does"""
+        stop = threading.Event()
+
+        def run():
+            i = 0
+            while not stop.is_set():
+                set_weights(i)
+                i += 1
+
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        thread = threading.Thread(target=run)
+        thread.start()
+        try:
+            for _ in range(20000):
+                # Choice points are tracked, so the weights are read even if they were not set
+                inst.trace = []
+                self.assertIn(inst.rand_choice("abc", "T.a"), check_choice)
+                self.assertIn(inst.rand_count(0, 7, "T.b.count"), range(8))
+                self.assertIn(inst.rand_pop([30, 10, 20], "T.c", (10, 20, 30)), (10, 20, 30))
+        finally:
+            stop.set()
+            thread.join()
+            sys.setswitchinterval(switch_interval)
+
+    def test_set_weights_while_generating(self):
+        inst = KsHelper(seed=1)
+        weights = [{}, {"T.a": [0, 1, 0], "T.b.count": [0, 0, 0, 1], "T.c": [1, 2, 3]}]
+        self.generate_while_setting_weights(inst, lambda i: inst.set_choice_weights(weights[i % len(weights)]), "abc")
+
+    def test_update_weights_while_generating(self):
+        inst = KsHelper(seed=1)
+        inst.set_choice_weights({"T.a": [0, 1, 0]})
+        weights = [{"T.b.count": [0, 0, 0, 1], "T.c": [1, 2, 3]}, {"T.b.count": [1, 1], "T.c": [0, 0, 1]}]
+        # The weights of `T.a` are kept by every update
+        self.generate_while_setting_weights(inst, lambda i: inst.update_choice_weights(weights[i % len(weights)]), "b")
+
+    def test_pop_swaps_last(self):
+        inst = KsHelper(seed=1)
+        items = list(range(10))
+        item = inst.rand_pop(items)
+        self.assertEqual(9, len(items))
+        self.assertEqual(set(range(10)) - {item}, set(items))
+        if item != 9:
+            self.assertEqual(9, items[item])
+
+    def test_pop_weights_skewed(self):
+        # The values left hold little of the weight once `a` is used up, `rand_pop` then falls back to their weights
+        inst = KsHelper(seed=1)
+        inst.set_choice_weights({"T.a": [1000, 1, 3, 0]})
+        counts = {"b": 0, "c": 0}
+        for _ in range(2000):
+            items = ["d", "b", "c"]
+            counts[inst.rand_pop(items, "T.a", "abcd")] += 1
+        self.assertAlmostEqual(0.75, counts["c"] / 2000, delta=0.05)
+        # Options without weight are picked last
+        items = ["d", "b"]
+        self.assertEqual(["b", "d"], [inst.rand_pop(items, "T.a", "abcd") for _ in range(2)])
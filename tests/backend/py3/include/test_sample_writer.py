@@ -0,0 +1,69 @@
+import unittest
+import io
+import struct
+import tempfile
+import os
+from backend.py3.include import DirectorySampleWriter, StreamSampleWriter
+
+
+class TestStreamSampleWriter(unittest.TestCase):
+    def test_raw(self):
+        stream = io.BytesIO()
+        with StreamSampleWriter(stream) as writer:
+            writer.write(0, b"abc")
+            writer.write(1, b"de")
+        self.assertEqual(b"abcde", stream.getvalue())
+
+    def test_length_prefixed(self):
+        stream = io.BytesIO()
+        samples = [b"abc", b"", b"\0\1"]
+        with StreamSampleWriter(stream, stream_format="length-prefixed") as writer:
+            for i, sample in enumerate(samples):
+                writer.write(i, sample)
+        expected_data = b""
+        for sample in samples:
+            expected_data += struct.pack(StreamSampleWriter.LENGTH_PREFIX_FORMAT, len(sample)) + sample
+        self.assertEqual(expected_data, stream.getvalue())
+
+    def test_length_prefixed_write_with(self):
+        stream = io.BytesIO()
+        with StreamSampleWriter(stream, stream_format="length-prefixed") as writer:
+            writer.write_with(0, lambda sink: sink.write(b"abc"), size=3)
+            self.assertRaises(ValueError, writer.write_with, 1, lambda sink: sink.write(b"abc"))
+        self.assertEqual(struct.pack(StreamSampleWriter.LENGTH_PREFIX_FORMAT, 3) + b"abc", stream.getvalue())
+
+    def test_delimited(self):
+        stream = io.BytesIO()
+        with StreamSampleWriter(stream, stream_format="delimited", delimiter=b"\0") as writer:
+            writer.write(0, b"abc")
+            writer.write(1, b"de")
+        self.assertEqual(b"abc\0de\0", stream.getvalue())
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, StreamSampleWriter, io.BytesIO(), stream_format="unknown")
+
+
+class TestDirectorySampleWriter(unittest.TestCase):
+    def test_write(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with DirectorySampleWriter(tmp_dir, suffix=".png", width=3) as writer:
+                writer.write(0, b"abc")
+                writer.write(12, b"de")
+            self.assertEqual(["000.png", "012.png"], sorted(os.listdir(tmp_dir)))
+            with open(os.path.join(tmp_dir, "012.png"), "rb") as f:
+                self.assertEqual(b"de", f.read())
+
+    def test_create_directory(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            out_dir = os.path.join(tmp_dir, "a", "b")
+            DirectorySampleWriter(out_dir)
+            self.assertTrue(os.path.isdir(out_dir))
+
+    def test_negative_index(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            writer = DirectorySampleWriter(tmp_dir)
+            self.assertRaises(ValueError, writer.write, -1, b"abc")
+
+    def test_invalid_width(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.assertRaises(ValueError, DirectorySampleWriter, tmp_dir, width=0)
@@ -205,3 +205,103 @@ class TestSeekableBuffer(unittest.TestCase):
         self.assertEqual(ptr_pos, buf.ptr)
         buf.seek(0)
         self.assertEqual(expected_data, buf.get_data())
+
+    def test_append_after_get_data(self):
+        buf = SeekableBuffer()
+        buf.append(b"0123")
+        self.assertEqual(b"0123", buf.get_data())
+        buf.append(b"45")
+        self.assertEqual(b"012345", buf.get_full_data())
+
+    def test_append_keeps_spare_capacity_zeroed(self):
+        buf = SeekableBuffer()
+        for i in range(100):
+            buf.append(bytes([i]) * 3)
+        self.assertEqual(300, len(buf))
+        self.assertGreaterEqual(len(buf.data), len(buf))
+        self.assertEqual(bytes(len(buf.data) - len(buf)), bytes(buf.data[len(buf):]))
+        buf.seek(297)
+        self.assertEqual(b"\x63\x63\x63", buf.get_data())
+
+    def test_write_overwrite(self):
+        buf = SeekableBuffer()
+        buf.append(b"0123456789")
+        buf.seek(2)
+        buf.write(b"ab")
+        self.assertEqual(4, buf.ptr)
+        self.assertEqual(b"01ab456789", buf.get_full_data())
+
+    def test_write_grow(self):
+        buf = SeekableBuffer()
+        buf.append(b"0123")
+        buf.seek(2)
+        buf.write(b"abcdef")
+        self.assertEqual(8, len(buf))
+        self.assertTrue(buf.is_eos())
+        self.assertEqual(b"01abcdef", buf.get_full_data())
+
+    def test_write_empty_buffer(self):
+        buf = SeekableBuffer()
+        buf.write(b"abc")
+        buf.write(b"def")
+        self.assertEqual(b"abcdef", buf.get_full_data())
+
+    def test_get_view(self):
+        buf = SeekableBuffer()
+        buf.append(b"0123456789")
+        view = buf.get_view(4)
+        self.assertIsInstance(view, memoryview)
+        self.assertEqual(b"0123", view)
+        self.assertEqual(b"456789", buf.get_view())
+        self.assertTrue(buf.is_eos())
+
+    def test_get_full_view_no_copy(self):
+        buf = SeekableBuffer()
+        buf.append(b"0123456789")
+        view = buf.get_full_view()
+        buf.seek(0)
+        buf.write(b"a")
+        self.assertEqual(b"a123456789", view)
+
+    def test_get_subbuffer(self):
+        buf = SeekableBuffer()
+        buf.append(b"0123456789")
+        subbuffer = buf.get_subbuffer(2, 4)
+        self.assertTrue(subbuffer.is_subbuffer())
+        self.assertFalse(buf.is_subbuffer())
+        self.assertEqual(4, len(subbuffer))
+        self.assertEqual(b"2345", subbuffer.get_data())
+        # Sub-buffer shares the data
+        subbuffer.seek(0)
+        subbuffer.write(b"ab")
+        self.assertEqual(b"01ab456789", buf.get_full_data())
+
+    def test_subbuffer_cannot_grow(self):
+        buf = SeekableBuffer()
+        buf.append(b"0123456789")
+        subbuffer = buf.get_subbuffer(2, 4)
+        subbuffer.seek(3)
+        self.assertRaises(BufferError, subbuffer.write, b"ab")
+        self.assertRaises(BufferError, subbuffer.append, b"ab")
+        self.assertEqual(b"0123456789", buf.get_full_data())
+
+    def test_grow_buf(self):
+        buf = SeekableBuffer()
+        buf.append(b"01")
+        buf._grow_buf(3)
+        self.assertEqual(b"01\0\0\0", buf.get_full_data())
+
+    def test_move_data_right_past_end(self):
+        data = b"0123456789\n"
+        expected_data = b"0" + b"\0" * 10
+        buf = SeekableBuffer()
+        buf.append(data)
+        buf.seek(1)
+        buf._move_data(20)
+        self.assertEqual(expected_data, buf.get_full_data())
+
+    def test_move_data_left_beyond_start(self):
+        buf = SeekableBuffer()
+        buf.append(b"0123456789\n")
+        buf.seek(1)
+        self.assertRaises(ValueError, buf._move_data, -2)
@@ -0,0 +1,1167 @@
+import unittest
+import hashlib
+import importlib.util
+import itertools
+import io
+import os
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from pathlib import Path
+
+import yaml
+
+from frontend.frontend import Frontend
+from backend.py3.code_generator import Python3CodeGenerator
+from backend.py3.include import StreamSampleWriter
+
+DEFINITIONS_DIR = Path(__file__).parents[3] / "definitions"
+
+
+def compile_definition(ksy_file_name: str, output_path: str, optimise: bool = True) -> None:
+    with open(DEFINITIONS_DIR / ksy_file_name, "r") as f:
+        compile_source(yaml.safe_load(f), output_path, optimise)
+
+
+def compile_source(ksy_source: dict, output_path: str, optimise: bool = True) -> None:
+    ir = Frontend(ksy_source).generate_ir()
+    output = io.StringIO()
+    code_gen = Python3CodeGenerator(ir, output, is_entry_point=True, optimise=optimise)
+    code_gen.logger.disabled = True
+    code_gen.generate_code()
+    with open(output_path, "w") as f:
+        f.write(output.getvalue())
+
+
+def split_length_prefixed(data: bytes) -> list[bytes]:
+    samples = []
+    prefix_size = struct.calcsize(StreamSampleWriter.LENGTH_PREFIX_FORMAT)
+    while len(data) > 0:
+        (sample_len, ) = struct.unpack_from(StreamSampleWriter.LENGTH_PREFIX_FORMAT, data)
+        samples.append(data[prefix_size:prefix_size + sample_len])
+        data = data[prefix_size + sample_len:]
+    return samples
+
+
+class GeneratedFuzzerTestCase(unittest.TestCase):
+    KSY_FILE_NAME = "fuzz_png.ksy"
+    KSY_SOURCE = None  # Used instead of `KSY_FILE_NAME` if set
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.fuzzer_path = os.path.join(cls.tmp_dir.name, "output_fuzzer.py")
+        if cls.KSY_SOURCE is not None:
+            compile_source(yaml.safe_load(cls.KSY_SOURCE), cls.fuzzer_path)
+        else:
+            compile_definition(cls.KSY_FILE_NAME, cls.fuzzer_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def run_fuzzer(self, *args: str) -> bytes:
+        process = subprocess.run([sys.executable, self.fuzzer_path, *args], capture_output=True)
+        self.assertEqual(0, process.returncode, process.stderr.decode(errors="replace"))
+        return process.stdout
+
+    def load_fuzzer(self, fuzzer_path: str = None):
+        """Import the generated fuzzer as a module"""
+        fuzzer_path = fuzzer_path or self.fuzzer_path
+        spec = importlib.util.spec_from_file_location(f"fuzzer_{type(self).__name__}_{Path(fuzzer_path).stem}", fuzzer_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+
+class TestBatchMode(GeneratedFuzzerTestCase):
+    def test_single_sample(self):
+        output = self.run_fuzzer()
+        self.assertTrue(output.startswith(b"\x89PNG\r\n\x1a\n"))
+
+    def test_length_prefixed(self):
+        n_samples = 20
+        samples = split_length_prefixed(self.run_fuzzer("-n", str(n_samples), "-f", "length-prefixed"))
+        self.assertEqual(n_samples, len(samples))
+        for sample in samples:
+            self.assertTrue(sample.startswith(b"\x89PNG\r\n\x1a\n"))
+            self.assertTrue(sample.endswith(b"IEND\xae\x42\x60\x82"))
+
+    def test_output_dir(self):
+        n_samples = 12
+        out_dir = os.path.join(self.tmp_dir.name, "samples")
+        self.assertEqual(b"", self.run_fuzzer("-n", str(n_samples), "-o", out_dir, "--suffix", ".png"))
+        file_names = sorted(os.listdir(out_dir))
+        self.assertEqual([f"{i:02d}.png" for i in range(n_samples)], file_names)
+        for file_name in file_names:
+            with open(os.path.join(out_dir, file_name), "rb") as f:
+                self.assertTrue(f.read().startswith(b"\x89PNG\r\n\x1a\n"))
+
+
+class TestParallelMode(GeneratedFuzzerTestCase):
+    def test_seed_reproducible(self):
+        args = ("-n", "10", "-f", "length-prefixed", "--seed", "1234")
+        self.assertEqual(self.run_fuzzer(*args), self.run_fuzzer(*args))
+
+    def test_jobs_same_output(self):
+        args = ("-n", "25", "-f", "length-prefixed", "--seed", "1234", "--chunk-size", "4")
+        sequential_output = self.run_fuzzer(*args)
+        self.assertEqual(25, len(split_length_prefixed(sequential_output)))
+        self.assertEqual(sequential_output, self.run_fuzzer(*args, "--jobs", "3"))
+
+    def test_index(self):
+        samples = split_length_prefixed(self.run_fuzzer("-n", "10", "-f", "length-prefixed", "--seed", "1234"))
+        self.assertEqual(samples[7], self.run_fuzzer("--seed", "1234", "--index", "7"))
+        self.assertEqual(samples[3:6], split_length_prefixed(
+            self.run_fuzzer("-n", "3", "-f", "length-prefixed", "--seed", "1234", "--index", "3")))
+
+    def test_index_requires_seed(self):
+        process = subprocess.run([sys.executable, self.fuzzer_path, "--index", "7"], capture_output=True)
+        self.assertNotEqual(0, process.returncode)
+
+    def test_different_seed(self):
+        args = ("-n", "10", "-f", "length-prefixed")
+        self.assertNotEqual(self.run_fuzzer(*args, "--seed", "1"), self.run_fuzzer(*args, "--seed", "2"))
+
+
+class TestStreamMode(GeneratedFuzzerTestCase):
+    def test_same_output(self):
+        args = ("-n", "10", "-f", "delimited", "--seed", "1234")
+        self.assertEqual(self.run_fuzzer(*args), self.run_fuzzer(*args, "--stream"))
+
+    def test_output_dir(self):
+        out_dir = os.path.join(self.tmp_dir.name, "stream_samples")
+        self.run_fuzzer("-n", "3", "-o", out_dir, "--seed", "1234", "--stream")
+        samples = split_length_prefixed(self.run_fuzzer("-n", "3", "-f", "length-prefixed", "--seed", "1234"))
+        for i, sample in enumerate(samples):
+            with open(os.path.join(out_dir, f"{i}.bin"), "rb") as f:
+                self.assertEqual(sample, f.read())
+
+    def test_length_prefixed(self):
+        args = ("-n", "10", "-f", "length-prefixed", "--seed", "1234")
+        self.assertEqual(self.run_fuzzer(*args), self.run_fuzzer(*args, "--stream"))
+
+
+class TestMutationMode(GeneratedFuzzerTestCase):
+    def test_chunks_valid(self):
+        samples = split_length_prefixed(self.run_fuzzer("-n", "100", "-f", "length-prefixed", "--seed", "1234", "--mutate"))
+        self.assertEqual(100, len(samples))
+        self.assertGreater(len(set(samples)), 1)
+        for sample in samples:
+            offset = 8
+            while offset < len(sample):
+                (body_len, ) = struct.unpack_from(">I", sample, offset)
+                chunk_type_and_body = sample[offset + 4:offset + 8 + body_len]
+                self.assertEqual(zlib.crc32(chunk_type_and_body).to_bytes(4), sample[offset + 8 + body_len:offset + 12 + body_len])
+                offset += 12 + body_len
+            self.assertEqual(len(sample), offset)
+
+    def test_first_sample(self):
+        args = ("-f", "length-prefixed", "--seed", "1234", "--index", "3")
+        first_sample = split_length_prefixed(self.run_fuzzer("-n", "5", "--mutate", *args))[0]
+        self.assertEqual(self.run_fuzzer("-n", "1", *args), struct.pack(">Q", len(first_sample)) + first_sample)
+
+    def test_stream(self):
+        args = ("-n", "20", "-f", "length-prefixed", "--seed", "1234", "--mutate")
+        self.assertEqual(self.run_fuzzer(*args), self.run_fuzzer(*args, "--stream"))
+
+    def test_same_as_regenerated(self):
+        fuzzer = self.load_fuzzer()
+        sample = fuzzer.create_sample()
+        for _ in range(50):
+            fuzzer.mutate_sample(sample)
+            output = sample.result()
+            objects = [sample]
+            for obj in objects:
+                obj._cached = False
+                obj._io = fuzzer.SeekableBuffer()
+                obj._bytes_cache.clear()
+                for name in obj.__slots__:
+                    value = getattr(obj, name, None)
+                    if not name.startswith("_"):
+                        objects.extend(item for item in (value if isinstance(value, list) else [value]) if hasattr(item, "_bytes_cache"))
+            self.assertEqual(sample.result(), output)
+
+    def test_depends_on_other_object(self):
+        # The frame control chunks and the scanlines are generated from `_root.ihdr`, they are generated again with it
+        fuzzer = self.load_fuzzer()
+        for seed in (6, 11, 14):
+            fuzzer.ks_helper.seed(seed)
+            sample = fuzzer.create_sample()
+            for _ in range(50):
+                fuzzer.mutate_sample(sample)
+                self.assertEqual(b"\x89PNG\r\n\x1a\n", sample.result()[:8])
+                for chunk in sample.chunks:
+                    if isinstance(chunk.body, fuzzer.FrameControlChunk_):
+                        self.assertLessEqual(chunk.body.x_offset + chunk.body.width, sample.ihdr.width)
+                        self.assertLessEqual(chunk.body.y_offset + chunk.body.height, sample.ihdr.height)
+                    elif isinstance(chunk.body, fuzzer.IdatChunk_):
+                        self.assertEqual(sample.ihdr.height, len(chunk.body.data.scanline))
+
+    def test_jobs_not_supported(self):
+        process = subprocess.run([sys.executable, self.fuzzer_path, "--mutate", "-j", "2"], capture_output=True)
+        self.assertNotEqual(0, process.returncode)
+
+
+class TestGenerateApi(GeneratedFuzzerTestCase):
+    def test_same_as_cli(self):
+        fuzzer = self.load_fuzzer()
+        args = ("-n", "5", "-f", "length-prefixed", "--seed", "1234", "--index", "3")
+        self.assertEqual(split_length_prefixed(self.run_fuzzer(*args)), list(fuzzer.generate(5, seed=1234, start=3)))
+        self.assertEqual(split_length_prefixed(self.run_fuzzer(*args, "--mutate")), list(fuzzer.generate(5, seed=1234, start=3, mutate=True)))
+
+    def test_forever(self):
+        fuzzer = self.load_fuzzer()
+        samples = list(itertools.islice(fuzzer.generate(seed=1234), 10))
+        self.assertEqual(list(fuzzer.generate(10, seed=1234)), samples)
+        for sample in samples:
+            self.assertIsInstance(sample, bytes)
+            self.assertEqual(b"\x89PNG\r\n\x1a\n", sample[:8])
+
+    def test_invalid_arguments(self):
+        fuzzer = self.load_fuzzer()
+        self.assertRaises(ValueError, next, fuzzer.generate(-1))
+        self.assertRaises(ValueError, next, fuzzer.generate(1, start=-1, seed=1))
+        self.assertRaises(ValueError, next, fuzzer.generate(1, start=1))
+
+
+class TestServeMode(GeneratedFuzzerTestCase):
+    def read_samples(self, stream, count):
+        samples = []
+        for _ in range(count):
+            (sample_len, ) = struct.unpack(">Q", stream.read(8))
+            samples.append(stream.read(sample_len))
+        return samples
+
+    def test_stdio(self):
+        process = subprocess.run([sys.executable, self.fuzzer_path, "--serve", "-"], input=b"3 1234 2\n-1\n2 1234\n", capture_output=True)
+        self.assertEqual(0, process.returncode, process.stderr.decode(errors="replace"))
+        output = io.BytesIO(process.stdout)
+        self.assertEqual(split_length_prefixed(self.run_fuzzer("-n", "3", "-s", "1234", "-i", "2", "-f", "length-prefixed")), self.read_samples(output, 3))
+        (error_len, message_len) = struct.unpack(">QQ", output.read(16))
+        self.assertEqual(2**64 - 1, error_len)
+        self.assertIn(b"negative", output.read(message_len))
+        self.assertEqual(split_length_prefixed(self.run_fuzzer("-n", "2", "-s", "1234", "-f", "length-prefixed")), self.read_samples(output, 2))
+        self.assertEqual(b"", output.read())
+
+    def test_unix_socket(self):
+        socket_path = os.path.join(self.tmp_dir.name, "fuzzer.sock")
+        process = subprocess.Popen([sys.executable, self.fuzzer_path, "--serve", socket_path])
+        try:
+            deadline = time.monotonic() + 30
+            while not os.path.exists(socket_path):
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.05)
+            expected = split_length_prefixed(self.run_fuzzer("-n", "4", "-s", "99", "-i", "10", "-f", "length-prefixed"))
+            # Clients are served one after another, every client gets the same samples
+            for _ in range(2):
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                    client.connect(socket_path)
+                    with client.makefile("rwb") as stream:
+                        stream.write(b"4 99 10\n")
+                        stream.flush()
+                        self.assertEqual(expected, self.read_samples(stream, 4))
+                        stream.write(b"1 99 13\n")
+                        stream.flush()
+                        self.assertEqual(expected[3:], self.read_samples(stream, 1))
+        finally:
+            process.terminate()
+            process.wait()
+
+    def test_jobs_not_supported(self):
+        process = subprocess.run([sys.executable, self.fuzzer_path, "--serve", "-", "-j", "2"], capture_output=True)
+        self.assertNotEqual(0, process.returncode)
+
+
+class TestServeModeGenerationError(GeneratedFuzzerTestCase):
+    KSY_SOURCE = """
+meta:
+  id: sized
+seq:
+  - id: len
+    type: u1
+  - id: body
+    size: len - 128
+"""
+
+    def test_error_response(self):
+        # The size of `body` is negative with seed 1, but not with seed 4
+        process = subprocess.run([sys.executable, self.fuzzer_path, "--serve", "-"], input=b"1 1\n1 4\n", capture_output=True)
+        self.assertEqual(0, process.returncode, process.stderr.decode(errors="replace"))
+        output = io.BytesIO(process.stdout)
+        (error_len, message_len) = struct.unpack(">QQ", output.read(16))
+        self.assertEqual(2**64 - 1, error_len)
+        self.assertIn(b"less than 0", output.read(message_len))
+        (sample_len, ) = struct.unpack(">Q", output.read(8))
+        self.assertEqual(self.run_fuzzer("--seed", "4"), output.read(sample_len))
+        self.assertEqual(b"", output.read())
+
+
+class TestDedup(GeneratedFuzzerTestCase):
+    KSY_SOURCE = """
+meta:
+  id: one_byte
+seq:
+  - id: value
+    type: u1
+"""
+
+    def run_dedup(self, *args: str) -> tuple[bytes, str]:
+        process = subprocess.run([sys.executable, self.fuzzer_path, "--dedup", *args], capture_output=True)
+        self.assertEqual(0, process.returncode, process.stderr.decode(errors="replace"))
+        return process.stdout, process.stderr.decode()
+
+    def test_drop_duplicates(self):
+        args = ("-n", "1000", "-f", "length-prefixed", "--seed", "1234")
+        samples = split_length_prefixed(self.run_fuzzer(*args))
+        output, report = self.run_dedup(*args)
+        unique_samples = list(dict.fromkeys(samples))
+        self.assertEqual(unique_samples, split_length_prefixed(output))
+        self.assertIn(f"{1000 - len(unique_samples)} of 1000 samples were duplicates", report)
+
+    def test_jobs_shared_filter(self):
+        args = ("-n", "1000", "-f", "length-prefixed", "--seed", "1234", "--chunk-size", "50")
+        self.assertEqual(self.run_dedup(*args), self.run_dedup(*args, "--jobs", "3"))
+
+    def test_bloom_filter(self):
+        args = ("-n", "1000", "-f", "length-prefixed", "--seed", "1234")
+        self.assertEqual(self.run_dedup(*args), self.run_dedup(*args, "--dedup-exact-limit", "10"))
+
+    def test_output_dir_keeps_index(self):
+        out_dir = os.path.join(self.tmp_dir.name, "dedup_samples")
+        samples = split_length_prefixed(self.run_fuzzer("-n", "300", "-f", "length-prefixed", "--seed", "1234"))
+        self.run_dedup("-n", "300", "-o", out_dir, "--seed", "1234")
+        first_indices = {sample: i for i, sample in reversed(list(enumerate(samples)))}
+        self.assertEqual(sorted(f"{i:03d}.bin" for i in first_indices.values()), sorted(os.listdir(out_dir)))
+
+    def test_mutate(self):
+        output, _ = self.run_dedup("-n", "100", "-f", "length-prefixed", "--seed", "1234", "--mutate")
+        samples = split_length_prefixed(output)
+        self.assertEqual(len(set(samples)), len(samples))
+
+    def test_stream_not_supported(self):
+        process = subprocess.run([sys.executable, self.fuzzer_path, "--dedup", "--stream"], capture_output=True)
+        self.assertNotEqual(0, process.returncode)
+
+
+class AflDriver():
+    """Stand-in for AFL++, calls the hooks of a Python custom mutator the way afl-fuzz does"""
+
+    def __init__(self, mutator, seed: int, max_size: int) -> None:
+        self.mutator = mutator
+        self.max_size = max_size
+        mutator.init(seed)
+
+    def fuzz(self, buf: bytes) -> bytes:
+        output = self.mutator.fuzz(bytearray(buf), None, self.max_size)
+        assert isinstance(output, bytearray) and len(output) <= self.max_size
+        return bytes(output)
+
+    def trim(self, buf: bytes, same_behaviour) -> bytes:
+        """Trim `buf` while `same_behaviour` says the trimmed input behaves the same"""
+        n_steps = self.mutator.init_trim(bytearray(buf))
+        step = 0
+        while step < n_steps:
+            output = bytes(self.mutator.trim())
+            success = same_behaviour(output)
+            if success:
+                buf = output
+            step = self.mutator.post_trim(success)
+        return buf
+
+    def close(self) -> None:
+        self.mutator.deinit()
+
+
+class TestAflMutator(GeneratedFuzzerTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with open(os.path.join(cls.tmp_dir.name, "afl_mutator.py"), "w") as f:
+            f.write(Python3CodeGenerator.generate_afl_mutator("output_fuzzer"))
+
+    def setUp(self):
+        sys.path.insert(0, self.tmp_dir.name)
+        self.mutator = importlib.import_module("afl_mutator")
+        self.driver = AflDriver(self.mutator, seed=1234, max_size=2**20)
+
+    def tearDown(self):
+        self.driver.close()
+        sys.path.remove(self.tmp_dir.name)
+        for name in ("afl_mutator", "output_fuzzer"):
+            sys.modules.pop(name, None)
+
+    def assertValidPng(self, sample: bytes):
+        self.assertEqual(b"\x89PNG\r\n\x1a\n", sample[:8])
+        offset = 8
+        while offset < len(sample):
+            (body_len, ) = struct.unpack_from(">I", sample, offset)
+            chunk_type_and_body = sample[offset + 4:offset + 8 + body_len]
+            self.assertEqual(zlib.crc32(chunk_type_and_body).to_bytes(4), sample[offset + 8 + body_len:offset + 12 + body_len])
+            offset += 12 + body_len
+        self.assertEqual(len(sample), offset)
+
+    def test_fuzz(self):
+        sample = self.driver.fuzz(b"not generated by the mutator")
+        self.assertValidPng(sample)
+        for _ in range(20):
+            previous_recipe = self.mutator.state.find_recipe(sample)
+            mutated = self.driver.fuzz(sample)
+            self.assertValidPng(mutated)
+            recipe = self.mutator.state.find_recipe(mutated)
+            self.assertEqual(previous_recipe.seeds, recipe.seeds[:-1])
+            sample = mutated
+        # A sample can be generated again from its recipe
+        fuzzer = sys.modules["output_fuzzer"]
+        fuzzer.ks_helper.seed(recipe.seeds[0])
+        regenerated = fuzzer.create_sample()
+        for seed in recipe.seeds[1:]:
+            fuzzer.ks_helper.seed(seed)
+            fuzzer.mutate_sample(regenerated)
+        self.assertEqual(sample, regenerated.result())
+
+    def test_same_seed(self):
+        samples = [self.driver.fuzz(b"") for _ in range(3)]
+        self.driver.close()
+        self.driver = AflDriver(self.mutator, seed=1234, max_size=2**20)
+        self.assertEqual(samples, [self.driver.fuzz(b"") for _ in range(3)])
+
+    def test_max_size(self):
+        self.driver.max_size = 20
+        sample = self.driver.fuzz(b"")
+        self.assertEqual(20, len(sample))
+        self.assertIsNone(self.mutator.state.find_recipe(sample))
+
+    def test_trim(self):
+        sample = self.driver.fuzz(b"")
+        while self.mutator.init_trim(bytearray(sample)) < 2:
+            sample = self.driver.fuzz(b"")
+        trimmed = self.driver.trim(sample, lambda output: True)
+        self.assertLess(len(trimmed), len(sample))
+        self.assertValidPng(trimmed)
+        self.assertEqual(sample, self.driver.trim(sample, lambda output: False))
+        self.assertEqual(b"abc", self.driver.trim(b"abc", lambda output: True))
+
+
+class TestStreamModeLargeField(GeneratedFuzzerTestCase):
+    KSY_SOURCE = """
+meta:
+  id: large_field
+  endian: be
+seq:
+  - id: len
+    type: u4
+    -fz-attr-len: body
+  - id: body
+    size-eos: true
+    -fz-size-min: 2000000
+    -fz-size-max: 3000000
+  - id: crc
+    size: 4
+    -fz-process-crc32: body
+"""
+
+    def test_same_output(self):
+        args = ("-n", "2", "-f", "delimited", "--seed", "1234")
+        output = self.run_fuzzer(*args)
+        self.assertEqual(output, self.run_fuzzer(*args, "--stream"))
+
+    def test_fields(self):
+        sample = self.run_fuzzer("--seed", "1234", "--stream")
+        (body_len, ) = struct.unpack_from(">I", sample)
+        self.assertGreaterEqual(body_len, 2000000)
+        self.assertEqual(4 + body_len + 4, len(sample))
+        self.assertEqual(zlib.crc32(sample[4:-4]).to_bytes(4), sample[-4:])
+
+
+class TestSize(GeneratedFuzzerTestCase):
+    def test_same_as_result(self):
+        fuzzer = self.load_fuzzer()
+        for _ in range(50):
+            sample = fuzzer.create_sample()
+            size = len(sample)
+            self.assertEqual(size, len(sample.result()))
+            self.assertEqual(size, len(sample))
+
+
+class TestSizeLargeField(GeneratedFuzzerTestCase):
+    KSY_SOURCE = """
+meta:
+  id: large_field
+  endian: be
+seq:
+  - id: len
+    type: u4
+    -fz-attr-len: body
+  - id: body
+    size-eos: true
+    -fz-size-min: 2000000
+    -fz-size-max: 3000000
+"""
+
+    def test_not_generated(self):
+        fuzzer = self.load_fuzzer()
+        sample = fuzzer.create_sample()
+        self.assertIsInstance(sample.body, fuzzer.LazyRandomBytes)
+        self.assertEqual(len(sample.body), sample.len)
+        self.assertEqual(4 + sample.len, len(sample))
+
+
+class TestNumberArray(GeneratedFuzzerTestCase):
+    KSY_SOURCE = """
+meta:
+  id: number_array
+  endian: be
+seq:
+  - id: n
+    type: u1
+  - id: full_range
+    type: u2
+    repeat: expr
+    repeat-expr: n
+  - id: small_range
+    type: s4le
+    repeat: expr
+    repeat-expr: 3
+    -fz-range-min: -5
+    -fz-range-max: 5
+  - id: floats
+    type: f8
+    repeat: eos
+    -fz-repeat-min: 2
+    -fz-repeat-max: 2
+  - id: counter
+    type: u2
+    repeat: expr
+    repeat-expr: 3
+    -fz-increment: start
+    -fz-increment-step: 2
+instances:
+  start:
+    value: 7
+"""
+
+    def test_fields(self):
+        for sample in split_length_prefixed(self.run_fuzzer("-n", "20", "-f", "length-prefixed")):
+            n = sample[0]
+            self.assertEqual(1 + 2 * n + 4 * 3 + 8 * 2 + 2 * 3, len(sample))
+            offset = 1 + 2 * n
+            small_range = struct.unpack_from("<3i", sample, offset)
+            for value in small_range:
+                self.assertTrue(-5 <= value <= 5)
+            offset += 4 * 3 + 8 * 2
+            self.assertEqual((7, 9, 11), struct.unpack_from(">3H", sample, offset))
+
+    def test_out_of_range(self):
+        for seq_type, range_min, range_max in (("u1", 0, 300), ("s2le", -40000, 0), ("u4", -1, 10)):
+            source = yaml.safe_load(self.KSY_SOURCE)
+            source["seq"][2].update({"type": seq_type, "-fz-range-min": range_min, "-fz-range-max": range_max})
+            with self.assertRaises(ValueError):
+                compile_source(source, os.path.join(self.tmp_dir.name, "invalid.py"))
+
+
+class TestStringBytes(GeneratedFuzzerTestCase):
+    KSY_SOURCE = """
+meta:
+  id: text
+seq:
+  - id: name
+    type: str
+    size: 12
+    encoding: ascii
+  - id: body
+    type: strz
+    size: 9
+    encoding: iso8859-6
+  - id: note
+    type: str
+    size: 6
+    encoding: utf-8
+    if: name != ""
+instances:
+  greeting:
+    value: name + "!"
+"""
+
+    def test_fields(self):
+        for sample in split_length_prefixed(self.run_fuzzer("-n", "20", "-f", "length-prefixed")):
+            self.assertEqual(12 + 9 + 6, len(sample))
+            sample[:12].decode("ascii")
+            self.assertEqual(0, sample[20])
+            sample[12:21].decode("iso8859-6")
+            sample[21:].decode("utf-8")
+
+
+class TestFusedStructPacking(GeneratedFuzzerTestCase):
+    KSY_SOURCE = """
+meta:
+  id: header
+  endian: le
+seq:
+  - id: magic
+    type: u4
+  - id: version
+    type: u1
+  - id: kind
+    type: u1
+    enum: kind
+  - id: width
+    type: u2be
+  - id: height
+    type: u2be
+  - id: flags
+    type: u1
+    if: version > 3
+  - id: scale
+    type: f8
+  - id: offset
+    type: s8
+  - id: tail
+    type: u2
+    repeat: expr
+    repeat-expr: 2
+enums:
+  kind:
+    1: a
+    2: b
+"""
+
+    def test_same_as_fields(self):
+        fuzzer = self.load_fuzzer()
+        self.assertEqual("<IBB", fuzzer.Header_._fused_struct_0.format)
+        self.assertEqual(">HH", fuzzer.Header_._fused_struct_1.format)
+        self.assertEqual("<dq", fuzzer.Header_._fused_struct_2.format)
+        for _ in range(50):
+            sample = fuzzer.create_sample()
+            expected = b"".join(getattr(sample, f"{name}_to_bytes")()
+                                for name in ("magic", "version", "kind", "width", "height", "flags", "scale", "offset", "tail"))
+            output = io.BytesIO()
+            sample.write_to(output)
+            self.assertEqual(expected, output.getvalue())
+            self.assertEqual(expected, sample.result())
+
+
+class TestConstantTemplate(GeneratedFuzzerTestCase):
+    KSY_SOURCE = """
+meta:
+  id: header
+  endian: be
+seq:
+  - id: magic
+    contents: [0x89, "HDR"]
+  - id: version
+    type: u2
+    valid: 0x0102
+  - id: width
+    type: u4
+  - id: reserved
+    type: u1
+    valid: 0
+  - id: body
+    size: 3
+  - id: end_magic
+    contents: "END"
+  - id: end_version
+    type: u1
+    valid: 7
+"""
+
+    def test_templates(self):
+        fuzzer = self.load_fuzzer()
+        # Constants next to numbers are packed with them
+        self.assertEqual(">4s2sI1s", fuzzer.Header_._fused_struct_0.format)
+        self.assertEqual(b"END\x07", fuzzer.Header_._template_0)
+        for _ in range(20):
+            sample = fuzzer.create_sample()
+            expected = b"".join(getattr(sample, f"{name}_to_bytes")()
+                                for name in ("magic", "version", "width", "reserved", "body", "end_magic", "end_version"))
+            self.assertEqual(b"\x89HDR\x01\x02", expected[:6])
+            self.assertEqual(b"\x00END\x07", expected[10:11] + expected[-4:])
+            output = io.BytesIO()
+            sample.write_to(output)
+            self.assertEqual(expected, output.getvalue())
+            self.assertEqual(expected, sample.result())
+            self.assertEqual(len(expected), len(sample))
+
+
+class TestSerialisationCache(GeneratedFuzzerTestCase):
+    KSY_SOURCE = """
+meta:
+  id: chunk
+  endian: be
+seq:
+  - id: len_body
+    type: u4
+    -fz-attr-len: body
+  - id: body
+    size: 16
+  - id: crc
+    size: 4
+    -fz-process-crc32: len_body + body
+"""
+
+    def test_serialised_once(self):
+        fuzzer = self.load_fuzzer()
+        n_calls = []
+        serialise_body = fuzzer.Chunk_._serialise_body
+
+        def count_serialise_body(instance):
+            n_calls.append(instance)
+            return serialise_body(instance)
+
+        fuzzer.Chunk_._serialise_body = count_serialise_body
+        try:
+            sample = fuzzer.create_sample()
+            sample.result()
+            self.assertEqual(1, len(n_calls))
+        finally:
+            fuzzer.Chunk_._serialise_body = serialise_body
+
+    def test_reassigned(self):
+        fuzzer = self.load_fuzzer()
+        sample = fuzzer.create_sample()
+        sample.body_to_bytes()
+        sample.body = b"\x01\x02"
+        self.assertEqual(b"\x01\x02", sample.body_to_bytes())
+
+
+class TestIncrementalChecksum(GeneratedFuzzerTestCase):
+    KSY_SOURCE = """
+meta:
+  id: checksum
+  endian: be
+seq:
+  - id: n
+    type: u1
+  - id: items
+    type: item
+    repeat: expr
+    repeat-expr: n
+  - id: data
+    size: 3000000
+  - id: crc
+    size: 4
+    -fz-process-crc32: n + items + data
+  - id: sha
+    size: 32
+    -fz-process-sha256: items
+types:
+  item:
+    seq:
+      - id: text
+        type: strz
+        encoding: utf-8
+        size: 10
+      - id: value
+        type: u4
+"""
+
+    def test_fields(self):
+        sample = self.run_fuzzer("--seed", "1234")
+        n = sample[0]
+        items = sample[1:1 + 14 * n]
+        data = sample[1 + 14 * n:-36]
+        self.assertEqual(3000000, len(data))
+        self.assertEqual(zlib.crc32(sample[:-36]).to_bytes(4), sample[-36:-32])
+        self.assertEqual(hashlib.sha256(items).digest(), sample[-32:])
+        self.assertEqual(sample, self.run_fuzzer("--seed", "1234", "--stream"))
+
+
+class TestSlots(GeneratedFuzzerTestCase):
+    def test_no_instance_dict(self):
+        fuzzer = self.load_fuzzer()
+        objects = [fuzzer.create_sample()]
+        for obj in objects:
+            self.assertFalse(hasattr(obj, "__dict__"))
+            for name in obj.__slots__:
+                value = getattr(obj, name, None)
+                if not name.startswith("_"):
+                    objects.extend(item for item in (value if isinstance(value, list) else [value]) if hasattr(item, "__slots__"))
+        self.assertGreater(len(objects), 1)
+
+    def test_order_list_not_shadowed(self):
+        fuzzer = self.load_fuzzer()
+        chunk = fuzzer.create_sample().chunks[0]
+        self.assertIsInstance(chunk.type, str)
+        self.assertIsInstance(type(chunk)._type_order, list)
+
+
+class TestBudget(GeneratedFuzzerTestCase):
+    # Never ends without a budget
+    KSY_SOURCE = """
+meta:
+  id: tree
+  endian: be
+seq:
+  - id: nodes
+    type: node
+    repeat: until
+    repeat-until: _io.eof
+types:
+  node:
+    seq:
+      - id: data
+        size-eos: true
+        -fz-size-max: 100
+      - id: children
+        type: node
+        repeat: eos
+        -fz-repeat-min: 1
+        -fz-repeat-max: 2
+"""
+
+    def generate_nodes(self, **limits):
+        fuzzer = self.load_fuzzer()
+        fuzzer.budget.configure(**limits)
+        nodes = list(fuzzer.create_sample().nodes)
+        for node in nodes:
+            nodes.extend(node.children)
+        return nodes
+
+    def test_max_depth(self):
+        nodes = self.generate_nodes(max_depth=4, max_objects=10000)
+        self.assertEqual({1, 2, 3, 4}, {node._depth for node in nodes})
+
+    def test_max_objects(self):
+        self.assertEqual(49, len(self.generate_nodes(max_objects=50)))
+
+    def test_max_bytes(self):
+        nodes = self.generate_nodes(max_bytes=1000)
+        self.assertEqual(1000, sum(len(node.data) for node in nodes))
+
+    def test_max_time(self):
+        start = time.monotonic()
+        self.assertGreater(len(self.generate_nodes(max_time=0.2, max_depth=20)), 0)
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_cli(self):
+        samples = split_length_prefixed(self.run_fuzzer("-n", "5", "-s", "1", "-f", "length-prefixed", "--max-bytes", "500", "--max-depth", "3"))
+        self.assertEqual(5, len(samples))
+        self.assertEqual(samples, split_length_prefixed(
+            self.run_fuzzer("-n", "5", "-s", "1", "-f", "length-prefixed", "--max-bytes", "500", "--max-depth", "3", "-j", "2")))
+        process = subprocess.run([sys.executable, self.fuzzer_path, "--max-objects", "-1"], capture_output=True)
+        self.assertNotEqual(0, process.returncode)
+
+
+class TestOrderRunsDry(GeneratedFuzzerTestCase):
+    KSY_SOURCE = """
+meta:
+  id: tags
+seq:
+  - id: items
+    type: item
+    repeat: until
+    repeat-until: _io.eof
+types:
+  item:
+    seq:
+      - id: tag
+        type: str
+        size: 1
+        encoding: ascii
+        -fz-random-order: ["a", "b", "c"]
+"""
+
+    def test_loop_stops(self):
+        for sample in self.run_fuzzer("-n", "10", "-f", "delimited").splitlines():
+            self.assertEqual(b"abc", bytes(sorted(sample)))
+
+
+class TestChoicePoints(GeneratedFuzzerTestCase):
+    KSY_SOURCE = """
+meta:
+  id: shapes
+  endian: be
+seq:
+  - id: kind
+    type: u1
+    -fz-choice: [1, 2, 3]
+  - id: color
+    type: u1
+    enum: color
+  - id: tag
+    type: str
+    size: 1
+    encoding: ascii
+    -fz-random-order: ["a", "b"]
+  - id: points
+    type: u1
+    repeat: eos
+    -fz-repeat-min: 0
+    -fz-repeat-max: 5
+enums:
+  color:
+    0: red
+    1: green
+"""
+
+    def test_choice_points(self):
+        fuzzer = self.load_fuzzer()
+        self.assertEqual({
+            "Shapes_.kind": ("choice", 3),
+            "Shapes_.color": ("enum", 2),
+            "Shapes_.tag": ("order", 2),
+            "Shapes_.points.count": ("count", 4),
+        }, fuzzer.CHOICE_POINTS)
+        fuzzer.ks_helper.trace = []
+        fuzzer.create_sample()
+        self.assertEqual(set(fuzzer.CHOICE_POINTS), {point for point, _ in fuzzer.ks_helper.trace})
+
+    def test_weights(self):
+        weights_path = os.path.join(self.tmp_dir.name, "weights.json")
+        with open(weights_path, "w") as f:
+            f.write('{"Shapes_.kind": [0, 0, 1], "Shapes_.color": [1, 0], "Shapes_.points.count": [1, 0, 0, 0]}')
+        args = ("-n", "20", "-s", "1", "-f", "length-prefixed", "--choice-weights", weights_path)
+        samples = split_length_prefixed(self.run_fuzzer(*args))
+        self.assertEqual({b"\x03\x00a", b"\x03\x00b"}, set(samples))
+        self.assertEqual(samples, split_length_prefixed(self.run_fuzzer(*args, "-j", "2")))
+
+    def test_invalid_weights(self):
+        weights_path = os.path.join(self.tmp_dir.name, "invalid.json")
+        with open(weights_path, "w") as f:
+            f.write('{"Shapes_.kind": [0, 0, 0]}')
+        process = subprocess.run([sys.executable, self.fuzzer_path, "--choice-weights", weights_path], capture_output=True)
+        self.assertEqual(2, process.returncode)
+
+
+class TestChoiceWeights(GeneratedFuzzerTestCase):
+    KSY_SOURCE = """
+meta:
+  id: shapes
+  endian: be
+seq:
+  - id: kind
+    type: u1
+    -fz-choice: [1, 2, 3]
+    -fz-choice-weights: [0, 1, 3]
+  - id: color
+    type: u1
+    enum: color
+    -fz-choice-weights: [1, 0, 0]
+  - id: tag
+    type: str
+    size: 1
+    encoding: ascii
+    -fz-random-order: ["a", "b"]
+    -fz-random-order-weights: [0, 1]
+enums:
+  color:
+    0: red
+    1: green
+    2: blue
+"""
+
+    def test_weights(self):
+        fuzzer = self.load_fuzzer()
+        self.assertEqual({"Shapes_.kind": [0, 1, 3], "Shapes_.color": [1, 0, 0], "Shapes_.tag": [0, 1]}, fuzzer.CHOICE_WEIGHTS)
+        self.assertEqual(fuzzer.CHOICE_ALIAS_TABLES, fuzzer.ks_helper.alias_tables)
+        samples = list(fuzzer.generate(2000, seed=1))
+        self.assertEqual({b"\x02\x00b", b"\x03\x00b"}, set(samples))
+        self.assertAlmostEqual(0.75, samples.count(b"\x03\x00b") / 2000, delta=0.05)
+
+    def test_cli(self):
+        weights_path = os.path.join(self.tmp_dir.name, "weights.json")
+        with open(weights_path, "w") as f:
+            f.write('{"Shapes_.kind": [1, 0, 0]}')
+        # Weights of the file replace those of the definition, the other ones are kept
+        args = ("-n", "20", "-s", "1", "-f", "length-prefixed", "--choice-weights", weights_path)
+        samples = split_length_prefixed(self.run_fuzzer(*args))
+        self.assertEqual({b"\x01\x00b"}, set(samples))
+        self.assertEqual(samples, split_length_prefixed(self.run_fuzzer(*args, "-j", "2")))
+
+    def test_invalid_weights(self):
+        for key, weights in (("-fz-choice-weights", [1, 2]), ("-fz-choice-weights", [0, 0, 0]), ("-fz-random-order-weights", [1, 2, 3])):
+            source = yaml.safe_load(self.KSY_SOURCE)
+            field = {"-fz-choice-weights": source["seq"][0], "-fz-random-order-weights": source["seq"][2]}[key]
+            field[key] = weights
+            with self.assertRaises(ValueError):
+                compile_source(source, os.path.join(self.tmp_dir.name, "invalid.py"))
+        source = yaml.safe_load(self.KSY_SOURCE)
+        source["seq"][2]["-fz-choice-weights"] = [1, 1]
+        self.assertRaises(ValueError, compile_source, source, os.path.join(self.tmp_dir.name, "invalid.py"))
+
+
+class TestOptimisation(GeneratedFuzzerTestCase):
+    KSY_SOURCE = """
+meta:
+  id: hoist
+  endian: be
+seq:
+  - id: header
+    type: header
+  - id: skipped
+    type: header
+    if: _root.header.limit == 0
+  - id: items
+    type: str
+    encoding: ascii
+    size: _root.header.limit % 4
+    repeat: eos
+    -fz-repeat-min: 0
+    -fz-repeat-max: 6
+  - id: records
+    type:
+      switch-on: _root.header.kind
+      cases:
+        kinds::a: rec_a
+        kinds::b: rec_b
+    repeat: expr
+    repeat-expr: _root.header.n_records
+  - id: counters
+    type: u2
+    -fz-increment: _root.header.n_records
+    -fz-increment-step: 1
+    repeat: expr
+    repeat-expr: 3
+  - id: never
+    type: str
+    encoding: ascii
+    size: _root.skipped.limit
+    repeat: expr
+    repeat-expr: 0
+  - id: tail
+    type: u1
+    repeat: until
+    repeat-until: _ > _root.header.limit
+  - id: tags
+    type: tag
+    repeat: eos
+    -fz-repeat-max: 4
+enums:
+  kinds:
+    0: a
+    1: b
+types:
+  header:
+    seq:
+      - id: kind
+        type: u1
+        enum: kinds
+      - id: limit
+        type: u1
+        -fz-range-min: 1
+        -fz-range-max: 200
+      - id: n_records
+        type: u1
+        -fz-range-max: 4
+  rec_a:
+    seq:
+      - id: a
+        type: u1
+        -fz-range-max: _root.header.limit
+  rec_b:
+    seq:
+      - id: b
+        type: u2
+  tag:
+    seq:
+      - id: name
+        type: str
+        size: 1
+        encoding: ascii
+        -fz-order: ["x", "y", "z"]
+"""
+    # Definitions the compiler supports
+    DEFINITIONS = ("checksum_test", "easy_png", "enums_test", "example", "fixed_content", "fuzz_png", "fz_attr_len_test",
+                   "if_test", "increment_test", "int_range", "loop_test", "reference_test", "string_test", "switch_on_test",
+                   "valid_test")
+
+    def assert_same_samples(self, fuzzer_path: str, unoptimised_path: str, count: int) -> None:
+        fuzzer, unoptimised = self.load_fuzzer(fuzzer_path), self.load_fuzzer(unoptimised_path)
+        for mutate in (False, True):
+            self.assertEqual(list(unoptimised.generate(count, seed=1, mutate=mutate)), list(fuzzer.generate(count, seed=1, mutate=mutate)))
+        for module in (fuzzer, unoptimised):
+            module.budget.configure(max_objects=5)
+        self.assertEqual(list(unoptimised.generate(count, seed=2)), list(fuzzer.generate(count, seed=2)))
+
+    def test_hoisted(self):
+        with open(self.fuzzer_path, "r") as f:
+            code = f.read()
+        self.assertIn("root_header_kind = self._root.header.kind", code)
+        self.assertIn("match root_header_kind:", code)
+        # The field incremented in the loop is read again on every iteration
+        self.assertIn("_ = self._root.header.n_records", code)
+        self.assertIn("self._root.header.n_records += (1)", code)
+
+    def test_same_samples(self):
+        unoptimised_path = os.path.join(self.tmp_dir.name, "unoptimised.py")
+        compile_source(yaml.safe_load(self.KSY_SOURCE), unoptimised_path, optimise=False)
+        self.assert_same_samples(self.fuzzer_path, unoptimised_path, 300)
+
+    def test_definitions(self):
+        for name in self.DEFINITIONS:
+            with self.subTest(name):
+                fuzzer_path = os.path.join(self.tmp_dir.name, f"{name}.py")
+                unoptimised_path = os.path.join(self.tmp_dir.name, f"{name}_unoptimised.py")
+                compile_definition(f"{name}.ksy", fuzzer_path)
+                compile_definition(f"{name}.ksy", unoptimised_path, optimise=False)
+                self.assert_same_samples(fuzzer_path, unoptimised_path, 5 if name.endswith("png") else 30)
+
+
+class TestExpressions(GeneratedFuzzerTestCase):
+    KSY_SOURCE = """
+meta:
+  id: exprs
+  endian: le
+seq:
+  - id: header
+    type: header
+  - id: kind
+    type: u1
+    valid: 2 * 3 + 1
+  - id: body
+    size: header.limit % 4 + 1
+  - id: body_len
+    type: u2
+    -fz-attr-len: body + "!!"
+  - id: another_body
+    size: '(header.limit > 2 ? 2 : 1)'
+  - id: crc
+    size: 4
+    -fz-process-crc32: body + another_body
+  - id: tail
+    type:
+      switch-on: kind
+      cases:
+        7: header
+        8: header
+types:
+  header:
+    seq:
+      - id: limit
+        type: u1
+"""
+
+    def test_fields(self):
+        for seed in range(20):
+            with self.subTest(seed=seed):
+                sample = self.run_fuzzer("--seed", f"{seed}")
+                limit = sample[0]
+                self.assertEqual(7, sample[1])
+                body_size = limit % 4 + 1
+                body = sample[2:2 + body_size]
+                (body_len, ) = struct.unpack_from("<H", sample, 2 + body_size)
+                self.assertEqual(body_size + 2, body_len)
+                another_body_size = 2 if limit > 2 else 1
+                another_body = sample[4 + body_size:4 + body_size + another_body_size]
+                crc = sample[4 + body_size + another_body_size:8 + body_size + another_body_size]
+                self.assertEqual(zlib.crc32(body + another_body).to_bytes(4), crc)
+                self.assertEqual(9 + body_size + another_body_size, len(sample))
+
+    def test_compiled(self):
+        with open(self.fuzzer_path, "r") as f:
+            code = f.read()
+        # Folded to a constant, packed with the neighbouring fields
+        self.assertIn("_template_0 = b'\\x07'", code)
+        self.assertIn("self.body_len = self.body_size() + 2", code)
+        self.assertIn("(2 if self.header.limit > 2 else 1)", code)
+
+    def test_dependents(self):
+        fuzzer = self.load_fuzzer()
+        self.assertEqual(("body", "body_len", "another_body", "crc"), fuzzer.Exprs_._dependents["header"])
+        # The name contains `not`, an operator
+        self.assertEqual(("crc", ), fuzzer.Exprs_._dependents["another_body"])
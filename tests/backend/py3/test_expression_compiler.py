@@ -0,0 +1,142 @@
+import unittest
+from types import SimpleNamespace
+
+from backend.py3.expression_compiler import Python3ExpressionCompiler, get_constant_value
+
+
+class TestPython3ExpressionCompiler(unittest.TestCase):
+    def setUp(self):
+        self.compiler = Python3ExpressionCompiler("Chunk_", ["len", "type", "body", "header", "limit", "ctr"], ["ctr"])
+
+    def test_references(self):
+        cases = {
+            "len * 2": "self.len * 2",
+            "ctr": "Chunk_.ctr",
+            "_root.ihdr.width - width": "self._root.ihdr.width - width",
+            "_parent.len": "self._parent.len",
+            "header.limit % 4": "self.header.limit % 4",
+            "_.type == \"IEND\" or _io.eof": "_.type == \"IEND\" or False",
+            "type == chunk::types::body_0": "self.type == Chunk_.Types_.body_0",
+            "color_type::greyscale": "ColorType_.greyscale",
+        }
+        for expression, code in cases.items():
+            with self.subTest(expression=expression):
+                self.assertEqual(code, self.compiler.compile(expression))
+
+    def test_parentheses(self):
+        cases = {
+            "len - (limit - 1)": "self.len - (self.limit - 1)",
+            "(len - limit) - 1": "self.len - self.limit - 1",
+            "_root.w * (_root.d / 8) * 4": "self._root.w * (self._root.d / 8) * 4",
+            "(len == 1) == (limit == 2)": "(self.len == 1) == (self.limit == 2)",
+            "not (len or limit)": "not (self.len or self.limit)",
+            "-(len + 1)": "-(self.len + 1)",
+            "(len ? 1 : 2) + 1": "(1 if self.len else 2) + 1",
+            "len / (limit == 0 ? 100.0 : limit)": "self.len / (100.0 if self.limit == 0 else self.limit)",
+            "len ? 1 : 2": "(1 if self.len else 2)",
+            "(a ? b : c) ? d : e": "(d if (b if a else c) else e)",
+        }
+        for expression, code in cases.items():
+            with self.subTest(expression=expression):
+                self.assertEqual(code, self.compiler.compile(expression))
+
+    def test_constant_folding(self):
+        cases = {
+            "2 * 3 + len": "6 + self.len",
+            "len + 2 * 3": "self.len + 6",
+            "1 << 4 | 0x0f": "31",
+            "-(3)": "-3",
+            "7 / 2": "3.5",
+            "\"IE\" + \"ND\"": "\"IEND\"",
+            "1 == 1 ? len : limit": "self.len",
+            "false or len": "self.len",
+            "true and 0": "0",
+            "not true": "False",
+            # Left to the generated code
+            "1 / 0": "1 / 0",
+            "1 << 1000": "1 << 1000",
+            "\"a\" * 3": "\"a\" * 3",
+            "len * 1": "self.len * 1",
+        }
+        for expression, code in cases.items():
+            with self.subTest(expression=expression):
+                self.assertEqual(code, self.compiler.compile(expression))
+
+    def test_same_value(self):
+        # Without a ternary, an expression is valid Python with the same precedence
+        obj = SimpleNamespace(len=5, limit=0, _root=SimpleNamespace(w=3, d=16))
+        expressions = ("len - (limit - 1) * 3 % 4", "-len << 2 ^ ~limit & 7", "not len > 3 and limit == 0 or _root.w",
+                       "(len > 1) == (limit > 1)", "_root.w * (_root.d / 8) * 4", "(2 + 3) * len - -1 + (1 << 3)")
+        for expression in expressions:
+            with self.subTest(expression=expression):
+                code = self.compiler.compile(expression)
+                self.assertEqual(eval(expression, {}, vars(obj)), eval(code, {}, {"self": obj}))
+
+    def test_produce_bytes(self):
+        cases = {
+            "type + body": "self.type_to_bytes() + self.body_to_bytes()",
+            "body + \"!\"": "self.body_to_bytes() + b'!'",
+            "_root.ihdr + [1, 2]": "self._root.ihdr_to_bytes() + b'\\x01\\x02'",
+            "ctr + body": "Chunk_.ctr + self.body_to_bytes()",
+            "body[len]": "self.body[self.len]",
+        }
+        for expression, code in cases.items():
+            with self.subTest(expression=expression):
+                self.assertEqual(code, self.compiler.compile(expression, produce_bytes=True))
+
+    def test_bytes_parts(self):
+        cases = {
+            "type + body": ["self.type", "self.body"],
+            "len + \"a\" + \"b\" + _root.ihdr": ["self.len", b"ab", "self._root.ihdr"],
+            "body + (\"x\" + \"y\")": ["self.body", b"xy"],
+            "body": ["self.body"],
+            "ctr + body": None,
+            "body + len * 2": None,
+            "unknown + body": None,
+        }
+        for expression, parts in cases.items():
+            with self.subTest(expression=expression):
+                self.assertEqual(parts, self.compiler.compile_bytes_parts(expression))
+
+    def test_cached(self):
+        self.assertIs(self.compiler.compile("len + 1"), self.compiler.compile("len + 1"))
+
+    def test_compile_in_loop(self):
+        hoisted = {}
+        cases = {
+            "_root.ihdr.width * (_root.ihdr.bit_depth / 8)": "root_ihdr_width * (root_ihdr_bit_depth / 8)",
+            "header.limit + len + _root.ihdr.width": "header_limit + self.len + root_ihdr_width",
+            # Not hoisted: the field being generated, the loop item, static fields and `_io`
+            "body.len + _.len + ctr + _root._io.pos": "self.body.len + _.len + Chunk_.ctr + self._root._io.pos",
+            # Only the condition of a ternary is evaluated every time
+            "_root.ihdr.height > 0 ? _parent.a.b : _parent.c.d": "(self._parent.a.b if root_ihdr_height > 0 else self._parent.c.d)",
+            "header.kind != 0 and header.size.value": "header_kind != 0 and self.header.size.value",
+            "header.name.to_s() + \"self.header.limit\"": "header_name.to_s() + \"self.header.limit\"",
+        }
+        for expression, code in cases.items():
+            with self.subTest(expression=expression):
+                self.assertEqual(code, self.compiler.compile_in_loop(expression, "body", [], hoisted))
+        self.assertEqual({
+            "self._root.ihdr.width": "root_ihdr_width",
+            "self._root.ihdr.bit_depth": "root_ihdr_bit_depth",
+            "self.header.limit": "header_limit",
+            "self._root.ihdr.height": "root_ihdr_height",
+            "self.header.kind": "header_kind",
+            "self.header.name": "header_name",
+        }, hoisted)
+
+    def test_compile_in_loop_assigned(self):
+        # The chains of a field the loop increments are read again for every item, however the field is reached
+        hoisted = {}
+        code = self.compiler.compile_in_loop("_root.header.limit + header.kind + _root.header", "body", [("header", "limit")], hoisted)
+        self.assertEqual("self._root.header.limit + header_kind + self._root.header", code)
+        self.assertEqual({"self.header.kind": "header_kind"}, hoisted)
+        # Locals do not shadow the fields
+        compiler = Python3ExpressionCompiler("T_", ["a", "a_b"], [])
+        self.assertEqual("a_b_ + self.a_b", compiler.compile_in_loop("a.b + a_b", "c", [], {}))
+
+    def test_get_constant_value(self):
+        self.assertEqual(7, get_constant_value("2 * 3 + 1"))
+        self.assertEqual(258, get_constant_value("0x0102"))
+        self.assertIsNone(get_constant_value("self.len"))
+        self.assertIsNone(get_constant_value("1 +"))
@@ -0,0 +1,52 @@
+import unittest
+import io
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import yaml
+
+from frontend.frontend import Frontend
+from backend.py3.code_generator import Python3CodeGenerator
+from backend.py3.value_code_generator import ValueCodeGenerator
+
+DEFINITIONS_DIR = Path(__file__).parents[3] / "definitions"
+
+
+class TestGenBytesFn(unittest.TestCase):
+    def setUp(self):
+        self.generator = ValueCodeGenerator(ks_helper_instance_name="ks_helper")
+
+    def test_fixed_size(self):
+        self.assertEqual("ks_helper.rand_bytes_lazy(16)", self.generator.gen_bytes_fn(16))
+
+    def test_size_range(self):
+        self.assertEqual("ks_helper.rand_bytes_lazy(-1, min_n_bytes=0, max_n_bytes=8)",
+                         self.generator.gen_bytes_fn(-1, min_n_bytes=0, max_n_bytes=8))
+
+    def test_size_expression(self):
+        self.assertEqual("ks_helper.rand_bytes_lazy(int(self.len))", self.generator.gen_bytes_fn("self.len"))
+
+    def test_empty(self):
+        self.assertEqual("b\"\"", self.generator.gen_bytes_fn(0))
+
+    def test_no_size(self):
+        self.assertRaises(ValueError, self.generator.gen_bytes_fn, -1)
+
+    def test_fixed_size_definition(self):
+        # `animal.ksy` starts with a `size: 16` byte field
+        with open(DEFINITIONS_DIR / "animal.ksy", "r") as f:
+            ir = Frontend(yaml.safe_load(f)).generate_ir()
+        output = io.StringIO()
+        code_gen = Python3CodeGenerator(ir, output, is_entry_point=True)
+        code_gen.logger.disabled = True
+        code_gen.generate_code()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fuzzer_path = os.path.join(tmp_dir, "output_fuzzer.py")
+            with open(fuzzer_path, "w") as f:
+                f.write(output.getvalue())
+            process = subprocess.run([sys.executable, fuzzer_path, "--seed", "1"], capture_output=True)
+        self.assertEqual(0, process.returncode, process.stderr.decode(errors="replace"))
+        self.assertEqual(16 + 24 + 2 + 8 + 4, len(process.stdout))
@@ -1,8 +1,47 @@
 import unittest
-from datastructure.dependency_graph import DependencyGraphNode
+from unittest import mock
+from datastructure.dependency_graph import DependencyGraph, DependencyGraphNode
 
 
 class TestDependencyGraph(unittest.TestCase):
     @staticmethod
     def _gen_nodes(num_nodes: int):
         return list(DependencyGraphNode(i) for i in range(num_nodes))
+
+    def test_linearise_keeps_insertion_order(self):
+        nodes = self._gen_nodes(5)
+        graph = DependencyGraph()
+        graph.add_nodes(nodes)
+        nodes[0].depends_on(nodes[3])
+        result = [node.data for node in graph.linearise_graph()]
+        self.assertEqual([1, 2, 3, 0, 4], result)
+
+    def test_linearise_circular_reference(self):
+        nodes = self._gen_nodes(2)
+        graph = DependencyGraph()
+        graph.add_nodes(nodes)
+        nodes[0].depends_on(nodes[1])
+        nodes[1].depends_on(nodes[0])
+        self.assertRaises(AssertionError, graph.linearise_graph)
+
+    def test_get_dependees(self):
+        nodes = self._gen_nodes(5)
+        graph = DependencyGraph()
+        graph.add_nodes(nodes)
+        nodes[0].depends_on(nodes[3])
+        nodes[1].depends_on(nodes[0])
+        nodes[2].depends_on(nodes[3])
+        self.assertEqual([0, 1, 2], [node.data for node in graph.get_dependees(nodes[3])])
+        self.assertEqual([], graph.get_dependees(nodes[4]))
+
+    def test_get_dependees_with_order(self):
+        nodes = self._gen_nodes(4)
+        graph = DependencyGraph()
+        graph.add_nodes(nodes)
+        nodes[0].depends_on(nodes[2])
+        nodes[1].depends_on(nodes[0])
+        order = graph.get_order()
+        self.assertEqual([2, 0, 1, 3], list(order))
+        with mock.patch.object(graph, "linearise_graph") as linearise_graph:
+            self.assertEqual([[1], [], [0, 1], []], [[dependee.data for dependee in graph.get_dependees(node, order)] for node in nodes])
+            linearise_graph.assert_not_called()
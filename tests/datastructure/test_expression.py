@@ -0,0 +1,86 @@
+import unittest
+from datastructure.expression import (Literal, ArrayLiteral, Name, EnumRef, Attribute, MethodCall, Subscript, UnaryOp, BinaryOp,
+                                      Ternary, tokenize, parse_expression, get_names, get_identifiers,
+                                      get_object_paths)
+
+
+class TestTokenize(unittest.TestCase):
+    def test_tokens(self):
+        tokens = tokenize("_root.a_b<<0x1_0 >= 'x\\n' :: 1.5e3")
+        self.assertEqual(["name", "op", "name", "op", "int", "op", "str", "op", "float"], [token.kind for token in tokens])
+        self.assertEqual(16, tokens[4].value)
+        self.assertEqual("x\\n", tokens[6].value)
+        self.assertEqual(1500.0, tokens[8].value)
+
+    def test_escapes(self):
+        (token, ) = tokenize(r'"a\"b\n\0\101é"')
+        self.assertEqual("a\"b\n\0Aé", token.value)
+
+    def test_leading_zeros(self):
+        self.assertEqual(7, tokenize("007")[0].value)
+
+    def test_invalid_character(self):
+        self.assertRaises(ValueError, tokenize, "a $ b")
+
+
+class TestParseExpression(unittest.TestCase):
+    def test_precedence(self):
+        self.assertEqual(
+            BinaryOp("or", Name("a"), BinaryOp("and", Name("b"), UnaryOp("not", BinaryOp("==", Name("c"), Literal(1))))),
+            parse_expression("a or b and not c == 1"))
+        self.assertEqual(
+            BinaryOp("|", Name("a"), BinaryOp("&", BinaryOp("<<", Name("b"), Literal(2)), Name("c"))),
+            parse_expression("a | b << 2 & c"))
+        self.assertEqual(
+            BinaryOp("-", BinaryOp("+", Name("a"), BinaryOp("*", Name("b"), UnaryOp("-", Name("c")))), Name("d")),
+            parse_expression("a + b * -c - d"))
+
+    def test_parentheses(self):
+        self.assertEqual(BinaryOp("-", Name("a"), BinaryOp("-", Name("b"), Name("c"))), parse_expression("a - (b - c)"))
+
+    def test_ternary(self):
+        self.assertEqual(
+            BinaryOp("/", Name("n"), Ternary(BinaryOp("==", Name("d"), Literal(0)), Literal(100.0), Name("d"))),
+            parse_expression("n / (d == 0 ? 100.0 : d)"))
+        # Right associative
+        self.assertEqual(Ternary(Name("a"), Name("b"), Ternary(Name("c"), Name("d"), Name("e"))),
+                         parse_expression("a ? b : c ? d : e"))
+
+    def test_postfix(self):
+        self.assertEqual(
+            Subscript(MethodCall(Attribute(Name("_root"), "items"), "first", (Literal(1), Name("b"))), Literal(0)),
+            parse_expression("_root.items.first(1, b)[0]"))
+
+    def test_literals(self):
+        self.assertEqual(ArrayLiteral((Literal(137), Literal("P"), Literal(True))), parse_expression("[0x89, 'P', true]"))
+        self.assertEqual(ArrayLiteral(()), parse_expression("[]"))
+
+    def test_enum_ref(self):
+        self.assertEqual(BinaryOp("==", Name("type"), EnumRef(("chunk", "types", "body_0"))),
+                         parse_expression("type == chunk::types::body_0"))
+
+    def test_node_types_not_equal(self):
+        self.assertNotEqual(Literal("a"), Name("a"))
+
+    def test_invalid(self):
+        for expression in ("a +", "(a", "a b", "a ? b", "a.", "[1, 2", ""):
+            with self.subTest(expression=expression):
+                self.assertRaises(ValueError, parse_expression, expression)
+
+    def test_cached(self):
+        self.assertIs(parse_expression("a + b * 2"), parse_expression("a + b * 2"))
+
+
+class TestNames(unittest.TestCase):
+    def test_get_names(self):
+        node = parse_expression("another_content + header.limit[index] + kinds::a + (color_type > 1 ? x : x)")
+        self.assertEqual(["another_content", "header", "index", "color_type", "x"], get_names(node))
+
+    def test_get_identifiers(self):
+        node = parse_expression("_root.header.n_records * 2 + len.to_i() + \"text\"")
+        self.assertCountEqual(["_root", "header", "n_records", "len", "to_i"], get_identifiers(node))
+
+    def test_get_object_paths(self):
+        node = parse_expression("_root.ihdr.width * (_root.ihdr.bit_depth / 8) + _parent.items[_root.ihdr.width] + header.len")
+        self.assertEqual([("_root", "ihdr", "width"), ("_root", "ihdr", "bit_depth"), ("_parent", "items")], get_object_paths(node))
+        self.assertEqual([], get_object_paths(parse_expression("_root")))
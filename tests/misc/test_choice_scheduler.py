@@ -0,0 +1,52 @@
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parents[2] / "misc"))  # Include misc dir to sys.path
+from choice_scheduler import ChoiceScheduler  # noqa:E402
+
+CHOICE_POINTS = {"T.a": ("choice", 2), "T.b.count": ("count", 3), "T.c": ("order", None), "T.d": ("enum", 1)}
+
+
+class TestChoiceScheduler(unittest.TestCase):
+    def test_points(self):
+        # Choice points without a known number of options, or with a single one, get no weights
+        scheduler = ChoiceScheduler(CHOICE_POINTS)
+        self.assertEqual({"T.a": 2, "T.b.count": 3}, scheduler.n_options)
+
+    def test_initial_weights(self):
+        scheduler = ChoiceScheduler(CHOICE_POINTS, exploration=0.5)
+        self.assertEqual({"T.a": [1.0, 1.0], "T.b.count": [1.0, 1.0, 1.0]}, scheduler.weights())
+
+    def test_priors(self):
+        # Priors of choice points without weights, or with another number of options, are left out
+        scheduler = ChoiceScheduler(CHOICE_POINTS, exploration=0.5, priors={"T.a": [0, 2], "T.b.count": [1, 1], "T.c": [1]})
+        self.assertEqual({"T.a": [0.0, 2.0], "T.b.count": [1.0, 1.0, 1.0]}, scheduler.weights())
+
+    def test_update(self):
+        scheduler = ChoiceScheduler(CHOICE_POINTS, exploration=0.5)
+        scheduler.record(0, [("T.a", 0), ("T.c", 1), ("T.b.count", 2)])
+        scheduler.record(1, [("T.a", 0), ("T.a", 0)])
+        scheduler.record(2, [("T.a", 1)])
+        # Only the samples before sample 2 belong to the window, and it found new lines
+        scheduler.update(2, 10)
+        # Every option is credited once per sample, with the share of the samples that picked it
+        self.assertEqual([1.0, 0.0], scheduler.uses["T.a"])
+        self.assertEqual([1.0, 0.0], scheduler.rewards["T.a"])
+        self.assertEqual([0.0, 0.0, 0.5], scheduler.rewards["T.b.count"])
+        # The next window found nothing new
+        scheduler.update(3, 10)
+        self.assertEqual([1.0, 1.0], scheduler.uses["T.a"])
+        self.assertEqual([1.0, 0.0], scheduler.rewards["T.a"])
+        self.assertEqual((2, 1), (scheduler.n_windows, scheduler.n_productive_windows))
+        weights = scheduler.weights()["T.a"]
+        self.assertAlmostEqual(0.5 + 2 / 3, weights[0])
+        self.assertAlmostEqual(0.5 + 1 / 3, weights[1])
+
+    def test_empty_window(self):
+        scheduler = ChoiceScheduler(CHOICE_POINTS)
+        scheduler.update(10, 5)
+        self.assertEqual((0, 0), (scheduler.n_windows, scheduler.lines_executed))
+
+    def test_invalid_exploration(self):
+        self.assertRaises(ValueError, ChoiceScheduler, CHOICE_POINTS, exploration=0)
@@ -0,0 +1,87 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parents[2] / "misc"))  # Include misc dir to sys.path
+from gcov_collector import CoverageCollector  # noqa:E402
+
+TARGET_SOURCE = """\
+#include <stdio.h>
+int main(void) {
+    int c = getchar();
+    if (c == 'a')
+        puts("a");
+    else
+        puts("b");
+    return 0;
+}
+"""
+
+
+@unittest.skipUnless(shutil.which("gcc") and shutil.which("gcov"), "gcc and gcov are required")
+class TestCoverageCollector(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.build_dir = os.path.join(self.tmp_dir.name, "build")
+        os.mkdir(self.build_dir)
+        with open(os.path.join(self.build_dir, "target.c"), "w") as f:
+            f.write(TARGET_SOURCE)
+        subprocess.run(["gcc", "--coverage", "-o", "target", "target.c"], cwd=self.build_dir, check=True)
+        self.csv_path = os.path.join(self.tmp_dir.name, "coverage.csv")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def run_target(self, sample: bytes) -> None:
+        subprocess.run([os.path.join(self.build_dir, "target")], input=sample, stdout=subprocess.DEVNULL, check=True)
+
+    def read_csv(self) -> list[str]:
+        with open(self.csv_path) as f:
+            return f.read().splitlines()
+
+    def test_collect(self):
+        collector = CoverageCollector([self.tmp_dir.name], self.csv_path, every_n=None, every_seconds=None)
+        self.assertEqual(0, collector.collect(0).lines_total)
+        self.run_target(b"a")
+        snapshot = collector.collect(1)
+        self.assertEqual((1, 5, 6), snapshot[:3])
+        self.assertEqual((1, 2), (snapshot.branches_executed, snapshot.branches_total))
+        self.run_target(b"b")
+        snapshot = collector.close()
+        self.assertEqual((6, 6, 2, 2), snapshot[1:])
+        self.assertEqual(["runs,coverage_percent", "0,0.00", "1,83.33", "0,100.00"], self.read_csv())
+
+    def test_lines_kept(self):
+        collector = CoverageCollector([self.build_dir], self.csv_path, every_n=None, every_seconds=None)
+        self.run_target(b"a")
+        collector.collect(1)
+        # Lines stay executed when the data files are reset
+        os.unlink(os.path.join(self.build_dir, "target.gcda"))
+        self.run_target(b"b")
+        self.assertEqual(6, collector.close().lines_executed)
+
+    def test_exclude(self):
+        collector = CoverageCollector([self.build_dir], self.csv_path, exclude=["target.*"])
+        self.run_target(b"a")
+        self.assertEqual(0, collector.close().lines_total)
+
+    def test_every_n(self):
+        collector = CoverageCollector([self.build_dir], self.csv_path, every_n=2, every_seconds=None)
+        for sample in (b"a", b"a", b"b"):
+            self.run_target(sample)
+            collector.on_execution()
+            if collector.pending is not None:
+                collector.pending.result()
+        collector.close()
+        self.assertEqual(["runs,coverage_percent", "2,83.33", "3,100.00"], self.read_csv())
+
+    def test_every_seconds(self):
+        collector = CoverageCollector([self.build_dir], self.csv_path, every_n=None, every_seconds=0)
+        self.run_target(b"a")
+        collector.on_execution()
+        collector.close()
+        self.assertEqual(["runs,coverage_percent", "1,83.33"], self.read_csv())
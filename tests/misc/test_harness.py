@@ -0,0 +1,142 @@
+import json
+import os
+import random
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parents[2] / "misc"))  # Include misc dir to sys.path
+import harness  # noqa:E402
+from choice_scheduler import ChoiceScheduler  # noqa:E402
+
+
+class FakeFuzzer():
+    """Stands in for a generated fuzzer module, sample k of a run is `k` random bytes"""
+
+    @staticmethod
+    def generate(count=None, seed=None):
+        index = 0
+        while count is None or index < count:
+            yield random.Random(f"{seed}/{index}").randbytes(index)
+            index += 1
+
+
+class FakeKsHelper():
+    trace = None
+
+
+class FakeTracedFuzzer(FakeFuzzer):
+    """Records a choice for every sample, the parity of its index"""
+    CHOICE_POINTS = {"T.a": ("choice", 2)}
+    ks_helper = FakeKsHelper()
+
+    @classmethod
+    def generate(cls, count=None, seed=None):
+        for index, sample in enumerate(super().generate(count, seed)):
+            cls.ks_helper.trace.append(("T.a", index % 2))
+            yield sample
+
+
+def python_target(code: str) -> list[str]:
+    return [sys.executable, "-c", code]
+
+
+class TestTarget(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_stdin(self):
+        target = harness.Target(python_target("import sys; sys.exit(len(sys.stdin.buffer.read()))"))
+        self.assertEqual(harness.Execution(7, "ok", 0, 0.0, 0), target.run(7, b"")._replace(duration=0.0))
+        execution = target.run(3, b"abc")
+        self.assertEqual(("failed", 3, 3), (execution.status, execution.returncode, execution.size))
+
+    def test_file(self):
+        target = harness.Target(python_target("import sys; sys.exit(open(sys.argv[1], 'rb').read() != b'abc')") + ["@@"], work_dir=self.tmp_dir.name)
+        self.assertEqual("ok", target.run(0, b"abc").status)
+        self.assertEqual("failed", target.run(1, b"abd").status)
+        self.assertEqual([], os.listdir(self.tmp_dir.name))
+
+    def test_crash(self):
+        execution = harness.Target(python_target("import os, sys; sys.stderr.write('boom'); sys.stderr.flush(); os.abort()")).run(0, b"")
+        self.assertEqual("crash", execution.status)
+        self.assertEqual(b"boom", execution.stderr)
+        self.assertEqual("SIGABRT", execution.to_record()["signal"])
+
+    def test_timeout(self):
+        execution = harness.Target(python_target("import time; time.sleep(30)"), timeout=0.5).run(0, b"")
+        self.assertEqual("timeout", execution.status)
+        self.assertIsNone(execution.returncode)
+        self.assertLess(execution.duration, 10)
+
+    def test_empty_command(self):
+        self.assertRaises(ValueError, harness.Target, [])
+
+
+class TestRun(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def run_harness(self, code: str, count: int, jobs: int):
+        report = harness.Report(self.tmp_dir.name, {"seed": 1234})
+        target = harness.Target(python_target(code))
+        executions = []
+        harness.run(FakeFuzzer, target, report, 1234, count=count, jobs=jobs, batch_size=4,
+                    on_execution=lambda execution, sample: executions.append(execution))
+        return executions, report.close()
+
+    def test_report(self):
+        # The size of a sample is its index: odd samples fail, every fifth sample crashes
+        code = "import os, sys; n = len(sys.stdin.buffer.read()); os.abort() if n % 5 == 4 else sys.exit(n % 2)"
+        executions, summary = self.run_harness(code, 20, 3)
+        self.assertEqual(list(range(20)), [execution.index for execution in executions])
+        self.assertEqual(20, summary["executions"])
+        self.assertEqual({"ok": 8, "failed": 8, "crash": 4, "timeout": 0}, summary["statuses"])
+        self.assertEqual(1234, summary["seed"])
+        with open(os.path.join(self.tmp_dir.name, "summary.json")) as f:
+            self.assertEqual(summary, json.load(f))
+        with open(os.path.join(self.tmp_dir.name, "executions.jsonl")) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([execution.to_record() for execution in executions], records)
+        crash_dir = os.path.join(self.tmp_dir.name, "crashes")
+        self.assertEqual(sorted(f"{i}.{ext}" for i in (4, 9, 14, 19) for ext in ("bin", "stderr")), sorted(os.listdir(crash_dir)))
+        with open(os.path.join(crash_dir, "9.bin"), "rb") as f:
+            self.assertEqual(list(FakeFuzzer.generate(10, seed=1234))[9], f.read())
+
+    def test_duration(self):
+        report = harness.Report(self.tmp_dir.name, {})
+        harness.run(FakeFuzzer, harness.Target(python_target("")), report, 1, duration=1.0, jobs=2, batch_size=2)
+        summary = report.close()
+        self.assertGreater(summary["executions"], 0)
+        self.assertLess(summary["elapsed"], 20)
+
+
+    def test_scheduler(self):
+        scheduler = ChoiceScheduler(FakeTracedFuzzer.CHOICE_POINTS)
+        report = harness.Report(self.tmp_dir.name, {})
+        harness.run(FakeTracedFuzzer, harness.Target(python_target("")), report, 1, count=5, jobs=2, batch_size=2, scheduler=scheduler)
+        report.close()
+        self.assertEqual({i: {("T.a", i % 2)} for i in range(5)}, scheduler.pending)
+        self.assertIsNone(FakeTracedFuzzer.ks_helper.trace)
+        scheduler.update(5, 1)
+        self.assertEqual([3.0 / 5, 2.0 / 5], scheduler.rewards["T.a"])
+
+
+class TestParseArgs(unittest.TestCase):
+    def test_target(self):
+        args = harness.parse_args(["-n", "5", "--", "./readpng", "-v"])
+        self.assertEqual(["./readpng", "-v"], args.target)
+        self.assertEqual(5, args.count)
+
+    def test_invalid(self):
+        for argv in ([], ["-n", "5"], ["--", "./readpng"], ["-n", "5", "-j", "0", "--", "./readpng"],
+                     ["-n", "5", "--feedback", "--", "./readpng"]):
+            with self.assertRaises(SystemExit):
+                harness.parse_args(argv)